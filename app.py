@@ -1,18 +1,23 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, make_response, send_file
+import time
+_INICIO = time.perf_counter()  # medição da inicialização: conta desde o começo das importações
+
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, make_response, send_file, Response, stream_with_context, g, has_app_context, session
 import sqlite3
-from datetime import datetime
+import click
 import re
 import json
 import threading
-import csv
-from io import StringIO
+import random
+import queue
+import tempfile
+import uuid
+import hashlib
+import shutil
+from collections import OrderedDict, deque
+from datetime import date, datetime, timedelta
+from concurrent.futures import Future, ThreadPoolExecutor
 import os
 import sys
-from werkzeug.utils import secure_filename
-import webbrowser
-from threading import Timer
-import subprocess
-from flask import Flask  
 
 
 
@@ -26,44 +31,987 @@ base_path = get_base_path()
 def resource_path(relative_path):
     return os.path.join(base_path, relative_path)
 
+# Banco, documentos e backups ficam ao lado do executável: no PyInstaller o base_path
+# (sys._MEIPASS) é a pasta temporária de extração, apagada ao fechar o programa
+def get_data_path():
+    if getattr(sys, "frozen", False):
+        return os.path.dirname(sys.executable)
+    return base_path
+
+data_path = get_data_path()
+
 app = Flask(
     __name__,
     template_folder=os.path.join(base_path, "templates"),
     static_folder=os.path.join(base_path, "static")
 )
 
-DB_PATH = os.path.join(base_path, "reabilitacao.db")
+DB_PATH = os.path.join(data_path, "reabilitacao.db")
 
 app.secret_key = 'chave_secreta_reabilitacao_2024'
 
-UPLOAD_FOLDER = os.path.join(base_path, "uploads")
+UPLOAD_FOLDER = os.path.join(data_path, "uploads")
 ALLOWED_EXTENSIONS = {'pdf', 'jpg', 'jpeg', 'png', 'doc', 'docx', 'txt'}
+EXTENSOES_VISUALIZACAO = {'pdf', 'jpg', 'jpeg', 'png', 'txt'}  # abertas no navegador com ?inline=1
+EXTENSOES_PREVIA = {'pdf', 'jpg', 'jpeg', 'png'}  # PDF depende do PyMuPDF (opcional); ver extensoes_previa()
+EXTENSOES_COMPRIMIVEIS = {'pdf', 'doc', 'docx', 'txt'}  # imagens já chegam comprimidas
 
 if not os.path.exists(UPLOAD_FOLDER):
     os.makedirs(UPLOAD_FOLDER)
 
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
+app.config['UPLOAD_CHUNK'] = 4 * 1024 * 1024  # tamanho de cada parte do envio em partes
+app.config['UPLOAD_TAMANHO_MAXIMO'] = 1024 * 1024 * 1024  # limite do documento enviado em partes
+app.config['UPLOAD_PARCIAL_VALIDADE'] = 24 * 60 * 60  # segundos até descartar envios abandonados
+app.config['PASTA_PARCIAIS'] = os.path.join(UPLOAD_FOLDER, 'parciais')
+app.config['USE_X_SENDFILE'] = os.environ.get('CLINICA_X_SENDFILE') == '1'  # só com proxy que entenda X-Sendfile (Apache/lighttpd)
+app.config['PREVIA_TAMANHO'] = 320  # pixels do maior lado da miniatura
+app.config['PREVIA_WORKERS'] = 2
+app.config['PREVIA_MAX_AGE'] = 365 * 24 * 60 * 60  # a miniatura de um conteúdo nunca muda
+app.config['COMPRIMIR_DOCUMENTOS'] = os.environ.get('CLINICA_COMPRIMIR_DOCUMENTOS') == '1'
+app.config['COMPRESSAO_NIVEL'] = 6
+app.config['COMPRESSAO_GANHO_MINIMO'] = 0.9  # só guarda comprimido se ficar abaixo de 90% do original
+
+os.makedirs(app.config['PASTA_PARCIAIS'], exist_ok=True)
+app.config['CLIENTES_POR_PAGINA'] = 50
+app.config['CLIENTES_POR_PAGINA_MAX'] = 200
+app.config['CLIENTES_PERIODO_ESTREITO'] = 5000  # fichas no período abaixo das quais a lista parte do índice de datas
+app.config['EXPORTACAO_LOTE'] = 1000
+app.config['IMPORTACAO_LOTE'] = 1000
+app.config['EXPORTACAO_PASTA'] = os.path.join(tempfile.gettempdir(), 'clinica_exportacoes')
+app.config['EXPORTACAO_WORKERS'] = 2
+app.config['EXPORTACAO_IDADE_MAXIMA'] = 60 * 60  # segundos
+app.config['EXPORTACAO_ESPACO_MAXIMO'] = 500 * 1024 * 1024
+
+os.makedirs(app.config['EXPORTACAO_PASTA'], exist_ok=True)
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-_thread_local = threading.local()
+app.config['LOG_QUERY_PLAN'] = os.environ.get('CLINICA_LOG_QUERY_PLAN') == '1'
+app.config['POOL_LEITURA'] = 8
+app.config['POOL_ESCRITA'] = 2
+app.config['POOL_TIMEOUT'] = 30.0
+app.config['POOL_VERIFICAR_APOS'] = 60  # segundos ociosa antes de testar a conexão
+app.config['ESCRITA_LOTE'] = 64  # máximo de unidades por commit em grupo
+app.config['ESCRITA_TIMEOUT'] = 30.0
+app.config['SERVIDOR'] = os.environ.get('CLINICA_SERVIDOR', 'producao')
+app.config['SERVIDOR_THREADS'] = 8
+
+app.config['SQL_LENTA_MS'] = float(os.environ.get('CLINICA_SQL_LENTA_MS', 200))
+app.config['PROFILING_AMOSTRAGEM'] = float(os.environ.get('CLINICA_PROFILING_AMOSTRAGEM', 0))  # fração das requisições
+app.config['PROFILING_HEADER'] = os.environ.get('CLINICA_PROFILING_HEADER') == '1'  # permite X-Profile: 1
+
+app.config['CACHE_CLIENTES_BYTES'] = 32 * 1024 * 1024  # orçamento de memória das páginas de paciente
+
+app.config['API_LIMITE_PADRAO'] = 100
+app.config['API_LIMITE_MAXIMO'] = 10000  # listas grandes saem em streaming, lote a lote
+app.config['API_IDS_MAXIMO'] = 1000
+
+app.config['READMISSAO_DIAS'] = 30  # nova internação até N dias após a alta conta como readmissão
+app.config['RELATORIOS_MESES_PADRAO'] = 12
+app.config['RELATORIOS_MEDICAMENTOS'] = 10  # medicamentos mais usados exibidos por mês
+app.config['RELATORIOS_AQUECER'] = True  # recalcula em segundo plano os meses descartados do cache
+app.config['RELATORIOS_ESPERA'] = 10  # segundos que o relatório espera um recálculo em andamento
+
+def _ler_unidades(texto):
+    """Lê CLINICA_UNIDADES no formato "centro=Centro,norte=Unidade Norte" (identificador=nome)"""
+    unidades = {}
+    for item in filter(None, (parte.strip() for parte in texto.split(','))):
+        identificador, _, nome = (parte.strip() for parte in item.partition('='))
+        if not re.fullmatch(r'[a-z0-9][a-z0-9-]*', identificador):
+            raise ValueError(f'Identificador de unidade inválido: {identificador!r}')
+        unidades[identificador] = nome or identificador
+    return unidades
+
+# Cada unidade da clínica tem o próprio banco (shard) e pasta de documentos; a unidade padrão usa
+# DB_PATH e UPLOAD_FOLDER, então uma instalação de unidade única continua exatamente como antes
+app.config['UNIDADES'] = _ler_unidades(os.environ.get('CLINICA_UNIDADES', ''))
+app.config['UNIDADE_PADRAO'] = os.environ.get('CLINICA_UNIDADE_PADRAO') or next(iter(app.config['UNIDADES']), 'principal')
+app.config['UNIDADES_PASTA'] = os.path.join(data_path, 'unidades')
+app.config['UNIDADES_WORKERS'] = 8  # consultas simultâneas nas leituras entre unidades
+app.config['UNIDADES_BUSCA_LIMITE'] = 50  # resultados da busca combinada
+
+app.config['INICIALIZACAO_ESPERA'] = 60  # segundos que o lançador espera o /pronto antes de abrir o navegador assim mesmo
+
+app.config['BACKUP_PASTA'] = os.environ.get('CLINICA_BACKUP_PASTA') or os.path.join(data_path, 'backups')
+app.config['BACKUP_INTERVALO'] = 6 * 60 * 60  # segundos entre cópias de segurança
+app.config['BACKUP_MANTER_RECENTES'] = 4  # rotação: as N cópias mais recentes,
+app.config['BACKUP_MANTER_DIARIOS'] = 7  # a última de cada um dos últimos N dias
+app.config['BACKUP_MANTER_SEMANAIS'] = 4  # e a última de cada uma das últimas N semanas
+app.config['MANUTENCAO_AGENDADA'] = os.environ.get('CLINICA_MANUTENCAO', '1') == '1'
+app.config['MANUTENCAO_VERIFICAR'] = 30  # segundos entre verificações do agendador
+app.config['MANUTENCAO_OCIOSO'] = 120  # segundos sem requisições para o sistema contar como ocioso
+app.config['MANUTENCAO_ESPERA_MS'] = 2000  # busy_timeout do checkpoint e do VACUUM; se ocupado, tenta depois
+app.config['MANUTENCAO_CHECKPOINT_INTERVALO'] = 15 * 60
+app.config['MANUTENCAO_OTIMIZAR_INTERVALO'] = 60 * 60
+app.config['MANUTENCAO_ANALYZE_INTERVALO'] = 7 * 24 * 60 * 60
+app.config['MANUTENCAO_VACUO_INTERVALO'] = 24 * 60 * 60
+app.config['MANUTENCAO_VACUO_PAGINAS'] = 25000  # páginas liberadas por execução do vácuo incremental
+
+def _registrar_tempo_sql(duracao):
+    if has_app_context() and 'sql_tempo' in g:
+        g.sql_tempo += duracao
+
+def _contar_sql(sql):
+    # Callback de set_trace_callback: inclui comandos disparados por gatilhos
+    if has_app_context() and 'sql_comandos' in g:
+        g.sql_comandos += 1
+
+class CursorClinica(sqlite3.Cursor):
+    """Cursor que mede o tempo das consultas e registra o EXPLAIN QUERY PLAN quando LOG_QUERY_PLAN está ativo.
+    
+    O SQLite executa a consulta aos poucos, conforme as linhas são lidas: o tempo de cada comando soma o
+    execute() e os fetch*/iteração seguintes, e a consulta lenta é registrada quando o comando termina.
+    """
+    _sql = None
+    _duracao = 0.0
+    
+    def _medir(self, inicio):
+        duracao = time.perf_counter() - inicio
+        _registrar_tempo_sql(duracao)
+        self._duracao += duracao
+    
+    def _concluir(self):
+        """Fecha a medição do comando atual: linhas esgotadas, novo execute, close ou cursor descartado"""
+        if self._sql is not None and self._duracao * 1000 >= app.config['SQL_LENTA_MS']:
+            app.logger.warning('Consulta lenta (%.1f ms): %s', self._duracao * 1000, ' '.join(self._sql.split()))
+        self._sql = None
+        self._duracao = 0.0
+    
+    def _executar(self, metodo, sql, parametros):
+        self._concluir()
+        self._sql = sql
+        inicio = time.perf_counter()
+        try:
+            return metodo(sql, parametros)
+        finally:
+            self._medir(inicio)
+            if self.description is None:  # sem linhas para ler (INSERT, UPDATE, DDL...)
+                self._concluir()
+    
+    def execute(self, sql, parameters=()):
+        if app.config['LOG_QUERY_PLAN'] and sql.lstrip().upper().startswith(('SELECT', 'UPDATE', 'DELETE')):
+            try:
+                plano = self.connection.execute(f'EXPLAIN QUERY PLAN {sql}', parameters).fetchall()
+                app.logger.info('Plano de consulta:\n%s\n%s', ' '.join(sql.split()),
+                                '\n'.join(f'  {row[3]}' for row in plano))
+            except sqlite3.Error:
+                pass
+        return self._executar(super().execute, sql, parameters)
+    
+    def executemany(self, sql, seq_of_parameters):
+        return self._executar(super().executemany, sql, seq_of_parameters)
+    
+    def fetchone(self):
+        inicio = time.perf_counter()
+        try:
+            linha = super().fetchone()
+        finally:
+            self._medir(inicio)
+        if linha is None:
+            self._concluir()
+        return linha
+    
+    def fetchmany(self, size=None):
+        size = self.arraysize if size is None else size
+        inicio = time.perf_counter()
+        try:
+            linhas = super().fetchmany(size)
+        finally:
+            self._medir(inicio)
+        if len(linhas) < size:
+            self._concluir()
+        return linhas
+    
+    def fetchall(self):
+        inicio = time.perf_counter()
+        try:
+            return super().fetchall()
+        finally:
+            self._medir(inicio)
+            self._concluir()
+    
+    def __iter__(self):
+        return self
+    
+    def __next__(self):
+        inicio = time.perf_counter()
+        esgotado = False
+        try:
+            return super().__next__()
+        except StopIteration:
+            esgotado = True
+            raise
+        finally:
+            self._medir(inicio)
+            if esgotado:
+                self._concluir()
+    
+    def close(self):
+        self._concluir()
+        super().close()
+    
+    def __del__(self):
+        self._concluir()
+
+class ConexaoClinica(sqlite3.Connection):
+    def cursor(self, factory=CursorClinica):
+        return super().cursor(factory)
+
+    # Os atalhos da conexão criariam um sqlite3.Cursor comum, fora da medição
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+def _conectar(caminho, somente_leitura=False):
+    """Abre uma conexão SQLite com configurações otimizadas para evitar locks"""
+    conn = sqlite3.connect(caminho, timeout=30.0, check_same_thread=False, factory=ConexaoClinica)
+    conn.execute('PRAGMA auto_vacuum = INCREMENTAL')  # só vale em banco novo, antes do WAL e da primeira tabela
+    conn.execute('PRAGMA journal_mode = WAL')  
+    conn.execute('PRAGMA synchronous = NORMAL')
+    conn.execute('PRAGMA cache_size = -64000')  
+    conn.execute('PRAGMA temp_store = MEMORY')
+    conn.execute('PRAGMA foreign_keys = ON')  # ON DELETE CASCADE impede fichas órfãs
+    if somente_leitura:
+        conn.execute('PRAGMA query_only = ON')
+    conn.row_factory = sqlite3.Row
+    conn.set_trace_callback(_contar_sql)
+    return conn
+
+class PoolConexoes:
+    """Pool limitado de conexões SQLite, com verificação de saúde e métricas de uso"""
+    def __init__(self, caminho, tamanho, somente_leitura=False):
+        self.caminho = caminho
+        self.tamanho = tamanho
+        self.somente_leitura = somente_leitura
+        self._livres = queue.LifoQueue()
+        self._vagas = threading.BoundedSemaphore(tamanho)
+        self._lock = threading.Lock()
+        self.criadas = 0
+        self.em_uso = 0
+        self.aquisicoes = 0
+        self.esperas = 0
+        self.tempo_espera = 0.0
+        self.falhas_saude = 0
+    
+    def adquirir(self, timeout=30.0):
+        inicio = time.perf_counter()
+        if not self._vagas.acquire(blocking=False):
+            with self._lock:
+                self.esperas += 1
+            if not self._vagas.acquire(timeout=timeout):
+                raise RuntimeError('Nenhuma conexão disponível com o banco de dados. Tente novamente.')
+        
+        try:
+            conn = None
+            while conn is None:
+                try:
+                    conn, devolvida_em = self._livres.get_nowait()
+                except queue.Empty:
+                    conn = _conectar(self.caminho, self.somente_leitura)
+                    with self._lock:
+                        self.criadas += 1
+                    break
+                if time.monotonic() - devolvida_em > app.config['POOL_VERIFICAR_APOS'] and not self._saudavel(conn):
+                    conn = None
+        except Exception:
+            self._vagas.release()
+            raise
+        
+        with self._lock:
+            self.em_uso += 1
+            self.aquisicoes += 1
+            self.tempo_espera += time.perf_counter() - inicio
+        return conn
+    
+    def _saudavel(self, conn):
+        try:
+            conn.execute('SELECT 1').fetchone()
+            return True
+        except sqlite3.Error:
+            with self._lock:
+                self.falhas_saude += 1
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+            return False
+    
+    def devolver(self, conn):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            self._livres.put((conn, time.monotonic()))
+        except sqlite3.Error:
+            conn.close()
+        finally:
+            with self._lock:
+                self.em_uso -= 1
+            self._vagas.release()
+    
+    def metricas(self):
+        with self._lock:
+            return {
+                'tamanho': self.tamanho,
+                'em_uso': self.em_uso,
+                'livres': self._livres.qsize(),
+                'criadas': self.criadas,
+                'aquisicoes': self.aquisicoes,
+                'esperas': self.esperas,
+                'tempo_espera_medio_ms': round(self.tempo_espera / self.aquisicoes * 1000, 3) if self.aquisicoes else 0.0,
+                'falhas_saude': self.falhas_saude,
+            }
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def obter_pool(caminho, escrita):
+    with _pools_lock:
+        chave = (caminho, escrita)
+        if chave not in _pools:
+            tamanho = app.config['POOL_ESCRITA'] if escrita else app.config['POOL_LEITURA']
+            _pools[chave] = PoolConexoes(caminho, tamanho, somente_leitura=not escrita)
+        return _pools[chave]
+
+# Etapas da inicialização, em ms desde o começo das importações (expostas em /pronto e /saude)
+_etapas_inicializacao = {}
+_pronto = threading.Event()  # unidade padrão migrada: o sistema já pode atender
+
+def marcar_etapa(nome):
+    decorrido = round((time.perf_counter() - _INICIO) * 1000, 1)
+    _etapas_inicializacao[nome] = decorrido
+    app.logger.info('Inicialização: %s em %.1f ms', nome, decorrido)
+
+def listar_unidades():
+    """Unidades configuradas ({identificador: nome}); sem configuração, só a unidade padrão"""
+    return app.config['UNIDADES'] or {app.config['UNIDADE_PADRAO']: 'Centro de Reabilitação'}
+
+def unidade_atual():
+    if has_app_context():
+        return g.get('unidade') or app.config['UNIDADE_PADRAO']
+    return app.config['UNIDADE_PADRAO']
+
+def caminho_unidade(unidade):
+    if unidade == app.config['UNIDADE_PADRAO']:
+        return DB_PATH
+    return os.path.join(app.config['UNIDADES_PASTA'], unidade, 'reabilitacao.db')
+
+def pasta_uploads(unidade=None):
+    unidade = unidade or unidade_atual()
+    if unidade == app.config['UNIDADE_PADRAO']:
+        return app.config['UPLOAD_FOLDER']
+    return os.path.join(app.config['UNIDADES_PASTA'], unidade, 'uploads')
+
+def banco_atual():
+    """Banco (shard) da unidade escolhida para a requisição em curso"""
+    return caminho_unidade(unidade_atual())
+
+def rotulo_banco(caminho):
+    """Nome do banco nas métricas: o identificador da unidade (todos os shards se chamam reabilitacao.db)"""
+    for unidade in listar_unidades():
+        if caminho_unidade(unidade) == caminho:
+            return unidade
+    return os.path.basename(caminho)
+
+_unidades_prontas = set()
+_unidades_lock = threading.Lock()
+
+def preparar_unidade(unidade):
+    """Cria as pastas e aplica o esquema/migrações no banco da unidade, uma vez por processo"""
+    caminho = caminho_unidade(unidade)
+    if caminho in _unidades_prontas:
+        return
+    with _unidades_lock:
+        if caminho in _unidades_prontas:
+            return
+        os.makedirs(os.path.dirname(caminho), exist_ok=True)
+        os.makedirs(pasta_uploads(unidade), exist_ok=True)
+        with app.app_context():
+            g.unidade = unidade
+            init_db()
+        _unidades_prontas.add(caminho)
+        if unidade == app.config['UNIDADE_PADRAO']:
+            _pronto.set()
+
+_opcao_unidade = click.option('--unidade', help='identificador da unidade (padrão: todas)')
+
+def _unidades_comando(unidade):
+    if unidade is None:
+        return list(listar_unidades())
+    if unidade not in listar_unidades():
+        raise click.BadParameter(f'unidade desconhecida: {unidade}', param_hint='--unidade')
+    return [unidade]
+
+class PorUnidade:
+    """Mantém uma instância por unidade e delega para a da unidade da requisição atual"""
+    def __init__(self, fabrica):
+        self._fabrica = fabrica
+        self._instancias = {}
+        self._lock = threading.Lock()
+    
+    def da_unidade(self, unidade):
+        caminho = caminho_unidade(unidade)
+        with self._lock:
+            if caminho not in self._instancias:
+                self._instancias[caminho] = self._fabrica(unidade)
+            return self._instancias[caminho]
+    
+    def atual(self):
+        return self.da_unidade(unidade_atual())
+    
+    def __getattr__(self, nome):
+        return getattr(self.atual(), nome)
+
+_unidades_pool = ThreadPoolExecutor(max_workers=app.config['UNIDADES_WORKERS'], thread_name_prefix='unidade')
+
+def consultar_unidades(consulta):
+    """Executa consulta(cursor) no banco de cada unidade em paralelo; devolve {unidade: resultado}.
+    
+    Cada unidade usa o próprio pool de leitura, então a fila de escrita de uma não atrasa as outras.
+    """
+    def executar(unidade):
+        preparar_unidade(unidade)
+        pool = obter_pool(caminho_unidade(unidade), False)
+        conn = pool.adquirir(timeout=app.config['POOL_TIMEOUT'])
+        try:
+            return consulta(conn.cursor())
+        finally:
+            pool.devolver(conn)
+    
+    futuros = {unidade: _unidades_pool.submit(executar, unidade) for unidade in listar_unidades()}
+    return {unidade: futuro.result() for unidade, futuro in futuros.items()}
+
+def get_db(escrita=False):
+    """Obtém uma conexão do pool para o contexto atual; devolvida automaticamente no teardown.
+    
+    Conexões de leitura são abertas com query_only, então rotas que gravam devem pedir escrita=True.
+    """
+    atributo = 'db_escrita' if escrita else 'db_leitura'
+    conn = getattr(g, atributo, None)
+    if conn is None:
+        pool = obter_pool(banco_atual(), escrita)
+        conn = pool.adquirir(timeout=app.config['POOL_TIMEOUT'])
+        setattr(g, atributo, conn)
+        g.setdefault('db_pools', []).append((pool, conn))
+    return conn
+
+@app.teardown_appcontext
+def devolver_conexoes(exc):
+    for pool, conn in g.pop('db_pools', []):
+        pool.devolver(conn)
+
+# Limites (em segundos) dos buckets do histograma de latência por rota
+BUCKETS_LATENCIA = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class MetricasRotas:
+    """Histograma de latência e contagem/tempo de SQL por rota, no formato do Prometheus"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rotas = {}
+    
+    def registrar(self, rota, duracao, sql_comandos, sql_tempo):
+        with self._lock:
+            dados = self._rotas.setdefault(rota, {
+                'buckets': [0] * len(BUCKETS_LATENCIA),
+                'quantidade': 0,
+                'soma': 0.0,
+                'sql_comandos': 0,
+                'sql_tempo': 0.0,
+            })
+            for i, limite in enumerate(BUCKETS_LATENCIA):
+                if duracao <= limite:
+                    dados['buckets'][i] += 1
+            dados['quantidade'] += 1
+            dados['soma'] += duracao
+            dados['sql_comandos'] += sql_comandos
+            dados['sql_tempo'] += sql_tempo
+    
+    def exportar(self):
+        linhas = [
+            '# HELP clinica_requisicao_duracao_segundos Latência das requisições por rota.',
+            '# TYPE clinica_requisicao_duracao_segundos histogram',
+        ]
+        with self._lock:
+            rotas = {rota: dict(dados, buckets=list(dados['buckets'])) for rota, dados in self._rotas.items()}
+        for rota, dados in sorted(rotas.items()):
+            for limite, quantidade in zip(BUCKETS_LATENCIA, dados['buckets']):
+                linhas.append(f'clinica_requisicao_duracao_segundos_bucket{{rota="{rota}",le="{limite}"}} {quantidade}')
+            linhas.append(f'clinica_requisicao_duracao_segundos_bucket{{rota="{rota}",le="+Inf"}} {dados["quantidade"]}')
+            linhas.append(f'clinica_requisicao_duracao_segundos_sum{{rota="{rota}"}} {dados["soma"]:.6f}')
+            linhas.append(f'clinica_requisicao_duracao_segundos_count{{rota="{rota}"}} {dados["quantidade"]}')
+        linhas += [
+            '# HELP clinica_sql_comandos_total Comandos SQL executados por rota.',
+            '# TYPE clinica_sql_comandos_total counter',
+        ]
+        linhas += [f'clinica_sql_comandos_total{{rota="{rota}"}} {dados["sql_comandos"]}' for rota, dados in sorted(rotas.items())]
+        linhas += [
+            '# HELP clinica_sql_duracao_segundos_total Tempo gasto em SQL por rota.',
+            '# TYPE clinica_sql_duracao_segundos_total counter',
+        ]
+        linhas += [f'clinica_sql_duracao_segundos_total{{rota="{rota}"}} {dados["sql_tempo"]:.6f}' for rota, dados in sorted(rotas.items())]
+        return linhas
+
+metricas_rotas = MetricasRotas()
+
+@app.before_request
+def escolher_unidade():
+    """Define a unidade (shard) da requisição: cabeçalho X-Clinica-Unidade, subdomínio ou sessão"""
+    if request.endpoint in ('pronto', 'static'):
+        return
+    unidades = listar_unidades()
+    unidade = request.headers.get('X-Clinica-Unidade')
+    if unidade is not None and unidade not in unidades:
+        return 'Unidade desconhecida', 404
+    if unidade is None:
+        subdominio = request.host.split(':')[0].split('.')[0]
+        unidade = subdominio if subdominio in unidades else session.get('unidade')
+    if unidade not in unidades:
+        unidade = app.config['UNIDADE_PADRAO']
+    g.unidade = unidade
+    preparar_unidade(unidade)
+
+@app.route('/unidade/<unidade>')
+def trocar_unidade(unidade):
+    if unidade not in listar_unidades():
+        flash('Unidade não encontrada!', 'error')
+        return redirect(url_for('index'))
+    session['unidade'] = unidade
+    proximo = request.args.get('proximo', '')
+    # Só caminhos locais, para o parâmetro não virar um redirecionamento aberto
+    if not proximo.startswith('/') or proximo.startswith('//'):
+        proximo = url_for('index')
+    return redirect(proximo)
+
+@app.context_processor
+def dados_unidade():
+    unidades = listar_unidades()
+    return {'unidades': unidades, 'unidade_atual': unidade_atual(), 'nome_unidade': unidades.get(unidade_atual())}
+
+@app.before_request
+def iniciar_medicao():
+    g.inicio_requisicao = time.perf_counter()
+    g.sql_comandos = 0
+    g.sql_tempo = 0.0
+    # Sondas de monitoramento não contam como uso para o agendador de manutenção
+    if request.endpoint not in ('metrics', 'saude', 'pronto'):
+        manutencao.registrar_atividade()
+    
+    amostrar = app.config['PROFILING_AMOSTRAGEM'] and random.random() < app.config['PROFILING_AMOSTRAGEM']
+    if amostrar or (app.config['PROFILING_HEADER'] and request.headers.get('X-Profile') == '1'):
+        import cProfile
+        g.perfil = cProfile.Profile()
+        g.perfil.enable()
+
+@app.after_request
+def registrar_medicao(response):
+    perfil = g.pop('perfil', None)
+    if perfil is not None:
+        perfil.disable()
+        import pstats
+        from io import StringIO
+        saida = StringIO()
+        pstats.Stats(perfil, stream=saida).sort_stats('cumulative').print_stats(25)
+        app.logger.info('Perfil de %s %s:\n%s', request.method, request.path, saida.getvalue())
+    
+    if 'inicio_requisicao' in g:
+        duracao = time.perf_counter() - g.inicio_requisicao
+        metricas_rotas.registrar(request.endpoint or 'desconhecida', duracao, g.sql_comandos, g.sql_tempo)
+        response.headers['X-SQL-Count'] = str(g.sql_comandos)
+        response.headers['Server-Timing'] = f'app;dur={duracao * 1000:.1f}, sql;dur={g.sql_tempo * 1000:.1f}'
+    return response
+
+class EscritorSerial:
+    """Fila de escrita com uma única thread gravadora.
+    
+    As rotas enviam unidades de escrita (funções que recebem um cursor) e aguardam o resultado
+    em um Future. A thread agrupa as unidades pendentes em uma só transação (group commit);
+    cada unidade roda em um SAVEPOINT próprio, então o erro de uma não desfaz as demais.
+    """
+    def __init__(self, caminho):
+        self.caminho = caminho
+        self._fila = queue.Queue()
+        self._lock = threading.Lock()
+        self._latencias = deque(maxlen=1000)
+        self.unidades = 0
+        self.lotes = 0
+        self._thread = threading.Thread(target=self._executar, name='escritor-sqlite', daemon=True)
+        self._thread.start()
+    
+    def enviar(self, unidade):
+        futuro = Future()
+        self._fila.put((unidade, futuro, time.perf_counter()))
+        return futuro
+    
+    def _executar(self):
+        conn = _conectar(self.caminho)
+        cursor = conn.cursor()
+        while True:
+            lote = [self._fila.get()]
+            while len(lote) < app.config['ESCRITA_LOTE']:
+                try:
+                    lote.append(self._fila.get_nowait())
+                except queue.Empty:
+                    break
+            
+            resultados = []
+            try:
+                cursor.execute('BEGIN IMMEDIATE')
+                for unidade, futuro, _ in lote:
+                    cursor.execute('SAVEPOINT unidade')
+                    try:
+                        resultados.append((futuro, unidade(cursor), None))
+                        cursor.execute('RELEASE unidade')
+                    except Exception as e:
+                        cursor.execute('ROLLBACK TO unidade')
+                        cursor.execute('RELEASE unidade')
+                        resultados.append((futuro, None, e))
+                conn.commit()
+            except Exception as e:
+                if conn.in_transaction:
+                    conn.rollback()
+                resultados = [(futuro, None, e) for _, futuro, _ in lote]
+            
+            agora = time.perf_counter()
+            with self._lock:
+                self.lotes += 1
+                self.unidades += len(lote)
+                self._latencias.extend(agora - enviado_em for _, _, enviado_em in lote)
+            
+            for futuro, resultado, erro in resultados:
+                if erro is not None:
+                    futuro.set_exception(erro)
+                else:
+                    futuro.set_result(resultado)
+    
+    def metricas(self):
+        with self._lock:
+            latencias = sorted(self._latencias)
+            unidades, lotes = self.unidades, self.lotes
+        
+        def percentil(p):
+            if not latencias:
+                return 0.0
+            return round(latencias[min(len(latencias) - 1, int(len(latencias) * p))] * 1000, 3)
+        
+        return {
+            'fila': self._fila.qsize(),
+            'unidades': unidades,
+            'lotes': lotes,
+            'unidades_por_lote': round(unidades / lotes, 2) if lotes else 0.0,
+            'latencia_p50_ms': percentil(0.50),
+            'latencia_p99_ms': percentil(0.99),
+        }
+
+_escritores = {}
+
+def obter_escritor(caminho):
+    with _pools_lock:
+        if caminho not in _escritores:
+            _escritores[caminho] = EscritorSerial(caminho)
+        return _escritores[caminho]
+
+def executar_escrita(unidade, banco=None):
+    """Envia uma unidade de escrita para a fila do banco (o da requisição, por padrão) e devolve seu resultado"""
+    escritor = obter_escritor(banco or banco_atual())
+    return escritor.enviar(unidade).result(timeout=app.config['ESCRITA_TIMEOUT'])
+
+@app.route('/metrics')
+def metrics():
+    if request.remote_addr not in ('127.0.0.1', '::1'):
+        return 'Acesso permitido apenas localmente', 403
+    
+    linhas = metricas_rotas.exportar()
+    linhas += [
+        '# HELP clinica_pool_conexoes Uso dos pools de conexões SQLite.',
+        '# TYPE clinica_pool_conexoes gauge',
+    ]
+    with _pools_lock:
+        pools = {(rotulo_banco(caminho), 'escrita' if escrita else 'leitura'): pool.metricas()
+                 for (caminho, escrita), pool in _pools.items()}
+        escritores = {rotulo_banco(caminho): escritor.metricas() for caminho, escritor in _escritores.items()}
+    for (banco, tipo), dados in sorted(pools.items()):
+        for estado in ('em_uso', 'livres', 'tamanho'):
+            linhas.append(f'clinica_pool_conexoes{{banco="{banco}",pool="{tipo}",estado="{estado}"}} {dados[estado]}')
+    linhas += [
+        '# HELP clinica_escrita_fila Unidades aguardando na fila de escrita.',
+        '# TYPE clinica_escrita_fila gauge',
+    ]
+    linhas += [f'clinica_escrita_fila{{banco="{banco}"}} {dados["fila"]}' for banco, dados in sorted(escritores.items())]
+    linhas += [
+        '# HELP clinica_escrita_latencia_segundos Latência das escritas (janela das últimas 1000).',
+        '# TYPE clinica_escrita_latencia_segundos gauge',
+    ]
+    for banco, dados in sorted(escritores.items()):
+        linhas.append(f'clinica_escrita_latencia_segundos{{banco="{banco}",quantil="0.5"}} {dados["latencia_p50_ms"] / 1000}')
+        linhas.append(f'clinica_escrita_latencia_segundos{{banco="{banco}",quantil="0.99"}} {dados["latencia_p99_ms"] / 1000}')
+    
+    unidades = manutencao.metricas()['unidades']
+    linhas += [
+        '# HELP clinica_manutencao_duracao_segundos Duração da última execução de cada tarefa de manutenção.',
+        '# TYPE clinica_manutencao_duracao_segundos gauge',
+    ]
+    for unidade, dados in sorted(unidades.items()):
+        linhas += [f'clinica_manutencao_duracao_segundos{{unidade="{unidade}",tarefa="{tarefa}"}} {registro["duracao_s"]}'
+                   for tarefa, registro in sorted(dados['ultimas'].items())]
+    linhas += [
+        '# HELP clinica_manutencao_execucoes_total Execuções das tarefas de manutenção.',
+        '# TYPE clinica_manutencao_execucoes_total counter',
+    ]
+    for unidade, dados in sorted(unidades.items()):
+        for tarefa, totais in sorted(dados['totais'].items()):
+            rotulos = f'unidade="{unidade}",tarefa="{tarefa}"'
+            linhas.append(f'clinica_manutencao_execucoes_total{{{rotulos},resultado="ok"}} {totais["execucoes"] - totais["erros"]}')
+            linhas.append(f'clinica_manutencao_execucoes_total{{{rotulos},resultado="erro"}} {totais["erros"]}')
+    for nome, ajuda, tipo, valor in (
+        ('clinica_wal_recuperado_bytes_total', 'Espaço do WAL devolvido pelos checkpoints.', 'counter',
+         lambda dados: dados['totais'].get('checkpoint', {}).get('wal_recuperado', 0)),
+        ('clinica_wal_bytes', 'Tamanho atual do arquivo WAL.', 'gauge', lambda dados: dados['wal_bytes']),
+        ('clinica_backups', 'Cópias de segurança mantidas na pasta de backup.', 'gauge', lambda dados: dados['backups']),
+    ):
+        linhas += [f'# HELP {nome} {ajuda}', f'# TYPE {nome} {tipo}']
+        linhas += [f'{nome}{{unidade="{unidade}"}} {valor(dados)}' for unidade, dados in sorted(unidades.items())]
+    
+    return Response('\n'.join(linhas) + '\n', mimetype='text/plain; version=0.0.4')
+
+@app.route('/saude')
+def saude():
+    try:
+        get_db().execute('SELECT 1').fetchone()
+        ok = True
+    except Exception:
+        ok = False
+    with _pools_lock:
+        pools = {
+            f"{rotulo_banco(caminho)}:{'escrita' if escrita else 'leitura'}": pool.metricas()
+            for (caminho, escrita), pool in _pools.items()
+        }
+    with _pools_lock:
+        escritores = {rotulo_banco(caminho): escritor.metricas() for caminho, escritor in _escritores.items()}
+    return jsonify({'status': 'ok' if ok else 'erro', 'pools': pools, 'escrita': escritores,
+                    'cache_paginas': cache_paginas.metricas(),
+                    'cache_relatorios': cache_relatorios.metricas(),
+                    'manutencao': manutencao.metricas(),
+                    'inicializacao': _etapas_inicializacao}), 200 if ok else 503
+
+@app.route('/pronto')
+def pronto():
+    """Sonda de prontidão: 503 enquanto o banco da unidade padrão é criado ou migrado"""
+    return jsonify({'pronto': _pronto.is_set(), 'etapas': _etapas_inicializacao}), 200 if _pronto.is_set() else 503
+
+# Pesos do bm25 por coluna de busca_clientes: nome, cpf, email, telefone, observacoes, medicamentos, familiares
+PESOS_BUSCA = '10.0, 10.0, 5.0, 5.0, 1.0, 1.0, 2.0'
+
+_INDEXAR_CLIENTES = '''
+    INSERT INTO busca_clientes (rowid, nome, cpf, email, telefone, observacoes, medicamentos, familiares)
+    SELECT c.id, c.nome, c.cpf, c.email, c.telefone,
+           (SELECT group_concat(f.observacoes, ' ') FROM fichas f WHERE f.cliente_id = c.id),
+           (SELECT group_concat(m.nome, ' ') FROM medicamentos m JOIN fichas f ON f.id = m.ficha_id
+             WHERE f.cliente_id = c.id),
+           (SELECT group_concat(fa.nome, ' ') FROM familiares fa WHERE fa.cliente_id = c.id)
+    FROM clientes c
+'''
+
+# Recalcula a linha de busca de um cliente a partir das tabelas de origem.
+# {cliente} é a expressão SQL (dentro do gatilho) que resolve o id do cliente.
+_REINDEXAR_CLIENTE = (
+    'DELETE FROM busca_clientes WHERE rowid = {cliente};'
+    + _INDEXAR_CLIENTES + ' WHERE c.id = {cliente};'
+)
+
+def _migracao_busca(cursor):
+    cursor.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS busca_clientes USING fts5(
+            nome, cpf, email, telefone, observacoes, medicamentos, familiares,
+            tokenize = 'unicode61 remove_diacritics 2'
+        )
+    ''')
+    
+    gatilhos = {
+        'clientes': ('NEW.id', 'OLD.id'),
+        'fichas': ('NEW.cliente_id', 'OLD.cliente_id'),
+        'familiares': ('NEW.cliente_id', 'OLD.cliente_id'),
+        'medicamentos': ('(SELECT cliente_id FROM fichas WHERE id = NEW.ficha_id)',
+                         '(SELECT cliente_id FROM fichas WHERE id = OLD.ficha_id)'),
+    }
+    for tabela, (novo, antigo) in gatilhos.items():
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS busca_{tabela}_ai AFTER INSERT ON {tabela} BEGIN
+                {_REINDEXAR_CLIENTE.format(cliente=novo)}
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS busca_{tabela}_au AFTER UPDATE ON {tabela} BEGIN
+                {_REINDEXAR_CLIENTE.format(cliente=antigo)}
+                {_REINDEXAR_CLIENTE.format(cliente=novo)}
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS busca_{tabela}_ad AFTER DELETE ON {tabela} BEGIN
+                {_REINDEXAR_CLIENTE.format(cliente=antigo)}
+            END
+        ''')
+    
+    cursor.execute('DELETE FROM busca_clientes')
+    cursor.execute(_INDEXAR_CLIENTES)
+
+_RECALCULAR_ESTATISTICAS = '''
+    INSERT OR REPLACE INTO estatisticas (id, total_clientes, fichas_ativas, fichas_finalizadas)
+    SELECT 1,
+           (SELECT COUNT(*) FROM clientes),
+           (SELECT COUNT(*) FROM fichas WHERE data_saida IS NULL AND cliente_id IN (SELECT id FROM clientes)),
+           (SELECT COUNT(*) FROM fichas WHERE data_saida IS NOT NULL AND cliente_id IN (SELECT id FROM clientes))
+'''
+
+# Cada migração é aplicada uma única vez, na ordem, e registrada em PRAGMA user_version.
+# Os passos podem ser uma lista de comandos SQL ou uma função que recebe o cursor.
+def _migracao_datas(cursor):
+    """Reescreve as datas das fichas em ISO e cria as colunas inteiras (geradas) com seus índices"""
+    cursor.execute('SELECT id, data_entrada, data_saida, created_at FROM fichas')
+    corrigidas = []
+    for ficha_id, data_entrada, data_saida, created_at in cursor.fetchall():
+        novas = []
+        for valor in (data_entrada, data_saida):
+            try:
+                novas.append(normalizar_data(valor) if valor else None)
+            except ValueError:
+                app.logger.warning('Ficha %s com data não reconhecida mantida como está: %r', ficha_id, valor)
+                novas.append(valor)
+        try:
+            criado = datetime.fromisoformat((created_at or '').strip()).strftime('%Y-%m-%d %H:%M:%S')
+        except ValueError:
+            criado = created_at
+        if novas != [data_entrada, data_saida] or criado != created_at:
+            corrigidas.append((novas[0], novas[1], criado, ficha_id))
+    cursor.executemany('UPDATE fichas SET data_entrada=?, data_saida=?, created_at=? WHERE id=?', corrigidas)
+    
+    # Colunas virtuais: sempre coerentes com o texto, sem mudar INSERT/UPDATE; só os índices guardam os valores
+    for comando in (
+        'ALTER TABLE fichas ADD COLUMN dia_entrada INTEGER GENERATED ALWAYS AS (CAST(julianday(data_entrada) - 2440587.5 AS INTEGER)) VIRTUAL',
+        'ALTER TABLE fichas ADD COLUMN dia_saida INTEGER GENERATED ALWAYS AS (CAST(julianday(data_saida) - 2440587.5 AS INTEGER)) VIRTUAL',
+        'ALTER TABLE fichas ADD COLUMN criado_em INTEGER GENERATED ALWAYS AS (CAST(round((julianday(created_at) - 2440587.5) * 86400) AS INTEGER)) VIRTUAL',
+        'DROP INDEX IF EXISTS idx_fichas_cliente',
+        'DROP INDEX IF EXISTS idx_fichas_data_entrada',
+        'DROP INDEX IF EXISTS idx_fichas_data_saida',
+        'CREATE INDEX IF NOT EXISTS idx_fichas_cliente_criado ON fichas(cliente_id, criado_em)',
+        'CREATE INDEX IF NOT EXISTS idx_fichas_dia_entrada ON fichas(dia_entrada, cliente_id)',
+        'CREATE INDEX IF NOT EXISTS idx_fichas_dia_saida ON fichas(dia_saida, cliente_id)',
+        'CREATE INDEX IF NOT EXISTS idx_fichas_cliente_dia ON fichas(cliente_id, dia_entrada)',
+    ):
+        cursor.execute(comando)
+
+MIGRACOES = [
+    (1, 'Índices para as consultas mais frequentes', [
+        'CREATE INDEX IF NOT EXISTS idx_fichas_cliente ON fichas(cliente_id, created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_fichas_data_entrada ON fichas(data_entrada, cliente_id)',
+        'CREATE INDEX IF NOT EXISTS idx_fichas_data_saida ON fichas(data_saida, cliente_id)',
+        'CREATE INDEX IF NOT EXISTS idx_fichas_ativas ON fichas(cliente_id, data_entrada) WHERE data_saida IS NULL',
+        'CREATE INDEX IF NOT EXISTS idx_medicamentos_ficha ON medicamentos(ficha_id)',
+        'CREATE INDEX IF NOT EXISTS idx_familiares_cliente ON familiares(cliente_id, nome)',
+        'CREATE INDEX IF NOT EXISTS idx_documentos_cliente ON documentos(cliente_id, data_upload)',
+    ]),
+    (2, 'Índice de busca textual (FTS5) sobre clientes, fichas, medicamentos e familiares', _migracao_busca),
+    (3, 'Contadores do painel mantidos por gatilhos', [
+        '''
+        CREATE TABLE IF NOT EXISTS estatisticas (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            total_clientes INTEGER NOT NULL DEFAULT 0,
+            fichas_ativas INTEGER NOT NULL DEFAULT 0,
+            fichas_finalizadas INTEGER NOT NULL DEFAULT 0
+        )
+        ''',
+        _RECALCULAR_ESTATISTICAS,
+        '''
+        CREATE TRIGGER IF NOT EXISTS estatisticas_clientes_ai AFTER INSERT ON clientes BEGIN
+            UPDATE estatisticas SET total_clientes = total_clientes + 1 WHERE id = 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS estatisticas_clientes_ad AFTER DELETE ON clientes BEGIN
+            UPDATE estatisticas SET total_clientes = total_clientes - 1 WHERE id = 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS estatisticas_fichas_ai AFTER INSERT ON fichas BEGIN
+            UPDATE estatisticas
+            SET fichas_ativas = fichas_ativas + (NEW.data_saida IS NULL),
+                fichas_finalizadas = fichas_finalizadas + (NEW.data_saida IS NOT NULL)
+            WHERE id = 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS estatisticas_fichas_ad AFTER DELETE ON fichas BEGIN
+            UPDATE estatisticas
+            SET fichas_ativas = fichas_ativas - (OLD.data_saida IS NULL),
+                fichas_finalizadas = fichas_finalizadas - (OLD.data_saida IS NOT NULL)
+            WHERE id = 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS estatisticas_fichas_au AFTER UPDATE OF data_saida ON fichas BEGIN
+            UPDATE estatisticas
+            SET fichas_ativas = fichas_ativas - (OLD.data_saida IS NULL) + (NEW.data_saida IS NULL),
+                fichas_finalizadas = fichas_finalizadas - (OLD.data_saida IS NOT NULL) + (NEW.data_saida IS NOT NULL)
+            WHERE id = 1;
+        END
+        ''',
+    ]),
+    (4, 'Remoção única de registros órfãos antes de ativar foreign_keys', [
+        'DELETE FROM fichas WHERE cliente_id NOT IN (SELECT id FROM clientes)',
+        'DELETE FROM medicamentos WHERE ficha_id NOT IN (SELECT id FROM fichas)',
+        'DELETE FROM familiares WHERE cliente_id NOT IN (SELECT id FROM clientes)',
+        'DELETE FROM documentos WHERE cliente_id NOT IN (SELECT id FROM clientes)',
+        _RECALCULAR_ESTATISTICAS,
+    ]),
+    (5, 'Índice por nome para a exportação ordenada', [
+        'CREATE INDEX IF NOT EXISTS idx_clientes_nome ON clientes(nome)',
+    ]),
+    (6, 'Armazenamento de documentos endereçado por conteúdo (SHA-256)', [
+        'ALTER TABLE documentos ADD COLUMN hash_conteudo TEXT',
+        'CREATE INDEX IF NOT EXISTS idx_documentos_hash ON documentos(hash_conteudo)',
+    ]),
+    (7, 'Compressão opcional dos documentos armazenados', [
+        'ALTER TABLE documentos ADD COLUMN tamanho_armazenado INTEGER',
+        'ALTER TABLE documentos ADD COLUMN compressao TEXT',
+        'UPDATE documentos SET tamanho_armazenado = tamanho',
+    ]),
+    (8, 'Datas das fichas normalizadas e indexadas como dias/segundos desde 1970', _migracao_datas),
+    (9, 'Índice das fichas ativas pelo dia de entrada (filtro de status)', [
+        'DROP INDEX IF EXISTS idx_fichas_ativas',
+        'CREATE INDEX IF NOT EXISTS idx_fichas_ativas ON fichas(cliente_id, dia_entrada) WHERE data_saida IS NULL',
+    ]),
+]
 
-def get_db():
-    """Obtém conexão SQLite com configurações otimizadas para evitar locks"""
-    if not hasattr(_thread_local, 'db'):
-        conn = sqlite3.connect(DB_PATH, timeout=30.0, check_same_thread=False)
-        conn.execute('PRAGMA journal_mode = WAL')  
-        conn.execute('PRAGMA synchronous = NORMAL')
-        conn.execute('PRAGMA cache_size = -64000')  
-        conn.execute('PRAGMA temp_store = MEMORY')
-        conn.row_factory = sqlite3.Row
-        _thread_local.db = conn
-    return _thread_local.db
+def migrar_db(conn):
+    """Aplica as migrações pendentes sobre o banco existente, atualizando-o no lugar"""
+    versao_atual = conn.execute('PRAGMA user_version').fetchone()[0]
+    cursor = conn.cursor()
+    
+    for versao, descricao, passos in MIGRACOES:
+        if versao <= versao_atual:
+            continue
+        try:
+            cursor.execute('BEGIN IMMEDIATE')
+            if callable(passos):
+                passos(cursor)
+            else:
+                for comando in passos:
+                    cursor.execute(comando)
+            cursor.execute(f'PRAGMA user_version = {versao}')
+            conn.commit()
+            app.logger.info('Migração %s aplicada: %s', versao, descricao)
+        except Exception:
+            conn.rollback()
+            raise
+        versao_atual = versao
+    
+    conn.execute('PRAGMA optimize')
 
 def init_db():
-    conn = get_db()
+    conn = get_db(escrita=True)
     cursor = conn.cursor()
     
     cursor.execute('''
@@ -129,6 +1077,53 @@ def init_db():
     ''')
     
     conn.commit()
+    migrar_db(conn)
+
+COLUNAS_MEDICAMENTOS = ('nome', 'dosagem', 'frequencia', 'observacoes')
+COLUNAS_FAMILIARES = ('nome', 'parentesco', 'telefone', 'email', 'endereco', 'observacoes')
+
+def sincronizar_filhos(cursor, tabela, chave, pai_id, colunas, enviados):
+    """Aplica apenas as diferenças entre as linhas enviadas pelo formulário e as gravadas, preservando os ids"""
+    cursor.execute(f'SELECT id, {", ".join(colunas)} FROM {tabela} WHERE {chave} = ?', (pai_id,))
+    atuais = {row[0]: tuple(valor or '' for valor in row[1:]) for row in cursor.fetchall()}
+    
+    pendentes = []
+    atualizar = []
+    for item in enviados:
+        valores = tuple(str(item.get(coluna) or '').strip() for coluna in colunas)
+        if not valores[0]:
+            continue
+        item_id = item.get('id')
+        if item_id in atuais:
+            # Linha já gravada: só regrava se algum campo mudou
+            if atuais.pop(item_id) != valores:
+                atualizar.append(valores + (item_id,))
+        else:
+            pendentes.append(valores)
+    
+    # Linhas enviadas sem id que já existem com o mesmo conteúdo são mantidas como estão
+    por_conteudo = {}
+    for row_id, valores in atuais.items():
+        por_conteudo.setdefault(valores, []).append(row_id)
+    inserir = []
+    for valores in pendentes:
+        if por_conteudo.get(valores):
+            atuais.pop(por_conteudo[valores].pop(0))
+        else:
+            inserir.append((pai_id,) + valores)
+    
+    if atualizar:
+        cursor.executemany(
+            f'UPDATE {tabela} SET {", ".join(f"{coluna}=?" for coluna in colunas)} WHERE id=?',
+            atualizar
+        )
+    if atuais:
+        cursor.executemany(f'DELETE FROM {tabela} WHERE id=?', [(row_id,) for row_id in atuais])
+    if inserir:
+        cursor.executemany(
+            f'INSERT INTO {tabela} ({chave}, {", ".join(colunas)}) VALUES ({", ".join("?" * (len(colunas) + 1))})',
+            inserir
+        )
 
 def validar_cpf(cpf):
     cpf = re.sub(r'\D', '', cpf)
@@ -138,6 +1133,119 @@ def validar_email(email):
     pattern = r'^[\w\.-]+@[\w\.-]+\.\w+$'
     return re.match(pattern, email) is not None
 
+FORMATOS_DATA = ('%Y-%m-%d', '%d/%m/%Y', '%d-%m-%Y', '%Y/%m/%d')
+EPOCA = date(1970, 1, 1).toordinal()
+
+def normalizar_data(texto):
+    """Converte a data (AAAA-MM-DD ou DD/MM/AAAA, com ou sem hora) para AAAA-MM-DD; ValueError se inválida"""
+    texto = (texto or '').strip().replace('T', ' ').split(' ')[0]
+    for formato in FORMATOS_DATA:
+        try:
+            return datetime.strptime(texto, formato).date().isoformat()
+        except ValueError:
+            pass
+    raise ValueError(f'Data inválida: {texto or "(vazia)"}')
+
+def validar_datas(data_entrada, data_saida):
+    """Normaliza as datas da ficha e confere que a saída não é anterior à entrada"""
+    data_entrada = normalizar_data(data_entrada)
+    data_saida = normalizar_data(data_saida) if data_saida else None
+    if data_saida and data_saida < data_entrada:
+        raise ValueError('A data de saída não pode ser anterior à data de entrada!')
+    return data_entrada, data_saida
+
+def dia_epoca(data_iso):
+    """Dias desde 1970-01-01, o mesmo valor das colunas dia_entrada/dia_saida"""
+    return date.fromisoformat(data_iso).toordinal() - EPOCA
+
+LOTE_CONSULTA = 500
+
+def carregar_medicamentos(cursor, ficha_ids):
+    """Carrega os medicamentos de várias fichas em uma consulta por lote, agrupados por ficha_id"""
+    medicamentos = {}
+    ficha_ids = list(ficha_ids)
+    for inicio in range(0, len(ficha_ids), LOTE_CONSULTA):
+        lote = ficha_ids[inicio:inicio + LOTE_CONSULTA]
+        cursor.execute(f'''
+            SELECT id, nome, dosagem, frequencia, observacoes, ficha_id
+            FROM medicamentos
+            WHERE ficha_id IN ({','.join('?' * len(lote))})
+            ORDER BY ficha_id, id
+        ''', lote)
+        for med in cursor.fetchall():
+            medicamentos.setdefault(med['ficha_id'], []).append(med)
+    return medicamentos
+
+def expressao_busca(busca):
+    """Converte o texto digitado em uma consulta FTS5 por prefixo (cada termo deve aparecer)"""
+    termos = re.findall(r'\w+', busca or '')
+    return ' '.join(f'"{termo}"*' for termo in termos)
+
+def filtros_fichas(status, data_inicio, data_fim):
+    """Monta as condições sobre a ficha (alias f) usadas pelos filtros de status e data"""
+    cond = ''
+    params = []
+    
+    if status == 'ativo':
+        cond += ' AND f.data_saida IS NULL'
+    elif status == 'finalizado':
+        cond += ' AND f.data_saida IS NOT NULL'
+    
+    # Datas que não forem reconhecidas são ignoradas, como um filtro vazio
+    try:
+        if data_inicio:
+            params.append(dia_epoca(normalizar_data(data_inicio)))
+            cond += ' AND f.dia_entrada >= ?'
+    except ValueError:
+        pass
+    
+    try:
+        if data_fim:
+            params.append(dia_epoca(normalizar_data(data_fim)))
+            cond += ' AND f.dia_entrada <= ?'
+    except ValueError:
+        pass
+    
+    return cond, params
+
+def periodo_estreito(cursor, data_inicio, data_fim):
+    """Indica se o filtro de datas casa com poucas fichas (contagem limitada, só no índice de datas).
+    
+    Sem isso a lista percorre os clientes do maior id para o menor até encher a página; num período
+    curto ou antigo quase nenhum cliente casa e a varredura passa por todos. O status fica de fora da
+    contagem, que assim não lê a tabela: só reduziria a lista.
+    """
+    if not (data_inicio or data_fim):
+        return False
+    cond, params = filtros_fichas('', data_inicio, data_fim)
+    limite = app.config['CLIENTES_PERIODO_ESTREITO']
+    cursor.execute(f'SELECT COUNT(*) FROM (SELECT 1 FROM fichas f WHERE 1=1{cond} LIMIT ?)', params + [limite])
+    return cursor.fetchone()[0] < limite
+
+def montar_filtros(busca, status, data_inicio, data_fim, pelas_fichas=False):
+    """Monta a cláusula WHERE sobre clientes (alias c) equivalente aos filtros da página inicial.
+    
+    Com pelas_fichas, o filtro de fichas vira uma lista de clientes lida do índice de datas, em vez de
+    um EXISTS testado cliente a cliente (ver periodo_estreito).
+    """
+    where = '1=1'
+    params = []
+    
+    expressao = expressao_busca(busca)
+    if expressao:
+        where += ' AND c.id IN (SELECT rowid FROM busca_clientes WHERE busca_clientes MATCH ?)'
+        params.append(expressao)
+    
+    cond_fichas, params_fichas = filtros_fichas(status, data_inicio, data_fim)
+    if cond_fichas:
+        if pelas_fichas:
+            where += f' AND c.id IN (SELECT f.cliente_id FROM fichas f WHERE 1=1{cond_fichas})'
+        else:
+            where += f' AND EXISTS (SELECT 1 FROM fichas f WHERE f.cliente_id = c.id{cond_fichas})'
+        params.extend(params_fichas)
+    
+    return where, params
+
 @app.route('/')
 def index():
     try:
@@ -149,84 +1257,89 @@ def index():
         data_inicio = request.args.get('data_inicio', '')
         data_fim = request.args.get('data_fim', '')
         
-        # Limpar fichas órfãs (sem cliente)
-        cursor.execute('''
-            DELETE FROM fichas 
-            WHERE cliente_id NOT IN (SELECT id FROM clientes)
-        ''')
-        conn.commit()
-        
-        query = '''
-            SELECT c.id, c.nome, c.cpf, c.email, c.telefone,
-                   f.id as ficha_id, f.data_entrada, f.data_saida, f.created_at
-            FROM clientes c
-            LEFT JOIN fichas f ON c.id = f.cliente_id
-            WHERE 1=1
-        '''
-        params = []
-        
-        if busca:
-            query += ' AND (c.nome LIKE ? OR c.cpf LIKE ? OR c.email LIKE ?)'
-            busca_param = f'%{busca}%'
-            params.extend([busca_param, busca_param, busca_param])
-        
-        if status == 'ativo':
-            query += ' AND f.data_saida IS NULL AND f.id IS NOT NULL'
-        elif status == 'finalizado':
-            query += ' AND f.data_saida IS NOT NULL'
-        
-        if data_inicio:
-            query += ' AND f.data_entrada >= ?'
-            params.append(data_inicio)
-        
-        if data_fim:
-            query += ' AND f.data_entrada <= ?'
-            params.append(data_fim)
+        por_pagina = request.args.get('por_pagina', app.config['CLIENTES_POR_PAGINA'], type=int)
+        por_pagina = max(1, min(por_pagina, app.config['CLIENTES_POR_PAGINA_MAX']))
+        apos = request.args.get('apos', type=int)
+        apos_relevancia = request.args.get('apos_relevancia', type=float)
         
-        query += ' ORDER BY c.id DESC, f.created_at DESC'
+        # Paginação por cursor (keyset): o custo não cresce com o número da página
+        expressao = expressao_busca(busca)
+        if expressao:
+            # Busca textual: resultados ordenados por relevância (bm25), desempate pelo id
+            where, params = montar_filtros('', status, data_inicio, data_fim)
+            relevancia = f'bm25(busca_clientes, {PESOS_BUSCA})'
+            query = f'''
+                SELECT c.id, c.nome, c.cpf, c.email, c.telefone, {relevancia} AS relevancia
+                FROM busca_clientes
+                JOIN clientes c ON c.id = busca_clientes.rowid
+                WHERE busca_clientes MATCH ? AND {where}
+            '''
+            params.insert(0, expressao)
+            if apos and apos_relevancia is not None:
+                query += f' AND ({relevancia} > ? OR ({relevancia} = ? AND c.id < ?))'
+                params.extend([apos_relevancia, apos_relevancia, apos])
+            query += ' ORDER BY relevancia, c.id DESC LIMIT ?'
+        else:
+            estreito = periodo_estreito(cursor, data_inicio, data_fim)
+            where, params = montar_filtros('', status, data_inicio, data_fim, pelas_fichas=estreito)
+            query = f'''
+                SELECT c.id, c.nome, c.cpf, c.email, c.telefone
+                FROM clientes c
+                WHERE {where}
+            '''
+            if apos:
+                query += ' AND c.id < ?'
+                params.append(apos)
+            query += ' ORDER BY c.id DESC LIMIT ?'
+        params.append(por_pagina + 1)
         
         cursor.execute(query, params)
         resultados = cursor.fetchall()
         
+        proximo_cursor = None
+        proxima_relevancia = None
+        if len(resultados) > por_pagina:
+            resultados = resultados[:por_pagina]
+            proximo_cursor = resultados[-1][0]
+            if expressao:
+                proxima_relevancia = repr(resultados[-1][5])
+        
         clientes_dict = {}
         for row in resultados:
-            cliente_id = row[0]
-            if cliente_id not in clientes_dict:
-                clientes_dict[cliente_id] = {
-                    'id': row[0],
-                    'nome': row[1],
-                    'cpf': row[2],
-                    'email': row[3],
-                    'telefone': row[4],
-                    'fichas': []
-                }
-            
-            if row[5]:
-                clientes_dict[cliente_id]['fichas'].append({
-                    'id': row[5],
-                    'data_entrada': row[6],
-                    'data_saida': row[7],
-                    'created_at': row[8]
+            clientes_dict[row[0]] = {
+                'id': row[0],
+                'nome': row[1],
+                'cpf': row[2],
+                'email': row[3],
+                'telefone': row[4],
+                'fichas': []
+            }
+        
+        # Segunda consulta: somente as fichas dos clientes visíveis nesta página
+        if clientes_dict:
+            ids = list(clientes_dict.keys())
+            cond_fichas, params_fichas = filtros_fichas(status, data_inicio, data_fim)
+            cursor.execute(f'''
+                SELECT f.cliente_id, f.id, f.data_entrada, f.data_saida, f.created_at
+                FROM fichas f
+                WHERE f.cliente_id IN ({','.join('?' * len(ids))}) {cond_fichas}
+                ORDER BY f.cliente_id DESC, f.criado_em DESC
+            ''', ids + params_fichas)
+            for row in cursor.fetchall():
+                clientes_dict[row[0]]['fichas'].append({
+                    'id': row[1],
+                    'data_entrada': row[2],
+                    'data_saida': row[3],
+                    'created_at': row[4]
                 })
         
         clientes = list(clientes_dict.values())
         
-        cursor.execute('SELECT COUNT(*) FROM clientes')
-        total = cursor.fetchone()[0]
-        
-        cursor.execute('''
-            SELECT COUNT(*) FROM fichas 
-            WHERE data_saida IS NULL 
-            AND cliente_id IN (SELECT id FROM clientes)
-        ''')
-        ativos = cursor.fetchone()[0]
-        
         cursor.execute('''
-            SELECT COUNT(*) FROM fichas 
-            WHERE data_saida IS NOT NULL
-            AND cliente_id IN (SELECT id FROM clientes)
+            SELECT total_clientes, fichas_ativas, fichas_finalizadas
+            FROM estatisticas WHERE id = 1
         ''')
-        finalizados = cursor.fetchone()[0]
+        total, ativos, finalizados = cursor.fetchone()
         
         return render_template('index.html', 
                              clientes=clientes, 
@@ -236,7 +1349,11 @@ def index():
                              busca=busca,
                              status=status,
                              data_inicio=data_inicio,
-                             data_fim=data_fim)
+                             data_fim=data_fim,
+                             apos=apos,
+                             por_pagina=por_pagina,
+                             proximo_cursor=proximo_cursor,
+                             proxima_relevancia=proxima_relevancia)
     except Exception as e:
         flash(f'Erro ao carregar página: {str(e)}', 'error')
         return render_template('index.html', clientes=[], total=0, ativos=0, finalizados=0)
@@ -256,6 +1373,12 @@ def cadastrar():
             flash('Todos os campos obrigatórios devem ser preenchidos!', 'error')
             return redirect(url_for('cadastrar'))
         
+        try:
+            data_entrada, data_saida = validar_datas(data_entrada, data_saida)
+        except ValueError as e:
+            flash(str(e), 'error')
+            return redirect(url_for('cadastrar'))
+        
         medicamentos_json = request.form.get('medicamentos_data', '[]')
         try:
             medicamentos = json.loads(medicamentos_json)
@@ -289,56 +1412,56 @@ def cadastrar():
                 flash(f'Erro: CPF já cadastrado para o cliente "{cliente_existente[1]}". Use a opção "Nova Ficha" para adicionar uma nova internação.', 'error')
                 return redirect(url_for('cadastrar'))
             
-            cursor.execute('BEGIN IMMEDIATE')
-            
-            cursor.execute('''
-                INSERT INTO clientes (nome, cpf, email, telefone)
-                VALUES (?, ?, ?, ?)
-            ''', (nome, cpf_limpo, email, telefone))
-            cliente_id = cursor.lastrowid
+            def gravar(cursor):
+                cursor.execute('''
+                    INSERT INTO clientes (nome, cpf, email, telefone)
+                    VALUES (?, ?, ?, ?)
+                ''', (nome, cpf_limpo, email, telefone))
+                cliente_id = cursor.lastrowid
             
-            cursor.execute('''
-                INSERT INTO fichas (cliente_id, data_entrada, data_saida, observacoes)
-                VALUES (?, ?, ?, ?)
-            ''', (cliente_id, data_entrada, data_saida, observacoes))
-            ficha_id = cursor.lastrowid
+                cursor.execute('''
+                    INSERT INTO fichas (cliente_id, data_entrada, data_saida, observacoes)
+                    VALUES (?, ?, ?, ?)
+                ''', (cliente_id, data_entrada, data_saida, observacoes))
+                ficha_id = cursor.lastrowid
             
-            for med in medicamentos:
-                nome_med = med.get('nome', '').strip()
-                if nome_med:
-                    dosagem = med.get('dosagem', '').strip()
-                    frequencia = med.get('frequencia', '').strip()
-                    obs_med = med.get('observacoes', '').strip()
+                for med in medicamentos:
+                    nome_med = med.get('nome', '').strip()
+                    if nome_med:
+                        dosagem = med.get('dosagem', '').strip()
+                        frequencia = med.get('frequencia', '').strip()
+                        obs_med = med.get('observacoes', '').strip()
                     
-                    cursor.execute('''
-                        INSERT INTO medicamentos (ficha_id, nome, dosagem, frequencia, observacoes)
-                        VALUES (?, ?, ?, ?, ?)
-                    ''', (ficha_id, nome_med, dosagem, frequencia, obs_med))
+                        cursor.execute('''
+                            INSERT INTO medicamentos (ficha_id, nome, dosagem, frequencia, observacoes)
+                            VALUES (?, ?, ?, ?, ?)
+                        ''', (ficha_id, nome_med, dosagem, frequencia, obs_med))
             
-            for fam in familiares:
-                nome_fam = fam.get('nome', '').strip()
-                if nome_fam:
-                    parentesco = fam.get('parentesco', '').strip()
-                    telefone_fam = fam.get('telefone', '').strip()
-                    email_fam = fam.get('email', '').strip()
-                    endereco = fam.get('endereco', '').strip()
-                    obs_fam = fam.get('observacoes', '').strip()
+                for fam in familiares:
+                    nome_fam = fam.get('nome', '').strip()
+                    if nome_fam:
+                        parentesco = fam.get('parentesco', '').strip()
+                        telefone_fam = fam.get('telefone', '').strip()
+                        email_fam = fam.get('email', '').strip()
+                        endereco = fam.get('endereco', '').strip()
+                        obs_fam = fam.get('observacoes', '').strip()
                     
-                    cursor.execute('''
-                        INSERT INTO familiares (cliente_id, nome, parentesco, telefone, email, endereco, observacoes)
-                        VALUES (?, ?, ?, ?, ?, ?, ?)
-                    ''', (cliente_id, nome_fam, parentesco, telefone_fam, email_fam, endereco, obs_fam))
+                        cursor.execute('''
+                            INSERT INTO familiares (cliente_id, nome, parentesco, telefone, email, endereco, observacoes)
+                            VALUES (?, ?, ?, ?, ?, ?, ?)
+                        ''', (cliente_id, nome_fam, parentesco, telefone_fam, email_fam, endereco, obs_fam))
+                
+                return cliente_id
             
-            conn.commit()
+            cliente_id = executar_escrita(gravar)
+            cache_relatorios.invalidar(data_entrada, data_saida)
             flash('Novo cliente cadastrado com sucesso!', 'success')
             return redirect(url_for('ver_cliente', cliente_id=cliente_id))
             
         except sqlite3.IntegrityError as e:
-            conn.rollback()
             flash(f'Erro de integridade no banco de dados: {str(e)}', 'error')
             return redirect(url_for('cadastrar'))
         except Exception as e:
-            conn.rollback()
             flash(f'Erro ao cadastrar: {str(e)}', 'error')
             return redirect(url_for('cadastrar'))
     
@@ -361,45 +1484,126 @@ def nova_ficha(cliente_id):
         data_saida = request.form['data_saida'] if request.form['data_saida'] else None
         observacoes = request.form.get('observacoes', '')
         
+        try:
+            data_entrada, data_saida = validar_datas(data_entrada, data_saida)
+        except ValueError as e:
+            flash(str(e), 'error')
+            return redirect(url_for('nova_ficha', cliente_id=cliente_id))
+        
         medicamentos_json = request.form.get('medicamentos_data', '[]')
         try:
             medicamentos = json.loads(medicamentos_json)
         except:
             medicamentos = []
         
-        try:
-            cursor.execute('BEGIN IMMEDIATE')
-            
+        def gravar(cursor):
             cursor.execute('''
                 INSERT INTO fichas (cliente_id, data_entrada, data_saida, observacoes)
                 VALUES (?, ?, ?, ?)
             ''', (cliente_id, data_entrada, data_saida, observacoes))
             ficha_id = cursor.lastrowid
-            
+
             for med in medicamentos:
                 nome_med = med.get('nome', '').strip()
                 if nome_med:
                     dosagem = med.get('dosagem', '').strip()
                     frequencia = med.get('frequencia', '').strip()
                     obs_med = med.get('observacoes', '').strip()
-                    
+
                     cursor.execute('''
                         INSERT INTO medicamentos (ficha_id, nome, dosagem, frequencia, observacoes)
                         VALUES (?, ?, ?, ?, ?)
                     ''', (ficha_id, nome_med, dosagem, frequencia, obs_med))
-            
-            conn.commit()
+
+        try:
+            executar_escrita(gravar)
+            cache_paginas.invalidar(cliente_id)
+            cache_relatorios.invalidar(data_entrada, data_saida)
             flash('Nova ficha criada com sucesso!', 'success')
             return redirect(url_for('ver_cliente', cliente_id=cliente_id))
         except Exception as e:
-            conn.rollback()
             flash(f'Erro ao criar ficha: {str(e)}', 'error')
             return redirect(url_for('nova_ficha', cliente_id=cliente_id))
     
     return render_template('nova_ficha.html', cliente=cliente)
 
+class CachePaginas:
+    """LRU em memória de páginas renderizadas por paciente, limitado em bytes e invalidado por versão"""
+    def __init__(self, limite_bytes):
+        self._lock = threading.Lock()
+        self._paginas = OrderedDict()
+        self._versoes = {}
+        self._bytes = 0
+        self.limite_bytes = limite_bytes
+        # Versões recomeçam a cada processo; a geração evita que um ETag antigo case após reiniciar
+        self.geracao = uuid.uuid4().hex[:8]
+    
+    def versao(self, cliente_id):
+        with self._lock:
+            return self._versoes.get(cliente_id, 0)
+    
+    def etag(self, cliente_id, versao):
+        return f'{self.geracao}-{cliente_id}-{versao}'
+    
+    def obter(self, cliente_id, versao):
+        with self._lock:
+            chave = (cliente_id, versao)
+            pagina = self._paginas.get(chave)
+            if pagina is not None:
+                self._paginas.move_to_end(chave)
+            return pagina
+    
+    def guardar(self, cliente_id, versao, pagina):
+        with self._lock:
+            if versao != self._versoes.get(cliente_id, 0) or len(pagina) > self.limite_bytes:
+                return
+            chave = (cliente_id, versao)
+            if chave not in self._paginas:
+                self._paginas[chave] = pagina
+                self._bytes += len(pagina)
+            while self._bytes > self.limite_bytes:
+                _, antiga = self._paginas.popitem(last=False)
+                self._bytes -= len(antiga)
+    
+    def invalidar(self, cliente_id):
+        """Chamado após cada escrita que altera o que a página do paciente mostra"""
+        with self._lock:
+            versao = self._versoes.get(cliente_id, 0)
+            self._versoes[cliente_id] = versao + 1
+            pagina = self._paginas.pop((cliente_id, versao), None)
+            if pagina is not None:
+                self._bytes -= len(pagina)
+    
+    def metricas(self):
+        with self._lock:
+            return {'paginas': len(self._paginas), 'bytes': self._bytes}
+
+cache_paginas = PorUnidade(lambda unidade: CachePaginas(app.config['CACHE_CLIENTES_BYTES']))
+
 @app.route('/cliente/<int:cliente_id>')
 def ver_cliente(cliente_id):
+    # A versão é lida antes das consultas: uma escrita no meio do caminho só invalida o que for guardado
+    versao = cache_paginas.versao(cliente_id)
+    etag = cache_paginas.etag(cliente_id, versao)
+    if request.if_none_match.contains(etag):
+        response = make_response('', 304)
+    else:
+        pagina = cache_paginas.obter(cliente_id, versao)
+        if pagina is None:
+            pagina = renderizar_cliente(cliente_id)
+            if pagina is None:
+                flash('Cliente não encontrado!', 'error')
+                return redirect(url_for('index'))
+            pagina = pagina.encode('utf-8')
+            cache_paginas.guardar(cliente_id, versao, pagina)
+        response = make_response(pagina)
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+def renderizar_cliente(cliente_id):
+    """Consulta o paciente com fichas, familiares e documentos e renderiza a página (None se não existir)"""
     conn = get_db()
     cursor = conn.cursor()
     
@@ -407,33 +1611,27 @@ def ver_cliente(cliente_id):
     cliente = cursor.fetchone()
     
     if not cliente:
-        flash('Cliente não encontrado!', 'error')
-        return redirect(url_for('index'))
+        return None
     
     cursor.execute('''
         SELECT id, data_entrada, data_saida, observacoes, created_at
         FROM fichas
         WHERE cliente_id = ?
-        ORDER BY created_at DESC
+        ORDER BY criado_em DESC
     ''', (cliente_id,))
     fichas = cursor.fetchall()
     
+    medicamentos_por_ficha = carregar_medicamentos(cursor, [ficha[0] for ficha in fichas])
+    
     fichas_com_medicamentos = []
     for ficha in fichas:
-        cursor.execute('''
-            SELECT id, nome, dosagem, frequencia, observacoes
-            FROM medicamentos
-            WHERE ficha_id = ?
-        ''', (ficha[0],))
-        medicamentos = cursor.fetchall()
-        
         fichas_com_medicamentos.append({
             'id': ficha[0],
             'data_entrada': ficha[1],
             'data_saida': ficha[2],
             'observacoes': ficha[3],
             'created_at': ficha[4],
-            'medicamentos': medicamentos
+            'medicamentos': medicamentos_por_ficha.get(ficha[0], [])
         })
     
     cursor.execute('''
@@ -452,7 +1650,8 @@ def ver_cliente(cliente_id):
     ''', (cliente_id,))
     documentos = cursor.fetchall()
     
-    return render_template('ver_cliente.html', cliente=cliente, fichas=fichas_com_medicamentos, familiares=familiares, documentos=documentos)
+    return render_template('ver_cliente.html', cliente=cliente, fichas=fichas_com_medicamentos, familiares=familiares, documentos=documentos,
+                           extensoes_previa=extensoes_previa())
 
 @app.route('/editar/<int:id>', methods=['GET', 'POST'])
 def editar(id):
@@ -474,35 +1673,21 @@ def editar(id):
             flash('Email inválido!', 'error')
             return redirect(url_for('editar', id=id))
         
-        try:
-            cursor.execute('BEGIN IMMEDIATE')
+        def gravar(cursor):
             cursor.execute('''
-                UPDATE clientes 
+                UPDATE clientes
                 SET nome=?, email=?, telefone=?
                 WHERE id=?
             ''', (nome, email, telefone, id))
-            
-            cursor.execute('DELETE FROM familiares WHERE cliente_id=?', (id,))
-            
-            for fam in familiares:
-                nome_fam = fam.get('nome', '').strip()
-                if nome_fam:
-                    parentesco = fam.get('parentesco', '').strip()
-                    telefone_fam = fam.get('telefone', '').strip()
-                    email_fam = fam.get('email', '').strip()
-                    endereco = fam.get('endereco', '').strip()
-                    obs_fam = fam.get('observacoes', '').strip()
-                    
-                    cursor.execute('''
-                        INSERT INTO familiares (cliente_id, nome, parentesco, telefone, email, endereco, observacoes)
-                        VALUES (?, ?, ?, ?, ?, ?, ?)
-                    ''', (id, nome_fam, parentesco, telefone_fam, email_fam, endereco, obs_fam))
-            
-            conn.commit()
+
+            sincronizar_filhos(cursor, 'familiares', 'cliente_id', id, COLUNAS_FAMILIARES, familiares)
+
+        try:
+            executar_escrita(gravar)
+            cache_paginas.invalidar(id)
             flash('Cliente atualizado com sucesso!', 'success')
             return redirect(url_for('ver_cliente', cliente_id=id))
         except Exception as e:
-            conn.rollback()
             flash(f'Erro ao atualizar: {str(e)}', 'error')
             return redirect(url_for('editar', id=id))
     
@@ -521,7 +1706,7 @@ def editar_ficha(ficha_id):
     cursor = conn.cursor()
     
     cursor.execute('''
-        SELECT f.*, c.nome, c.cpf
+        SELECT f.id, f.cliente_id, f.data_entrada, f.data_saida, f.observacoes, c.nome, c.cpf
         FROM fichas f
         JOIN clientes c ON f.cliente_id = c.id
         WHERE f.id = ?
@@ -537,45 +1722,39 @@ def editar_ficha(ficha_id):
         data_saida = request.form['data_saida'] if request.form['data_saida'] else None
         observacoes = request.form.get('observacoes', '')
         
+        try:
+            data_entrada, data_saida = validar_datas(data_entrada, data_saida)
+        except ValueError as e:
+            flash(str(e), 'error')
+            return redirect(url_for('editar_ficha', ficha_id=ficha_id))
+        
         medicamentos_json = request.form.get('medicamentos_data', '[]')
         try:
             medicamentos = json.loads(medicamentos_json)
         except:
             medicamentos = []
         
-        try:
-            cursor.execute('BEGIN IMMEDIATE')
-            
+        def gravar(cursor):
             cursor.execute('''
                 UPDATE fichas
                 SET data_entrada=?, data_saida=?, observacoes=?
                 WHERE id=?
             ''', (data_entrada, data_saida, observacoes, ficha_id))
-            
-            cursor.execute('DELETE FROM medicamentos WHERE ficha_id=?', (ficha_id,))
-            
-            for med in medicamentos:
-                nome_med = med.get('nome', '').strip()
-                if nome_med:
-                    dosagem = med.get('dosagem', '').strip()
-                    frequencia = med.get('frequencia', '').strip()
-                    obs_med = med.get('observacoes', '').strip()
-                    
-                    cursor.execute('''
-                        INSERT INTO medicamentos (ficha_id, nome, dosagem, frequencia, observacoes)
-                        VALUES (?, ?, ?, ?, ?)
-                    ''', (ficha_id, nome_med, dosagem, frequencia, obs_med))
-            
-            conn.commit()
+
+            sincronizar_filhos(cursor, 'medicamentos', 'ficha_id', ficha_id, COLUNAS_MEDICAMENTOS, medicamentos)
+
+        try:
+            executar_escrita(gravar)
+            cache_paginas.invalidar(ficha[1])
+            cache_relatorios.invalidar(ficha['data_entrada'], ficha['data_saida'])
+            cache_relatorios.invalidar(data_entrada, data_saida)
             flash('Ficha atualizada com sucesso!', 'success')
             return redirect(url_for('ver_cliente', cliente_id=ficha[1]))
         except Exception as e:
-            conn.rollback()
             flash(f'Erro ao atualizar ficha: {str(e)}', 'error')
             return redirect(url_for('editar_ficha', ficha_id=ficha_id))
     
-    cursor.execute('SELECT * FROM medicamentos WHERE ficha_id=?', (ficha_id,))
-    medicamentos = cursor.fetchall()
+    medicamentos = carregar_medicamentos(cursor, [ficha_id]).get(ficha_id, [])
     medicamentos_json = json.dumps([dict(m) for m in medicamentos])
     
     return render_template('editar_ficha.html', ficha=ficha, medicamentos_json=medicamentos_json)
@@ -583,14 +1762,11 @@ def editar_ficha(ficha_id):
 @app.route('/deletar/<int:id>')
 def deletar(id):
     try:
-        conn = get_db()
-        cursor = conn.cursor()
-        cursor.execute('BEGIN IMMEDIATE')
-        cursor.execute('DELETE FROM clientes WHERE id=?', (id,))
-        conn.commit()
+        executar_escrita(lambda cursor: cursor.execute('DELETE FROM clientes WHERE id=?', (id,)))
+        cache_paginas.invalidar(id)
+        cache_relatorios.invalidar()
         flash('Cliente removido com sucesso!', 'success')
     except Exception as e:
-        conn.rollback()
         flash(f'Erro ao deletar: {str(e)}', 'error')
     
     response = redirect(url_for('index'))
@@ -604,15 +1780,15 @@ def deletar_ficha(ficha_id):
     try:
         conn = get_db()
         cursor = conn.cursor()
-        
-        cursor.execute('SELECT cliente_id FROM fichas WHERE id=?', (ficha_id,))
+
+        cursor.execute('SELECT cliente_id, data_entrada, data_saida FROM fichas WHERE id=?', (ficha_id,))
         result = cursor.fetchone()
-        
+
         if result:
             cliente_id = result[0]
-            cursor.execute('BEGIN IMMEDIATE')
-            cursor.execute('DELETE FROM fichas WHERE id=?', (ficha_id,))
-            conn.commit()
+            executar_escrita(lambda cursor: cursor.execute('DELETE FROM fichas WHERE id=?', (ficha_id,)))
+            cache_paginas.invalidar(cliente_id)
+            cache_relatorios.invalidar(result[1], result[2])
             flash('Ficha removida com sucesso!', 'success')
             response = redirect(url_for('ver_cliente', cliente_id=cliente_id))
             response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
@@ -620,39 +1796,64 @@ def deletar_ficha(ficha_id):
             response.headers['Expires'] = '0'
             return response
     except Exception as e:
-        conn.rollback()
         flash(f'Erro ao deletar ficha: {str(e)}', 'error')
     
     flash('Ficha não encontrada!', 'error')
     return redirect(url_for('index'))
 
+COLUNAS_EXPORTACAO = ['Nome', 'CPF', 'Email', 'Telefone', 'Data Entrada', 'Data Saida', 'Observacoes', 'Medicamento', 'Dosagem', 'Frequencia']
+
+def consultar_exportacao(cursor, busca, status, data_inicio, data_fim):
+    """Executa a consulta da exportação com os mesmos filtros da página inicial"""
+    where, params = montar_filtros(busca, status, data_inicio, data_fim)
+    cond_fichas, params_fichas = filtros_fichas(status, data_inicio, data_fim)
+    
+    cursor.execute(f'''
+        SELECT c.nome, c.cpf, c.email, c.telefone,
+               f.data_entrada, f.data_saida, f.observacoes,
+               m.nome as medicamento, m.dosagem, m.frequencia
+        FROM clientes c
+        LEFT JOIN fichas f ON c.id = f.cliente_id{cond_fichas}
+        LEFT JOIN medicamentos m ON f.id = m.ficha_id
+        WHERE {where}
+        ORDER BY c.nome, f.dia_entrada DESC
+    ''', params_fichas + params)
+    return cursor
+
 @app.route('/exportar-csv')
 def exportar_csv():
     try:
         conn = get_db()
         cursor = conn.cursor()
         
-        cursor.execute('''
-            SELECT c.nome, c.cpf, c.email, c.telefone,
-                   f.data_entrada, f.data_saida, f.observacoes,
-                   m.nome as medicamento, m.dosagem, m.frequencia
-            FROM clientes c
-            LEFT JOIN fichas f ON c.id = f.cliente_id
-            LEFT JOIN medicamentos m ON f.id = m.ficha_id
-            ORDER BY c.nome, f.data_entrada DESC
-        ''')
-        
-        dados = cursor.fetchall()
+        busca = request.args.get('busca', '')
+        status = request.args.get('status', '')
+        data_inicio = request.args.get('data_inicio', '')
+        data_fim = request.args.get('data_fim', '')
         
-        output = StringIO()
-        writer = csv.writer(output)
-        writer.writerow(['Nome', 'CPF', 'Email', 'Telefone', 'Data Entrada', 'Data Saida', 'Observacoes', 'Medicamento', 'Dosagem', 'Frequencia'])
+        consultar_exportacao(cursor, busca, status, data_inicio, data_fim)
         
-        for row in dados:
-            writer.writerow(row)
+        def gerar_linhas():
+            # Envia o CSV em blocos conforme as linhas são lidas, sem montar o arquivo inteiro em memória
+            import csv
+            from io import StringIO
+            output = StringIO()
+            writer = csv.writer(output)
+            writer.writerow(COLUNAS_EXPORTACAO)
+            
+            while True:
+                dados = cursor.fetchmany(app.config['EXPORTACAO_LOTE'])
+                if not dados:
+                    break
+                writer.writerows(dados)
+                yield output.getvalue()
+                output.seek(0)
+                output.truncate(0)
+            
+            yield output.getvalue()
+            cursor.close()
         
-        output.seek(0)
-        response = make_response(output.getvalue())
+        response = Response(stream_with_context(gerar_linhas()), mimetype='text/csv')
         response.headers['Content-Disposition'] = 'attachment; filename=clientes_export.csv'
         response.headers['Content-Type'] = 'text/csv; charset=utf-8'
         
@@ -661,8 +1862,678 @@ def exportar_csv():
         flash(f'Erro ao exportar: {str(e)}', 'error')
         return redirect(url_for('index'))
 
+# Exportações em segundo plano: o processamento roda no pool e o navegador consulta o status
+FORMATOS_EXPORTACAO = {
+    'csv': ('clientes_export.csv', 'text/csv'),
+    'csv.gz': ('clientes_export.csv.gz', 'application/gzip'),
+    'colunar': ('clientes_export.json.gz', 'application/gzip'),
+}
+
+_exportacoes = {}
+_exportacoes_lock = threading.Lock()
+_exportacoes_pool = ThreadPoolExecutor(max_workers=app.config['EXPORTACAO_WORKERS'], thread_name_prefix='exportacao')
+
+def _gravar_exportacao(job, filtros):
+    import csv
+    import gzip
+    
+    with _exportacoes_lock:
+        job['status'] = 'executando'
+    
+    try:
+        cursor = get_db().cursor()
+        consultar_exportacao(cursor, **filtros)
+        linhas = 0
+        
+        if job['formato'] == 'colunar':
+            # Um array por coluna, compactado: ocupa bem menos que o CSV para dados repetitivos.
+            # Cada lote é anexado ao arquivo temporário da sua coluna; no fim os arrays são emendados
+            # no gzip, então a memória fica no tamanho de um lote e não no da exportação inteira
+            temporarios = [tempfile.TemporaryFile('w+', encoding='utf-8') for _ in COLUNAS_EXPORTACAO]
+            try:
+                while True:
+                    dados = cursor.fetchmany(app.config['EXPORTACAO_LOTE'])
+                    if not dados:
+                        break
+                    for temporario, valores in zip(temporarios, zip(*dados)):
+                        if linhas:
+                            temporario.write(',')
+                        temporario.write(','.join(json.dumps(valor, ensure_ascii=False) for valor in valores))
+                    linhas += len(dados)
+                with gzip.open(job['caminho'], 'wt', encoding='utf-8') as arquivo:
+                    arquivo.write(f'{{"linhas": {linhas}, "colunas": {{')
+                    for i, (nome, temporario) in enumerate(zip(COLUNAS_EXPORTACAO, temporarios)):
+                        arquivo.write(f'{", " if i else ""}{json.dumps(nome, ensure_ascii=False)}: [')
+                        temporario.seek(0)
+                        shutil.copyfileobj(temporario, arquivo)
+                        arquivo.write(']')
+                    arquivo.write('}}')
+            finally:
+                for temporario in temporarios:
+                    temporario.close()
+        else:
+            abrir = gzip.open if job['formato'] == 'csv.gz' else open
+            with abrir(job['caminho'], 'wt', encoding='utf-8', newline='') as arquivo:
+                writer = csv.writer(arquivo)
+                writer.writerow(COLUNAS_EXPORTACAO)
+                while True:
+                    dados = cursor.fetchmany(app.config['EXPORTACAO_LOTE'])
+                    if not dados:
+                        break
+                    writer.writerows(dados)
+                    linhas += len(dados)
+        cursor.close()
+        
+        with _exportacoes_lock:
+            job['status'] = 'concluido'
+            job['linhas'] = linhas
+            job['tamanho'] = os.path.getsize(job['caminho'])
+            job['concluido_em'] = time.time()
+    except Exception as e:
+        with _exportacoes_lock:
+            job['status'] = 'erro'
+            job['erro'] = str(e)
+            job['concluido_em'] = time.time()
+        if os.path.exists(job['caminho']):
+            os.remove(job['caminho'])
+
+def _executar_exportacao(job, filtros):
+    # Roda fora de uma requisição: o contexto da aplicação devolve a conexão ao pool no final
+    with app.app_context():
+        g.unidade = job['unidade']
+        _gravar_exportacao(job, filtros)
+
+def limpar_exportacoes():
+    """Remove exportações antigas (inclusive arquivos órfãos na pasta) e, se preciso, as mais velhas até caber no limite de espaço"""
+    agora = time.time()
+    with _exportacoes_lock:
+        finalizados = sorted(
+            (job for job in _exportacoes.values() if job['status'] in ('concluido', 'erro')),
+            key=lambda job: job['concluido_em']
+        )
+        total = sum(job.get('tamanho', 0) for job in finalizados)
+        removidos = []
+        for job in finalizados:
+            if agora - job['concluido_em'] > app.config['EXPORTACAO_IDADE_MAXIMA'] \
+                    or total > app.config['EXPORTACAO_ESPACO_MAXIMO']:
+                total -= job.get('tamanho', 0)
+                removidos.append(_exportacoes.pop(job['id']))
+    
+    for job in removidos:
+        if os.path.exists(job['caminho']):
+            os.remove(job['caminho'])
+    
+    # Arquivos sem job em memória (de uma execução anterior do sistema) expiram pela data de modificação
+    with _exportacoes_lock:
+        conhecidos = set(_exportacoes)
+    pasta = app.config['EXPORTACAO_PASTA']
+    for nome in os.listdir(pasta):
+        if nome.split('_', 1)[0] in conhecidos:
+            continue
+        caminho = os.path.join(pasta, nome)
+        try:
+            if agora - os.path.getmtime(caminho) > app.config['EXPORTACAO_IDADE_MAXIMA']:
+                os.remove(caminho)
+        except OSError:
+            pass  # removido em paralelo ou ainda aberto
+
+def _status_exportacao(job):
+    return {
+        'id': job['id'],
+        'formato': job['formato'],
+        'status': job['status'],
+        'linhas': job.get('linhas'),
+        'tamanho': job.get('tamanho'),
+        'erro': job.get('erro'),
+        'status_url': url_for('status_exportacao', job_id=job['id']),
+        'download_url': url_for('baixar_exportacao', job_id=job['id']) if job['status'] == 'concluido' else None,
+    }
+
+@app.route('/exportacoes', methods=['POST'])
+def iniciar_exportacao():
+    formato = request.form.get('formato', 'csv')
+    if formato not in FORMATOS_EXPORTACAO:
+        return jsonify({'erro': f'Formato inválido: {formato}'}), 400
+    
+    limpar_exportacoes()
+    
+    job_id = uuid.uuid4().hex
+    nome_arquivo, _ = FORMATOS_EXPORTACAO[formato]
+    job = {
+        'id': job_id,
+        'formato': formato,
+        'unidade': unidade_atual(),
+        'status': 'pendente',
+        'caminho': os.path.join(app.config['EXPORTACAO_PASTA'], f'{job_id}_{nome_arquivo}'),
+        'criado_em': time.time(),
+    }
+    filtros = {campo: request.form.get(campo, '') for campo in ('busca', 'status', 'data_inicio', 'data_fim')}
+    
+    with _exportacoes_lock:
+        _exportacoes[job_id] = job
+    _exportacoes_pool.submit(_executar_exportacao, job, filtros)
+    
+    return jsonify(_status_exportacao(job)), 202
+
+@app.route('/exportacoes/<job_id>')
+def status_exportacao(job_id):
+    with _exportacoes_lock:
+        job = _exportacoes.get(job_id)
+        if not job:
+            return jsonify({'erro': 'Exportação não encontrada'}), 404
+        return jsonify(_status_exportacao(job))
+
+@app.route('/exportacoes/<job_id>/download')
+def baixar_exportacao(job_id):
+    with _exportacoes_lock:
+        job = _exportacoes.get(job_id)
+    
+    if not job or job['status'] != 'concluido' or not os.path.exists(job['caminho']):
+        flash('Exportação não encontrada ou ainda em andamento!', 'error')
+        return redirect(url_for('index'))
+    
+    nome_arquivo, mimetype = FORMATOS_EXPORTACAO[job['formato']]
+    return send_file(job['caminho'], as_attachment=True, download_name=nome_arquivo, mimetype=mimetype)
+
+CAMPOS_IMPORTACAO = ['nome', 'cpf', 'email', 'telefone', 'data_entrada', 'data_saida', 'observacoes', 'medicamentos', 'familiares']
+
+def ler_registros_importacao(arquivo, nome_arquivo):
+    """Lê os pacientes de um arquivo CSV ou JSON; em CSV, medicamentos/familiares vêm como JSON na célula"""
+    conteudo = arquivo.read()
+    if isinstance(conteudo, bytes):
+        conteudo = conteudo.decode('utf-8-sig')
+    
+    if nome_arquivo.lower().endswith('.json'):
+        registros = json.loads(conteudo)
+        if not isinstance(registros, list):
+            raise ValueError('o JSON deve ser uma lista de pacientes')
+    else:
+        import csv
+        from io import StringIO
+        registros = list(csv.DictReader(StringIO(conteudo)))
+    
+    for registro in registros:
+        if not isinstance(registro, dict):
+            continue  # recusado linha a linha na validação
+        for campo in ('medicamentos', 'familiares'):
+            valor = registro.get(campo) or []
+            if isinstance(valor, str):
+                try:
+                    valor = json.loads(valor)
+                except ValueError:
+                    pass  # o texto fica como veio e a validação aponta a linha
+            registro[campo] = valor
+    return registros
+
+CAMPOS_ITENS_IMPORTACAO = {
+    'medicamentos': ('nome', 'dosagem', 'frequencia', 'observacoes'),
+    'familiares': ('nome', 'parentesco', 'telefone', 'email', 'endereco', 'observacoes'),
+}
+
+def _validar_itens(campo, valor):
+    """Normaliza a lista de medicamentos/familiares de uma linha; ValueError se não for uma lista de objetos com nome"""
+    if not valor:
+        return []
+    if not isinstance(valor, list):
+        raise ValueError(f'{campo.capitalize()} inválidos: esperada uma lista')
+    itens = []
+    for n, item in enumerate(valor, 1):
+        if not isinstance(item, dict):
+            raise ValueError(f'{campo.capitalize()} inválidos: o item {n} não é um objeto')
+        limpo = {chave: str(item.get(chave) or '').strip() for chave in CAMPOS_ITENS_IMPORTACAO[campo]}
+        if not limpo['nome']:
+            raise ValueError(f'{campo.capitalize()} inválidos: o item {n} está sem nome')
+        itens.append(limpo)
+    return itens
+
+def _validar_importacao(registros):
+    """Valida todos os registros de uma vez e devolve (válidos, erros) com o número da linha de origem"""
+    objetos = [r if isinstance(r, dict) else {} for r in registros]
+    campos = {campo: [str(r.get(campo) or '').strip() for r in objetos] for campo in CAMPOS_IMPORTACAO[:7]}
+    cpfs = [re.sub(r'\D', '', cpf) for cpf in campos['cpf']]
+    cpf_ok = [validar_cpf(cpf) for cpf in campos['cpf']]
+    email_ok = [validar_email(email) for email in campos['email']]
+    obrigatorios_ok = [all(campos[c][i] for c in ('nome', 'cpf', 'email', 'telefone', 'data_entrada'))
+                       for i in range(len(registros))]
+    datas = []
+    for entrada, saida in zip(campos['data_entrada'], campos['data_saida']):
+        try:
+            datas.append(validar_datas(entrada, saida or None))
+        except ValueError as e:
+            datas.append(str(e))
+    
+    itens = []
+    for registro in objetos:
+        try:
+            itens.append({campo: _validar_itens(campo, registro.get(campo)) for campo in CAMPOS_ITENS_IMPORTACAO})
+        except ValueError as e:
+            itens.append(str(e))
+    
+    validos, erros, vistos = [], [], set()
+    for i, registro in enumerate(registros):
+        linha = i + 1
+        if not isinstance(registro, dict):
+            erros.append({'linha': linha, 'erro': 'A linha não é um objeto com os dados do paciente'})
+        elif not obrigatorios_ok[i]:
+            erros.append({'linha': linha, 'erro': 'Campos obrigatórios ausentes'})
+        elif not cpf_ok[i]:
+            erros.append({'linha': linha, 'erro': 'CPF inválido! Deve conter 11 dígitos.'})
+        elif not email_ok[i]:
+            erros.append({'linha': linha, 'erro': 'Email inválido!'})
+        elif isinstance(datas[i], str):
+            erros.append({'linha': linha, 'erro': datas[i]})
+        elif isinstance(itens[i], str):
+            erros.append({'linha': linha, 'erro': itens[i]})
+        elif cpfs[i] in vistos:
+            erros.append({'linha': linha, 'erro': 'CPF repetido no arquivo'})
+        else:
+            vistos.add(cpfs[i])
+            validos.append({
+                'linha': linha,
+                'nome': campos['nome'][i],
+                'cpf': cpfs[i],
+                'email': campos['email'][i],
+                'telefone': campos['telefone'][i],
+                'data_entrada': datas[i][0],
+                'data_saida': datas[i][1],
+                'observacoes': campos['observacoes'][i],
+                'medicamentos': itens[i]['medicamentos'],
+                'familiares': itens[i]['familiares'],
+            })
+    return validos, erros
+
+_PROXIMO_ID = '''
+    SELECT MAX(COALESCE((SELECT seq FROM sqlite_sequence WHERE name = '{tabela}'), 0),
+               COALESCE((SELECT MAX(id) FROM {tabela}), 0)) + 1
+'''
+
+def importar_pacientes(registros):
+    """Importa pacientes em lotes transacionais com executemany; uma linha inválida não interrompe as demais"""
+    validos, erros = _validar_importacao(registros)
+    importados = 0
+    tamanho_lote = app.config['IMPORTACAO_LOTE']
+    
+    def gravar_lote(lote):
+        def gravar(cursor):
+            cursor.execute(f'''
+                SELECT cpf FROM clientes WHERE cpf IN ({','.join('?' * len(lote))})
+            ''', [r['cpf'] for r in lote])
+            existentes = {row[0] for row in cursor.fetchall()}
+            novos = [r for r in lote if r['cpf'] not in existentes]
+            
+            # Na fila de escrita os ids podem ser reservados antes para ligar fichas, medicamentos e familiares.
+            # A base vem do sqlite_sequence (AUTOINCREMENT): ids de registros apagados nunca são reutilizados;
+            # o INSERT com id explícito maior que a sequência já a atualiza
+            proximo_cliente = cursor.execute(_PROXIMO_ID.format(tabela='clientes')).fetchone()[0]
+            proxima_ficha = cursor.execute(_PROXIMO_ID.format(tabela='fichas')).fetchone()[0]
+            clientes, fichas, medicamentos, familiares = [], [], [], []
+            for n, r in enumerate(novos):
+                cliente_id, ficha_id = proximo_cliente + n, proxima_ficha + n
+                clientes.append((cliente_id, r['nome'], r['cpf'], r['email'], r['telefone']))
+                fichas.append((ficha_id, cliente_id, r['data_entrada'], r['data_saida'], r['observacoes']))
+                # Itens já normalizados em _validar_importacao: nada aqui pode falhar por formato
+                medicamentos.extend((ficha_id, med['nome'], med['dosagem'], med['frequencia'], med['observacoes'])
+                                    for med in r['medicamentos'])
+                familiares.extend((cliente_id, fam['nome'], fam['parentesco'], fam['telefone'], fam['email'],
+                                   fam['endereco'], fam['observacoes']) for fam in r['familiares'])
+            
+            cursor.executemany('''
+                INSERT INTO clientes (id, nome, cpf, email, telefone)
+                VALUES (?, ?, ?, ?, ?)
+            ''', clientes)
+            cursor.executemany('''
+                INSERT INTO fichas (id, cliente_id, data_entrada, data_saida, observacoes)
+                VALUES (?, ?, ?, ?, ?)
+            ''', fichas)
+            cursor.executemany('''
+                INSERT INTO medicamentos (ficha_id, nome, dosagem, frequencia, observacoes)
+                VALUES (?, ?, ?, ?, ?)
+            ''', medicamentos)
+            cursor.executemany('''
+                INSERT INTO familiares (cliente_id, nome, parentesco, telefone, email, endereco, observacoes)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', familiares)
+            return len(novos), [r for r in lote if r['cpf'] in existentes]
+        return gravar
+    
+    # Cada lote é uma unidade da fila de escrita: se falhar, só ele é desfeito
+    lotes = [validos[inicio:inicio + tamanho_lote] for inicio in range(0, len(validos), tamanho_lote)]
+    for lote in lotes:
+        try:
+            inseridos, repetidos = executar_escrita(gravar_lote(lote))
+            if inseridos:
+                cache_relatorios.invalidar()
+            importados += inseridos
+            erros.extend({'linha': r['linha'], 'erro': 'CPF já cadastrado'} for r in repetidos)
+        except Exception as e:
+            erros.extend({'linha': r['linha'], 'erro': f'Erro ao importar lote: {str(e)}'} for r in lote)
+    
+    erros.sort(key=lambda erro: erro['linha'])
+    return {'total': len(registros), 'importados': importados, 'erros': erros}
+
+@app.route('/importar', methods=['POST'])
+def importar():
+    arquivo = request.files.get('arquivo')
+    if not arquivo or arquivo.filename == '':
+        return jsonify({'erro': 'Nenhum arquivo selecionado!'}), 400
+    
+    try:
+        registros = ler_registros_importacao(arquivo.stream, arquivo.filename)
+    except Exception as e:
+        return jsonify({'erro': f'Arquivo inválido: {str(e)}'}), 400
+    
+    return jsonify(importar_pacientes(registros))
+
+@app.cli.command('importar')
+@click.argument('caminho', type=click.Path(exists=True, dir_okay=False))
+@click.option('--unidade', help='identificador da unidade (padrão: a unidade padrão)')
+def importar_comando(caminho, unidade):
+    """Importa pacientes de um arquivo CSV ou JSON."""
+    g.unidade, = _unidades_comando(unidade or app.config['UNIDADE_PADRAO'])
+    preparar_unidade(g.unidade)
+    # O cache de relatórios termina junto com o comando: nada a recalcular em segundo plano
+    app.config['RELATORIOS_AQUECER'] = False
+    try:
+        with open(caminho, encoding='utf-8-sig') as arquivo:
+            registros = ler_registros_importacao(arquivo, caminho)
+    except ValueError as e:
+        raise click.ClickException(f'Arquivo inválido: {e}')
+    relatorio = importar_pacientes(registros)
+    click.echo(f"{relatorio['importados']} de {relatorio['total']} pacientes importados")
+    for erro in relatorio['erros']:
+        click.echo(f"Linha {erro['linha']}: {erro['erro']}", err=True)
+
+# Documentos ficam em uploads/objetos/ab/cd/<sha256>: arquivos idênticos são gravados uma vez só
+# e o blob é apagado quando o último documento que aponta para ele é removido.
+def caminho_objeto(hash_conteudo):
+    return '/'.join(('objetos', hash_conteudo[:2], hash_conteudo[2:4], hash_conteudo))
+
+def _copiar_com_hash(origem, destino):
+    """Copia o stream em blocos para o arquivo de destino, calculando o SHA-256 no caminho"""
+    sha = hashlib.sha256()
+    tamanho = 0
+    while True:
+        bloco = origem.read(app.config['UPLOAD_CHUNK'])
+        if not bloco:
+            break
+        sha.update(bloco)
+        destino.write(bloco)
+        tamanho += len(bloco)
+    return sha.hexdigest(), tamanho
+
+class _Descartar:
+    def write(self, bloco):
+        pass
+
+def _hash_arquivo(caminho):
+    with open(caminho, 'rb') as arquivo:
+        return _copiar_com_hash(arquivo, _Descartar())
+
+def _comprimir_arquivo(origem):
+    """Grava <origem>.gz ao lado do arquivo; devolve (caminho, tamanho) ou None se não compensar"""
+    import gzip
+    destino = f'{origem}.{uuid.uuid4().hex}.gz'
+    with open(origem, 'rb') as entrada, gzip.open(destino, 'wb', compresslevel=app.config['COMPRESSAO_NIVEL']) as saida:
+        while True:
+            bloco = entrada.read(app.config['UPLOAD_CHUNK'])
+            if not bloco:
+                break
+            saida.write(bloco)
+    tamanho = os.path.getsize(destino)
+    if tamanho >= os.path.getsize(origem) * app.config['COMPRESSAO_GANHO_MINIMO']:
+        os.remove(destino)
+        return None
+    return destino, tamanho
+
+def comprimivel(nome_original):
+    return nome_original.rsplit('.', 1)[-1].lower() in EXTENSOES_COMPRIMIVEIS
+
+def abrir_documento(nome_arquivo, compressao, unidade=None):
+    """Abre o arquivo armazenado para leitura do conteúdo original, descomprimindo sob demanda"""
+    caminho = os.path.join(pasta_uploads(unidade), nome_arquivo)
+    if compressao == 'gzip':
+        import gzip
+        return gzip.open(caminho, 'rb')
+    return open(caminho, 'rb')
+
+def registrar_documento(cliente_id, caminho_temp, hash_conteudo, tamanho, nome_original, tipo_documento, observacoes):
+    """Move o arquivo recebido para o armazenamento por conteúdo e grava o documento; devolve o id"""
+    nome_arquivo = caminho_objeto(hash_conteudo)
+    compressao = None
+    tamanho_armazenado = tamanho
+    
+    # A compressão (CPU) fica fora da fila de escrita; se o conteúdo já existir, o resultado é descartado
+    if app.config['COMPRIMIR_DOCUMENTOS'] and comprimivel(nome_original):
+        comprimido = _comprimir_arquivo(caminho_temp)
+        if comprimido:
+            os.remove(caminho_temp)
+            caminho_temp, tamanho_armazenado = comprimido
+            nome_arquivo += '.gz'
+            compressao = 'gzip'
+    
+    # A fila de escrita roda sem contexto da requisição: a pasta da unidade é resolvida aqui
+    unidade = unidade_atual()
+    pasta = pasta_uploads(unidade)
+    destino = os.path.join(pasta, nome_arquivo)
+    # O arquivo vai antes para um nome provisório ao lado do destino: na fila resta só um rename atômico
+    provisorio = f'{destino}.{uuid.uuid4().hex}.tmp'
+    os.makedirs(os.path.dirname(destino), exist_ok=True)
+    shutil.move(caminho_temp, provisorio)
+    
+    # Roda na fila de escrita, serializada com a remoção de documentos, então a contagem de
+    # referências e a existência do blob não mudam entre a verificação e o INSERT
+    def gravar(cursor):
+        nonlocal nome_arquivo, compressao, tamanho_armazenado
+        cursor.execute('''
+            SELECT nome_arquivo, compressao, tamanho_armazenado FROM documentos WHERE hash_conteudo=? LIMIT 1
+        ''', (hash_conteudo,))
+        existente = cursor.fetchone()
+        if existente and os.path.exists(os.path.join(pasta, existente[0])):
+            # Mesmo conteúdo já armazenado (talvez em outro formato): reaproveita o blob
+            nome_arquivo, compressao, tamanho_armazenado = existente
+        else:
+            os.replace(provisorio, destino)
+        cursor.execute('''
+            INSERT INTO documentos (cliente_id, nome_arquivo, nome_original, tipo_documento, tamanho, observacoes,
+                                    hash_conteudo, tamanho_armazenado, compressao)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (cliente_id, nome_arquivo, nome_original, tipo_documento, tamanho, observacoes,
+              hash_conteudo, tamanho_armazenado, compressao))
+        return cursor.lastrowid
+    
+    try:
+        documento_id = executar_escrita(gravar)
+    except Exception:
+        # INSERT ou COMMIT falhou: o blob já renomeado só sai se nenhum documento gravado usar o mesmo arquivo
+        try:
+            remover_blob_sem_referencias(nome_arquivo, unidade)
+        except Exception:
+            app.logger.exception('Falha ao descartar o arquivo de %s', nome_original)
+        raise
+    finally:
+        if os.path.exists(provisorio):
+            os.remove(provisorio)
+    cache_paginas.invalidar(cliente_id)
+    agendar_previa(nome_arquivo, nome_original, compressao)
+    return documento_id
+
+def remover_blob_sem_referencias(nome_arquivo, unidade):
+    """Apaga o blob e a miniatura se nenhum documento aponta mais para eles.
+    
+    Roda como unidade própria da fila depois do COMMIT que tirou a referência: o arquivo só some quando
+    a remoção da linha já é durável, e a verificação fica serializada com os envios do mesmo conteúdo.
+    """
+    caminhos = (os.path.join(pasta_uploads(unidade), nome_arquivo), caminho_previa(nome_arquivo, unidade))
+    
+    def remover(cursor):
+        cursor.execute('SELECT 1 FROM documentos WHERE nome_arquivo=? LIMIT 1', (nome_arquivo,))
+        if cursor.fetchone():
+            return
+        for caminho in caminhos:
+            if os.path.exists(caminho):
+                os.remove(caminho)
+    
+    executar_escrita(remover, caminho_unidade(unidade))
+
+def recomprimir_documentos():
+    """Comprime no lugar os documentos já armazenados sem compressão; devolve (arquivos, bytes economizados)"""
+    unidade = unidade_atual()
+    pasta = pasta_uploads(unidade)
+    cursor = get_db().cursor()
+    cursor.execute('''
+        SELECT nome_arquivo, MIN(nome_original), MAX(tamanho) FROM documentos
+        WHERE compressao IS NULL GROUP BY nome_arquivo
+    ''')
+    arquivos = economia = 0
+    for nome_arquivo, nome_original, tamanho in cursor.fetchall():
+        origem = os.path.join(pasta, nome_arquivo)
+        if not comprimivel(nome_original) or not os.path.exists(origem):
+            continue
+        comprimido = _comprimir_arquivo(origem)
+        if not comprimido:
+            continue
+        
+        # O comprimido ganha o nome definitivo antes da troca, sem que nenhuma linha aponte para ele;
+        # o original só sai depois que o UPDATE das referências estiver gravado
+        destino = origem + '.gz'
+        if os.path.exists(destino):
+            os.remove(comprimido[0])  # mesmo conteúdo já comprimido por outro documento
+            armazenado = os.path.getsize(destino)
+        else:
+            os.replace(comprimido[0], destino)
+            armazenado = comprimido[1]
+        
+        def trocar(cursor, nome_arquivo=nome_arquivo, armazenado=armazenado):
+            cursor.execute('''
+                UPDATE documentos SET nome_arquivo=?, compressao='gzip', tamanho_armazenado=?
+                WHERE nome_arquivo=? AND compressao IS NULL
+            ''', (nome_arquivo + '.gz', armazenado, nome_arquivo))
+            return cursor.rowcount
+        
+        try:
+            trocados = executar_escrita(trocar)
+        except Exception:
+            trocados = 0
+            app.logger.exception('Falha ao atualizar as referências de %s', nome_arquivo)
+        if not trocados:
+            remover_blob_sem_referencias(nome_arquivo + '.gz', unidade)
+            continue
+        
+        previa = caminho_previa(nome_arquivo, unidade)
+        if os.path.exists(previa) and not os.path.exists(caminho_previa(nome_arquivo + '.gz', unidade)):
+            os.replace(previa, caminho_previa(nome_arquivo + '.gz', unidade))
+        remover_blob_sem_referencias(nome_arquivo, unidade)
+        arquivos += 1
+        economia += (tamanho or 0) - armazenado
+    return arquivos, economia
+
+@app.cli.command('recomprimir-documentos')
+@_opcao_unidade
+def recomprimir_comando(unidade):
+    """Comprime os documentos já armazenados (PDF, DOC, DOCX, TXT)."""
+    for unidade in _unidades_comando(unidade):
+        preparar_unidade(unidade)
+        # Um contexto por unidade: a conexão guardada em g é do banco da unidade
+        with app.app_context():
+            g.unidade = unidade
+            arquivos, economia = recomprimir_documentos()
+        click.echo(f'{unidade}: {arquivos} arquivos comprimidos, {economia / (1024 * 1024):.1f} MB economizados')
+
+# Miniaturas: geradas em segundo plano e gravadas ao lado do original (<blob>.previa.jpg)
+_previas_pool = ThreadPoolExecutor(max_workers=app.config['PREVIA_WORKERS'], thread_name_prefix='previa')
+
+def caminho_previa(nome_arquivo, unidade=None):
+    return os.path.join(pasta_uploads(unidade), nome_arquivo + '.previa.jpg')
+
+def gerar_previa(nome_arquivo, extensao, compressao=None, unidade=None):
+    """Gera a miniatura de uma imagem ou da primeira página de um PDF, se as bibliotecas estiverem instaladas"""
+    destino = caminho_previa(nome_arquivo, unidade)
+    if os.path.exists(destino):
+        return
+    
+    try:
+        from PIL import Image, ImageOps
+    except ImportError:
+        return
+    
+    temporario = f'{destino}.{uuid.uuid4().hex}.tmp'
+    tamanho = app.config['PREVIA_TAMANHO']
+    try:
+        if extensao == 'pdf':
+            try:
+                import fitz
+            except ImportError:
+                return
+            with abrir_documento(nome_arquivo, compressao, unidade) as origem:
+                conteudo = origem.read()
+            with fitz.open(stream=conteudo, filetype='pdf') as pdf:
+                pagina = pdf[0]
+                escala = tamanho / max(pagina.rect.width, pagina.rect.height)
+                pixmap = pagina.get_pixmap(matrix=fitz.Matrix(escala, escala), alpha=False)
+                imagem = Image.frombytes('RGB', (pixmap.width, pixmap.height), pixmap.samples)
+        else:
+            with abrir_documento(nome_arquivo, compressao, unidade) as origem, Image.open(origem) as original:
+                imagem = ImageOps.exif_transpose(original)
+                imagem.thumbnail((tamanho, tamanho))
+                imagem = imagem.convert('RGB')
+        imagem.save(temporario, 'JPEG', quality=80, optimize=True)
+        os.replace(temporario, destino)
+    except Exception as e:
+        app.logger.warning('Falha ao gerar miniatura de %s: %s', nome_arquivo, e)
+        if os.path.exists(temporario):
+            os.remove(temporario)
+
+_extensoes_previa = None
+
+def extensoes_previa():
+    """Extensões com miniatura nesta instalação: Pillow para todas e PyMuPDF para PDF, verificados uma vez só"""
+    global _extensoes_previa
+    if _extensoes_previa is None:
+        from importlib.util import find_spec
+        if find_spec('PIL') is None:
+            _extensoes_previa = set()
+        elif find_spec('fitz') is None:
+            _extensoes_previa = EXTENSOES_PREVIA - {'pdf'}
+        else:
+            _extensoes_previa = set(EXTENSOES_PREVIA)
+    return _extensoes_previa
+
+def agendar_previa(nome_arquivo, nome_original, compressao=None):
+    extensao = nome_original.rsplit('.', 1)[-1].lower()
+    if extensao in extensoes_previa():
+        _previas_pool.submit(gerar_previa, nome_arquivo, extensao, compressao, unidade_atual())
+
+@app.route('/previa-documento/<int:doc_id>')
+def previa_documento(doc_id):
+    cursor = get_db().cursor()
+    cursor.execute('SELECT nome_arquivo, nome_original, hash_conteudo, compressao FROM documentos WHERE id=?', (doc_id,))
+    documento = cursor.fetchone()
+    if not documento:
+        return '', 404
+    
+    hash_conteudo = documento[2]
+    if hash_conteudo and request.if_none_match.contains(hash_conteudo):
+        response = make_response('', 304)
+        response.set_etag(hash_conteudo)
+        return response
+    
+    caminho = caminho_previa(documento[0])
+    if not os.path.exists(caminho):
+        # Ainda não gerada (ou documento anterior ao pipeline): agenda e deixa a página sem a miniatura
+        agendar_previa(documento[0], documento[1], documento[3])
+        return '', 404
+    
+    response = send_file(caminho, mimetype='image/jpeg', max_age=app.config['PREVIA_MAX_AGE'],
+                         etag=hash_conteudo or True, conditional=True)
+    response.cache_control.public = False
+    response.cache_control.private = True
+    response.cache_control.immutable = bool(hash_conteudo)
+    return response
+
 @app.route('/upload-documento/<int:cliente_id>', methods=['POST'])
 def upload_documento(cliente_id):
+    from werkzeug.utils import secure_filename
+    
     if 'arquivo' not in request.files:
         flash('Nenhum arquivo selecionado!', 'error')
         return redirect(url_for('ver_cliente', cliente_id=cliente_id))
@@ -676,50 +2547,198 @@ def upload_documento(cliente_id):
     if arquivo and allowed_file(arquivo.filename):
         tipo_documento = request.form.get('tipo_documento', 'Outro')
         observacoes = request.form.get('observacoes_doc', '')
-        
         nome_original = secure_filename(arquivo.filename)
-        extensao = nome_original.rsplit('.', 1)[1].lower()
-        nome_arquivo = f"cliente_{cliente_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{extensao}"
-        
-        caminho_arquivo = os.path.join(app.config['UPLOAD_FOLDER'], nome_arquivo)
-        arquivo.save(caminho_arquivo)
-        
-        tamanho = os.path.getsize(caminho_arquivo)
         
+        caminho_temp = os.path.join(app.config['PASTA_PARCIAIS'], f'{uuid.uuid4().hex}.tmp')
         try:
-            conn = get_db()
-            cursor = conn.cursor()
-            cursor.execute('''
-                INSERT INTO documentos (cliente_id, nome_arquivo, nome_original, tipo_documento, tamanho, observacoes)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (cliente_id, nome_arquivo, nome_original, tipo_documento, tamanho, observacoes))
-            conn.commit()
+            with open(caminho_temp, 'wb') as destino:
+                hash_conteudo, tamanho = _copiar_com_hash(arquivo.stream, destino)
+            registrar_documento(cliente_id, caminho_temp, hash_conteudo, tamanho, nome_original, tipo_documento, observacoes)
             flash('Documento enviado com sucesso!', 'success')
         except Exception as e:
             flash(f'Erro ao salvar documento: {str(e)}', 'error')
-            if os.path.exists(caminho_arquivo):
-                os.remove(caminho_arquivo)
+            if os.path.exists(caminho_temp):
+                os.remove(caminho_temp)
     else:
         flash('Tipo de arquivo não permitido! Use: PDF, JPG, PNG, DOC, DOCX, TXT', 'error')
     
     return redirect(url_for('ver_cliente', cliente_id=cliente_id))
 
+# Envio em partes (retomável): o navegador cria uma sessão e manda o arquivo em pedaços com
+# Content-Range; cada parte é gravada direto no disco e, se a conexão cair, o envio continua
+# do último byte recebido.
+_sessoes_upload_locks = {}
+_sessoes_upload_lock = threading.Lock()
+
+def _arquivos_sessao(upload_id):
+    if not re.fullmatch(r'[0-9a-f]{32}', upload_id):
+        return None, None
+    base = os.path.join(app.config['PASTA_PARCIAIS'], upload_id)
+    return base + '.json', base + '.part'
+
+def _lock_sessao(upload_id):
+    with _sessoes_upload_lock:
+        return _sessoes_upload_locks.setdefault(upload_id, threading.Lock())
+
+def limpar_uploads_parciais():
+    """Descarta envios em partes abandonados há mais tempo que UPLOAD_PARCIAL_VALIDADE"""
+    limite = time.time() - app.config['UPLOAD_PARCIAL_VALIDADE']
+    for nome in os.listdir(app.config['PASTA_PARCIAIS']):
+        caminho = os.path.join(app.config['PASTA_PARCIAIS'], nome)
+        try:
+            if os.path.getmtime(caminho) < limite:
+                os.remove(caminho)
+        except OSError:
+            pass
+
+@app.route('/upload-documento/<int:cliente_id>/sessoes', methods=['POST'])
+def iniciar_upload(cliente_id):
+    from werkzeug.utils import secure_filename
+    
+    nome_original = secure_filename(request.form.get('nome_arquivo', ''))
+    tamanho = request.form.get('tamanho', type=int)
+    
+    if not nome_original or not allowed_file(nome_original):
+        return jsonify({'erro': 'Tipo de arquivo não permitido! Use: PDF, JPG, PNG, DOC, DOCX, TXT'}), 400
+    if tamanho is None or tamanho <= 0 or tamanho > app.config['UPLOAD_TAMANHO_MAXIMO']:
+        return jsonify({'erro': 'Tamanho de arquivo inválido!'}), 400
+    
+    cursor = get_db().cursor()
+    cursor.execute('SELECT id FROM clientes WHERE id=?', (cliente_id,))
+    if not cursor.fetchone():
+        return jsonify({'erro': 'Cliente não encontrado!'}), 404
+    
+    limpar_uploads_parciais()
+    
+    upload_id = uuid.uuid4().hex
+    caminho_meta, caminho_parte = _arquivos_sessao(upload_id)
+    with open(caminho_meta, 'w', encoding='utf-8') as meta:
+        json.dump({
+            'cliente_id': cliente_id,
+            'nome_original': nome_original,
+            'tamanho': tamanho,
+            'tipo_documento': request.form.get('tipo_documento', 'Outro'),
+            'observacoes': request.form.get('observacoes_doc', ''),
+        }, meta)
+    open(caminho_parte, 'wb').close()
+    
+    return jsonify({'upload_id': upload_id, 'recebido': 0, 'chunk': app.config['UPLOAD_CHUNK']}), 201
+
+@app.route('/upload-sessoes/<upload_id>', methods=['GET'])
+def status_upload(upload_id):
+    caminho_meta, caminho_parte = _arquivos_sessao(upload_id)
+    if not caminho_meta or not os.path.exists(caminho_meta):
+        return jsonify({'erro': 'Envio não encontrado'}), 404
+    with open(caminho_meta, encoding='utf-8') as meta:
+        tamanho = json.load(meta)['tamanho']
+    return jsonify({'upload_id': upload_id, 'recebido': os.path.getsize(caminho_parte), 'tamanho': tamanho})
+
+@app.route('/upload-sessoes/<upload_id>', methods=['PUT'])
+def enviar_parte_upload(upload_id):
+    caminho_meta, caminho_parte = _arquivos_sessao(upload_id)
+    if not caminho_meta or not os.path.exists(caminho_meta):
+        return jsonify({'erro': 'Envio não encontrado'}), 404
+    
+    intervalo = re.fullmatch(r'bytes (\d+)-(\d+)/(\d+)', request.headers.get('Content-Range', ''))
+    if not intervalo:
+        return jsonify({'erro': 'Cabeçalho Content-Range inválido'}), 400
+    inicio, fim, total = (int(valor) for valor in intervalo.groups())
+    
+    with _lock_sessao(upload_id):
+        with open(caminho_meta, encoding='utf-8') as meta:
+            sessao = json.load(meta)
+        recebido = os.path.getsize(caminho_parte)
+        
+        if total != sessao['tamanho'] or fim < inicio or fim >= total:
+            return jsonify({'erro': 'Intervalo fora do tamanho declarado'}), 400
+        if inicio != recebido:
+            return jsonify({'erro': 'Parte fora de ordem', 'recebido': recebido}), 409
+        
+        with open(caminho_parte, 'ab') as parte:
+            while True:
+                bloco = request.stream.read(min(app.config['UPLOAD_CHUNK'], fim + 1 - recebido))
+                if not bloco:
+                    break
+                parte.write(bloco)
+                recebido += len(bloco)
+        
+        if recebido != fim + 1:
+            # Parte incompleta (conexão interrompida): o cliente retoma a partir de 'recebido'
+            return jsonify({'erro': 'Parte incompleta', 'recebido': recebido}), 409
+        
+        if recebido < total:
+            return jsonify({'upload_id': upload_id, 'recebido': recebido, 'tamanho': total})
+        
+        try:
+            hash_conteudo, tamanho = _hash_arquivo(caminho_parte)
+            documento_id = registrar_documento(sessao['cliente_id'], caminho_parte, hash_conteudo, tamanho,
+                                               sessao['nome_original'], sessao['tipo_documento'], sessao['observacoes'])
+        except Exception as e:
+            return jsonify({'erro': f'Erro ao salvar documento: {str(e)}'}), 500
+        finally:
+            os.remove(caminho_meta)
+            if os.path.exists(caminho_parte):
+                os.remove(caminho_parte)
+            with _sessoes_upload_lock:
+                _sessoes_upload_locks.pop(upload_id, None)
+    
+    flash('Documento enviado com sucesso!', 'success')
+    return jsonify({'upload_id': upload_id, 'recebido': total, 'tamanho': total, 'documento_id': documento_id}), 201
+
 @app.route('/download-documento/<int:doc_id>')
 def download_documento(doc_id):
     try:
         conn = get_db()
         cursor = conn.cursor()
-        cursor.execute('SELECT nome_arquivo, nome_original FROM documentos WHERE id=?', (doc_id,))
+        cursor.execute('''
+            SELECT nome_arquivo, nome_original, hash_conteudo, compressao, tamanho FROM documentos WHERE id=?
+        ''', (doc_id,))
         documento = cursor.fetchone()
         
         if not documento:
             flash('Documento não encontrado!', 'error')
             return redirect(url_for('index'))
         
-        caminho_arquivo = os.path.join(app.config['UPLOAD_FOLDER'], documento[0])
+        hash_conteudo = documento[2]
+        compressao = documento[3]
+        extensao = documento[1].rsplit('.', 1)[-1].lower()
+        inline = request.args.get('inline') == '1' and extensao in EXTENSOES_VISUALIZACAO
+        # Arquivo guardado em gzip vai como está se o cliente aceitar; senão é descomprimido no envio
+        repassar_gzip = compressao == 'gzip' and request.accept_encodings['gzip'] > 0
+        etag = f'{hash_conteudo}-gzip' if hash_conteudo and repassar_gzip else hash_conteudo
+        
+        # O hash do conteúdo é um ETag forte: se o navegador já tem o arquivo, nem abre o disco
+        if etag and request.if_none_match.contains(etag):
+            response = make_response('', 304)
+            response.set_etag(etag)
+            response.cache_control.private = True
+            response.cache_control.no_cache = True
+            if compressao:
+                response.vary.add('Accept-Encoding')
+            return response
+        
+        caminho_arquivo = os.path.join(pasta_uploads(), documento[0])
         
         if os.path.exists(caminho_arquivo):
-            return send_file(caminho_arquivo, as_attachment=True, download_name=documento[1])
+            if compressao and not repassar_gzip:
+                # Sem Range aqui: o deslocamento no conteúdo original exigiria descomprimir até ele
+                response = send_file(abrir_documento(documento[0], compressao), as_attachment=not inline,
+                                     download_name=documento[1], etag=etag or False, conditional=True)
+                response.content_length = documento[4]
+                response.headers['Accept-Ranges'] = 'none'
+            else:
+                # send_file responde a Range/If-None-Match. O waitress não usa sendfile: o wsgi.file_wrapper
+                # é lido em blocos e copiado pelos buffers dele. Envio sem cópia só com um proxy na frente
+                # (CLINICA_X_SENDFILE=1 liga o USE_X_SENDFILE e o arquivo sai pelo proxy, não pelo Python)
+                response = send_file(caminho_arquivo, as_attachment=not inline, download_name=documento[1],
+                                     etag=etag or True, conditional=True)
+                if repassar_gzip:
+                    response.content_encoding = 'gzip'
+            if compressao:
+                response.vary.add('Accept-Encoding')
+            response.cache_control.private = True
+            response.headers['X-Content-Type-Options'] = 'nosniff'
+            return response
         else:
             flash('Arquivo não encontrado no servidor!', 'error')
             return redirect(url_for('index'))
@@ -741,13 +2760,17 @@ def deletar_documento(doc_id):
             return redirect(url_for('index'))
         
         cliente_id = documento[1]
-        caminho_arquivo = os.path.join(app.config['UPLOAD_FOLDER'], documento[0])
         
-        cursor.execute('DELETE FROM documentos WHERE id=?', (doc_id,))
-        conn.commit()
+        def remover(cursor):
+            cursor.execute('DELETE FROM documentos WHERE id=?', (doc_id,))
+            # Arquivos por conteúdo podem ser compartilhados: só devolve o blob se ficou sem referências
+            cursor.execute('SELECT 1 FROM documentos WHERE nome_arquivo=? LIMIT 1', (documento[0],))
+            return None if cursor.fetchone() else documento[0]
         
-        if os.path.exists(caminho_arquivo):
-            os.remove(caminho_arquivo)
+        orfao = executar_escrita(remover)
+        if orfao:
+            remover_blob_sem_referencias(orfao, unidade_atual())
+        cache_paginas.invalidar(cliente_id)
         
         flash('Documento removido com sucesso!', 'success')
         return redirect(url_for('ver_cliente', cliente_id=cliente_id))
@@ -755,7 +2778,782 @@ def deletar_documento(doc_id):
         flash(f'Erro ao deletar documento: {str(e)}', 'error')
         return redirect(url_for('index'))
 
+# API JSON (v1): recursos planos, paginação por id (?apos=), campos esparsos (?fields=),
+# busca em lote (?ids=1,2,3) e filtro pelo pai (?cliente_id= / ?ficha_id=)
+try:
+    import orjson
+    
+    def codificar_json(dados):
+        return orjson.dumps(dados)
+except ImportError:
+    _codificador_json = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+    
+    def codificar_json(dados):
+        return _codificador_json.encode(dados).encode('utf-8')
+
+RECURSOS_API = {
+    'clientes': {'campos': ['id', 'nome', 'cpf', 'email', 'telefone'], 'filtros': []},
+    'fichas': {'campos': ['id', 'cliente_id', 'data_entrada', 'data_saida', 'observacoes', 'created_at'],
+               'filtros': ['cliente_id']},
+    'medicamentos': {'campos': ['id', 'ficha_id', 'nome', 'dosagem', 'frequencia', 'observacoes'],
+                     'filtros': ['ficha_id']},
+    'familiares': {'campos': ['id', 'cliente_id', 'nome', 'parentesco', 'telefone', 'email', 'endereco', 'observacoes'],
+                   'filtros': ['cliente_id']},
+    'documentos': {'campos': ['id', 'cliente_id', 'nome_original', 'tipo_documento', 'tamanho', 'data_upload',
+                              'observacoes', 'hash_conteudo'],
+                   'filtros': ['cliente_id']},
+}
+
+class ErroAPI(Exception):
+    def __init__(self, mensagem, status=400):
+        super().__init__(mensagem)
+        self.status = status
+
+def resposta_api(dados, status=200):
+    return Response(codificar_json(dados), status=status, mimetype='application/json')
+
+def _inteiro_api(nome, valor):
+    try:
+        return int(valor)
+    except (TypeError, ValueError):
+        raise ErroAPI(f'{nome} deve ser um número inteiro')
+
+def campos_api(recurso):
+    """Colunas pedidas em ?fields= (sempre com id), validadas contra a lista do recurso"""
+    disponiveis = RECURSOS_API[recurso]['campos']
+    pedidos = [campo.strip() for campo in request.args.get('fields', '').split(',') if campo.strip()]
+    if not pedidos:
+        return disponiveis
+    invalidos = [campo for campo in pedidos if campo not in disponiveis]
+    if invalidos:
+        raise ErroAPI(f"Campos desconhecidos: {', '.join(invalidos)}")
+    return ['id'] + [campo for campo in pedidos if campo != 'id']
+
+@app.errorhandler(ErroAPI)
+def tratar_erro_api(erro):
+    return resposta_api({'erro': str(erro)}, erro.status)
+
+@app.route('/api/v1/<recurso>')
+def api_listar(recurso):
+    if recurso not in RECURSOS_API:
+        raise ErroAPI('Recurso não encontrado', 404)
+    campos = campos_api(recurso)
+    colunas = ', '.join(campos)
+    cursor = get_db().cursor()
+    
+    if 'ids' in request.args:
+        ids = [_inteiro_api('ids', i) for i in request.args['ids'].split(',') if i.strip()]
+        if len(ids) > app.config['API_IDS_MAXIMO']:
+            raise ErroAPI(f"No máximo {app.config['API_IDS_MAXIMO']} ids por requisição")
+        marcadores = ', '.join('?' * len(ids))
+        cursor.execute(f'SELECT {colunas} FROM {recurso} WHERE id IN ({marcadores}) ORDER BY id', ids)
+        dados = [dict(zip(campos, linha)) for linha in cursor.fetchall()]
+        encontrados = {item['id'] for item in dados}
+        return resposta_api({'dados': dados, 'nao_encontrados': [i for i in ids if i not in encontrados]})
+    
+    limite = min(_inteiro_api('limite', request.args.get('limite', app.config['API_LIMITE_PADRAO'])),
+                 app.config['API_LIMITE_MAXIMO'])
+    if limite < 1:
+        raise ErroAPI('limite deve ser positivo')
+    condicoes = ['id > ?']
+    params = [_inteiro_api('apos', request.args.get('apos', 0))]
+    for filtro in RECURSOS_API[recurso]['filtros']:
+        if filtro in request.args:
+            condicoes.append(f'{filtro} = ?')
+            params.append(_inteiro_api(filtro, request.args[filtro]))
+    
+    # Busca um a mais para saber se há próxima página sem um COUNT(*)
+    cursor.execute(f'''
+        SELECT {colunas} FROM {recurso} WHERE {' AND '.join(condicoes)} ORDER BY id LIMIT ?
+    ''', params + [limite + 1])
+    
+    def gerar():
+        yield b'{"dados":['
+        enviados = 0
+        ultimo = None
+        while enviados < limite:
+            linhas = cursor.fetchmany(min(app.config['EXPORTACAO_LOTE'], limite - enviados))
+            if not linhas:
+                break
+            bloco = b','.join(codificar_json(dict(zip(campos, linha))) for linha in linhas)
+            yield (b',' if enviados else b'') + bloco
+            enviados += len(linhas)
+            ultimo = linhas[-1][0]
+        proximo = ultimo if cursor.fetchone() else None
+        cursor.close()
+        yield b'],"proximo":' + codificar_json(proximo) + b'}'
+    
+    return Response(stream_with_context(gerar()), mimetype='application/json')
+
+@app.route('/api/v1/<recurso>/<int:item_id>')
+def api_obter(recurso, item_id):
+    if recurso not in RECURSOS_API:
+        raise ErroAPI('Recurso não encontrado', 404)
+    campos = campos_api(recurso)
+    cursor = get_db().cursor()
+    cursor.execute(f"SELECT {', '.join(campos)} FROM {recurso} WHERE id=?", (item_id,))
+    linha = cursor.fetchone()
+    if not linha:
+        raise ErroAPI('Registro não encontrado', 404)
+    return resposta_api(dict(zip(campos, linha)))
+
+# Relatórios de ocupação: cada mês é agregado no SQLite (contagens de entradas e saídas por dia,
+# acumuladas como uma varredura +1/-1 em Python) e guardado em cache. Um período junta os meses do cache e
+# só calcula os que faltam; quando uma ficha muda, só os meses que ela cruza são descartados.
+_CONTAR_ANTES = '''
+    SELECT (SELECT COUNT(*) FROM fichas WHERE dia_entrada < :inicio)
+         - (SELECT COUNT(*) FROM fichas WHERE dia_saida < :inicio)
+'''
+
+_ENTRADAS_POR_DIA = '''
+    SELECT dia_entrada, COUNT(*) FROM fichas WHERE dia_entrada BETWEEN :inicio AND :fim GROUP BY dia_entrada
+'''
+
+_SAIDAS_POR_DIA = '''
+    SELECT dia_saida, COUNT(*) FROM fichas WHERE dia_saida BETWEEN :inicio AND :fim GROUP BY dia_saida
+'''
+
+# Readmissão: outra internação do mesmo paciente começando até READMISSAO_DIAS após a alta
+_ALTAS_POR_MES = '''
+    SELECT substr(f.data_saida, 1, 7), COUNT(*),
+           SUM(f.dia_saida - f.dia_entrada),
+           SUM(EXISTS (
+               SELECT 1 FROM fichas p
+               WHERE p.cliente_id = f.cliente_id AND p.id <> f.id
+                 AND p.dia_entrada BETWEEN f.dia_saida AND f.dia_saida + :readmissao
+           ))
+    FROM fichas f
+    WHERE f.dia_saida BETWEEN :inicio AND :fim
+    GROUP BY 1
+'''
+
+# Prescrições por medicamento: ativas no início do período e que entram/saem em cada mês
+_MEDICAMENTOS_ANTES = '''
+    SELECT lower(trim(m.nome)), COUNT(*)
+    FROM fichas f JOIN medicamentos m ON m.ficha_id = f.id
+    WHERE f.dia_entrada < :inicio AND (f.dia_saida >= :inicio OR f.data_saida IS NULL)
+    GROUP BY 1
+'''
+
+# Uma passada só pela junção fichas x medicamentos: o mês de entrada e o de saída vêm na mesma linha
+# (NULL quando caem fora do período)
+_MEDICAMENTOS_EVENTOS = '''
+    SELECT lower(trim(m.nome)),
+           CASE WHEN f.dia_entrada BETWEEN :inicio AND :fim THEN substr(f.data_entrada, 1, 7) END,
+           CASE WHEN f.dia_saida BETWEEN :inicio AND :fim THEN substr(f.data_saida, 1, 7) END,
+           COUNT(*)
+    FROM fichas f JOIN medicamentos m ON m.ficha_id = f.id
+    WHERE f.dia_entrada BETWEEN :inicio AND :fim OR f.dia_saida BETWEEN :inicio AND :fim
+    GROUP BY 1, 2, 3
+'''
+
+def _mes_seguinte(mes):
+    return date(mes.year + mes.month // 12, mes.month % 12 + 1, 1)
+
+def _mes_anterior(mes):
+    return (mes - timedelta(days=1)).replace(day=1)
+
+def meses_periodo(inicio, fim):
+    meses = []
+    mes = inicio.replace(day=1)
+    while mes <= fim:
+        meses.append(mes)
+        mes = _mes_seguinte(mes)
+    return meses
+
+def calcular_meses(cursor, meses, anterior=None):
+    """Agrega ocupação diária, altas, permanência, readmissões e prescrições dos meses (contíguos) dados.
+    
+    Com o resumo do mês anterior, a varredura continua dos totais dele e só lê os eventos do período.
+    """
+    hoje = date.today()
+    inicio, fim = meses[0], _mes_seguinte(meses[-1]) - timedelta(days=1)
+    params = {'inicio': dia_epoca(inicio.isoformat()), 'fim': dia_epoca(fim.isoformat()),
+              'readmissao': app.config['READMISSAO_DIAS']}
+    
+    if anterior:
+        ocupados = anterior['ocupados_fim']
+        prescricoes = dict(anterior['prescricoes_fim'])
+    else:
+        ocupados = cursor.execute(_CONTAR_ANTES, params).fetchone()[0]
+        prescricoes = dict(cursor.execute(_MEDICAMENTOS_ANTES, params).fetchall())
+    
+    # Ocupação no dia d = entradas até d - saídas até d (o dia da alta já não conta)
+    deltas = {}
+    for dia, quantidade in cursor.execute(_ENTRADAS_POR_DIA, params).fetchall():
+        deltas[dia] = deltas.get(dia, 0) + quantidade
+    for dia, quantidade in cursor.execute(_SAIDAS_POR_DIA, params).fetchall():
+        deltas[dia] = deltas.get(dia, 0) - quantidade
+    
+    entradas_medicamentos, saidas_medicamentos = {}, {}
+    for chave, mes_entrada, mes_saida, quantidade in cursor.execute(_MEDICAMENTOS_EVENTOS, params).fetchall():
+        if mes_entrada:
+            por_chave = entradas_medicamentos.setdefault(mes_entrada, {})
+            por_chave[chave] = por_chave.get(chave, 0) + quantidade
+        if mes_saida:
+            por_chave = saidas_medicamentos.setdefault(mes_saida, {})
+            por_chave[chave] = por_chave.get(chave, 0) + quantidade
+    
+    resumos = {}
+    for mes in meses:
+        ocupacao = []
+        dia = mes
+        while dia.month == mes.month:
+            ocupados += deltas.get(dia.toordinal() - EPOCA, 0)
+            # Fichas ativas não contam para dias que ainda não chegaram
+            if dia <= hoje:
+                ocupacao.append(ocupados)
+            dia += timedelta(days=1)
+        
+        # Uma prescrição conta em todo mês em que a ficha esteve aberta, inclusive o da alta
+        chave_mes = mes.strftime('%Y-%m')
+        for chave, quantidade in entradas_medicamentos.get(chave_mes, {}).items():
+            prescricoes[chave] = prescricoes.get(chave, 0) + quantidade
+        uso = {chave: quantidade for chave, quantidade in prescricoes.items() if quantidade}
+        for chave, quantidade in saidas_medicamentos.get(chave_mes, {}).items():
+            prescricoes[chave] = prescricoes.get(chave, 0) - quantidade
+        
+        resumos[mes] = {
+            'ocupacao': ocupacao,
+            'altas': 0,
+            'permanencia_total': 0.0,
+            'readmissoes': 0,
+            'medicamentos': uso,
+            'ocupados_fim': ocupados,
+            'prescricoes_fim': {chave: quantidade for chave, quantidade in prescricoes.items() if quantidade},
+        }
+    
+    for mes, altas, permanencia, readmissoes in cursor.execute(_ALTAS_POR_MES, params).fetchall():
+        resumo = resumos[date(int(mes[:4]), int(mes[5:7]), 1)]
+        resumo.update(altas=altas, permanencia_total=permanencia or 0.0, readmissoes=readmissoes)
+    
+    return resumos
+
+def montar_relatorio(inicio, fim, resumos):
+    meses = meses_periodo(inicio, fim)
+    dias, ocupacao, por_mes, uso = [], [], [], {}
+    for n, mes in enumerate(meses):
+        resumo = resumos[mes]
+        dias.extend((mes + timedelta(days=d)).isoformat() for d in range(len(resumo['ocupacao'])))
+        ocupacao.extend(resumo['ocupacao'])
+        altas, readmissoes = resumo['altas'], resumo['readmissoes']
+        por_mes.append({
+            'mes': mes.strftime('%Y-%m'),
+            'altas': altas,
+            'permanencia_media': round(resumo['permanencia_total'] / altas, 1) if altas else None,
+            'readmissoes': readmissoes,
+            'taxa_readmissao': round(100 * readmissoes / altas, 1) if altas else None,
+        })
+        for chave, quantidade in resumo['medicamentos'].items():
+            uso.setdefault(chave, [0] * len(meses))[n] = quantidade
+    principais = sorted(uso, key=lambda chave: -sum(uso[chave]))[:app.config['RELATORIOS_MEDICAMENTOS']]
+    
+    return {
+        'inicio': inicio.isoformat(),
+        'fim': fim.isoformat(),
+        'dias': dias,
+        'ocupacao': ocupacao,
+        'ocupacao_media': round(sum(ocupacao) / len(ocupacao), 1) if ocupacao else 0,
+        'ocupacao_pico': max(ocupacao, default=0),
+        'meses': por_mes,
+        'medicamentos': [{'nome': chave.capitalize(), 'uso': uso[chave]} for chave in sorted(principais)],
+    }
+
+_relatorios_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='relatorios')
+
+class CacheRelatorios:
+    """Resumos mensais calculados, descartados só nos meses que uma ficha alterada cruza.
+    
+    Depois de cada invalidação (e ao iniciar o sistema) os meses com fichas são recalculados em segundo
+    plano: uma internação retroativa ou um lote importado não deixam a conta de anos para o próximo acesso.
+    """
+    def __init__(self, unidade):
+        self._banco = caminho_unidade(unidade)
+        self._lock = threading.Lock()
+        self._meses = {}
+        self._geracao = 0
+        self._invalidacoes = deque(maxlen=256)  # (geração, desde, até) das invalidações recentes
+        self._aquecimento = None  # Future do recálculo em segundo plano, enquanto roda
+        self._aquecer_de_novo = False
+    
+    def resumos(self, cursor, meses, espera=0):
+        """Resumos dos meses (contíguos): os do cache e um cálculo só, do primeiro ao último mês faltando,
+        continuando a varredura do mês anterior quando ele está em cache"""
+        resumos, geracao = self.obter([_mes_anterior(meses[0])] + meses)
+        faltando = [mes for mes in meses if mes not in resumos]
+        if faltando and espera and self._aguardar_aquecimento(espera):
+            resumos, geracao = self.obter([_mes_anterior(meses[0])] + meses)
+            faltando = [mes for mes in meses if mes not in resumos]
+        if faltando:
+            calcular = meses[meses.index(faltando[0]):meses.index(faltando[-1]) + 1]
+            calculados = calcular_meses(cursor, calcular, resumos.get(_mes_anterior(calcular[0])))
+            self.guardar(calculados, geracao)
+            resumos.update(calculados)
+        return resumos
+    
+    def aquecer(self):
+        """Agenda o recálculo dos meses fora do cache; pedidos durante um recálculo viram mais uma passada"""
+        if not app.config['RELATORIOS_AQUECER']:
+            return
+        with self._lock:
+            self._aquecer_de_novo = True
+            if self._aquecimento is None:
+                self._aquecimento = _relatorios_pool.submit(self._aquecer)
+    
+    def _aquecer(self):
+        pool = obter_pool(self._banco, False)
+        while True:
+            with self._lock:
+                if not self._aquecer_de_novo:
+                    self._aquecimento = None
+                    return
+                self._aquecer_de_novo = False
+            try:
+                conn = pool.adquirir(timeout=app.config['POOL_TIMEOUT'])
+                try:
+                    cursor = conn.cursor()
+                    primeiro = cursor.execute('SELECT MIN(dia_entrada) FROM fichas').fetchone()[0]
+                    if primeiro is not None:
+                        self.resumos(cursor, meses_periodo(date.fromordinal(primeiro + EPOCA), date.today()))
+                    cursor.close()
+                finally:
+                    pool.devolver(conn)
+            except Exception:
+                app.logger.exception('Falha ao recalcular os relatórios de %s', rotulo_banco(self._banco))
+    
+    def _aguardar_aquecimento(self, espera):
+        """Espera o recálculo em andamento (sai mais barato que repetir a conta); False se não havia um"""
+        with self._lock:
+            aquecimento = self._aquecimento
+        if aquecimento is None:
+            return False
+        try:
+            aquecimento.result(timeout=espera)
+        except Exception:
+            pass
+        return True
+    
+    def obter(self, meses):
+        """Devolve (resumos em cache, geração); o mês corrente só vale no dia em que foi calculado"""
+        hoje = date.today()
+        with self._lock:
+            resumos = {}
+            for mes in meses:
+                guardado = self._meses.get(mes)
+                if guardado and (guardado[1] == hoje or _mes_seguinte(mes) <= guardado[1]):
+                    resumos[mes] = guardado[0]
+            return resumos, self._geracao
+    
+    def guardar(self, resumos, geracao):
+        hoje = date.today()
+        with self._lock:
+            # Invalidações feitas durante o cálculo: esses meses podem ter saído com dados velhos
+            recentes = [(desde, ate) for g, desde, ate in self._invalidacoes if g > geracao]
+            if len(recentes) < self._geracao - geracao:
+                return
+            for mes, resumo in resumos.items():
+                if not any(desde <= mes <= ate for desde, ate in recentes):
+                    self._meses[mes] = (resumo, hoje)
+    
+    def invalidar(self, data_entrada=None, data_saida=None):
+        """Descarta os meses afetados pela ficha [entrada, saída]; sem datas, descarta todos"""
+        try:
+            # A entrada também muda a readmissão de uma alta ocorrida até READMISSAO_DIAS antes
+            desde = (date.fromisoformat(data_entrada[:10]) - timedelta(days=app.config['READMISSAO_DIAS'])).replace(day=1)
+            ate = date.fromisoformat(data_saida[:10]) if data_saida else date.max
+        except (TypeError, ValueError):
+            desde, ate = date.min, date.max
+        with self._lock:
+            self._geracao += 1
+            self._invalidacoes.append((self._geracao, desde, ate))
+            for mes in [mes for mes in self._meses if desde <= mes <= ate]:
+                del self._meses[mes]
+        self.aquecer()
+    
+    def metricas(self):
+        with self._lock:
+            return {'meses': len(self._meses), 'recalculando': self._aquecimento is not None}
+
+cache_relatorios = PorUnidade(CacheRelatorios)
+
+def _ler_mes(valor):
+    if not re.fullmatch(r'\d{4}-\d{2}', valor or ''):
+        raise ValueError(valor)
+    return date(int(valor[:4]), int(valor[5:]), 1)
+
+@app.route('/relatorios')
+def relatorios():
+    hoje = date.today()
+    try:
+        mes_fim = _ler_mes(request.args.get('mes_fim') or hoje.strftime('%Y-%m'))
+        meses = mes_fim.year * 12 + mes_fim.month - app.config['RELATORIOS_MESES_PADRAO']
+        padrao = date(meses // 12, meses % 12 + 1, 1)
+        inicio = _ler_mes(request.args.get('mes_inicio') or padrao.strftime('%Y-%m'))
+    except ValueError:
+        flash('Período inválido! Use meses no formato AAAA-MM.', 'error')
+        return redirect(url_for('relatorios'))
+    if inicio > mes_fim:
+        flash('O mês inicial deve ser anterior ao final!', 'error')
+        return redirect(url_for('relatorios'))
+    fim = (mes_fim.replace(day=28) + timedelta(days=4)).replace(day=1) - timedelta(days=1)
+    
+    resumos = cache_relatorios.resumos(get_db().cursor(), meses_periodo(inicio, fim), app.config['RELATORIOS_ESPERA'])
+    relatorio = montar_relatorio(inicio, fim, resumos)
+    
+    if request.args.get('formato') == 'json':
+        return resposta_api(relatorio)
+    
+    return render_template('relatorios.html', relatorio=relatorio, mes_inicio=inicio.strftime('%Y-%m'),
+                           mes_fim=mes_fim.strftime('%Y-%m'), grafico=grafico_ocupacao(relatorio['ocupacao']))
+
+def grafico_ocupacao(ocupacao, largura=1000, altura=200):
+    """Pontos da polyline SVG da curva de ocupação"""
+    if not ocupacao:
+        return ''
+    maximo = max(max(ocupacao), 1)
+    passo = largura / max(len(ocupacao) - 1, 1)
+    return ' '.join(f'{i * passo:.1f},{altura - valor * altura / maximo:.1f}' for i, valor in enumerate(ocupacao))
+
+# Visão combinada das unidades: censo e busca consultam todos os bancos em paralelo
+_CENSO = 'SELECT total_clientes, fichas_ativas, fichas_finalizadas FROM estatisticas WHERE id = 1'
+
+@app.route('/unidades')
+def visao_unidades():
+    busca = request.args.get('busca', '').strip()
+    expressao = expressao_busca(busca)
+    limite = app.config['UNIDADES_BUSCA_LIMITE']
+    
+    def consultar(cursor):
+        total, ativos, finalizados = cursor.execute(_CENSO).fetchone()
+        pacientes = []
+        if expressao:
+            cursor.execute(f'''
+                SELECT c.id, c.nome, c.cpf, c.telefone, bm25(busca_clientes, {PESOS_BUSCA}) AS relevancia
+                FROM busca_clientes
+                JOIN clientes c ON c.id = busca_clientes.rowid
+                WHERE busca_clientes MATCH ?
+                ORDER BY relevancia, c.id DESC LIMIT ?
+            ''', (expressao, limite))
+            pacientes = [dict(row) for row in cursor.fetchall()]
+        return {'total': total, 'ativos': ativos, 'finalizados': finalizados, 'pacientes': pacientes}
+    
+    nomes = listar_unidades()
+    try:
+        por_unidade = consultar_unidades(consultar)
+    except Exception as e:
+        flash(f'Erro ao consultar as unidades: {str(e)}', 'error')
+        por_unidade = {}
+    
+    unidades = [{'unidade': unidade, 'nome': nomes[unidade], 'total': resultado['total'], 'ativos': resultado['ativos'],
+                 'finalizados': resultado['finalizados'], 'encontrados': len(resultado['pacientes'])}
+                for unidade, resultado in por_unidade.items()]
+    # Cada unidade já devolve os seus melhores; a mescla pega os melhores do conjunto (bm25 menor = mais relevante)
+    pacientes = sorted(
+        (dict(paciente, unidade=unidade, nome_unidade=nomes[unidade])
+         for unidade, resultado in por_unidade.items() for paciente in resultado['pacientes']),
+        key=lambda paciente: paciente['relevancia'],
+    )[:limite]
+    totais = {campo: sum(unidade[campo] for unidade in unidades) for campo in ('total', 'ativos', 'finalizados')}
+    
+    if request.args.get('formato') == 'json':
+        return resposta_api({'unidades': unidades, 'totais': totais, 'pacientes': pacientes})
+    
+    return render_template('unidades.html', lista_unidades=unidades, totais=totais, pacientes=pacientes, busca=busca)
+
+# Manutenção: cópias de segurança pela API de backup do SQLite (sem parar o sistema) e
+# checkpoint do WAL, optimize, ANALYZE e vácuo incremental agendados para os períodos ociosos
+_NOME_BACKUP = re.compile(r'^reabilitacao-(\d{8}-\d{6})\.db$')
+
+def listar_backups(pasta):
+    """Cópias de segurança da pasta, da mais recente para a mais antiga: [(momento, caminho)]"""
+    if not os.path.isdir(pasta):
+        return []
+    copias = []
+    for nome in os.listdir(pasta):
+        encontrado = _NOME_BACKUP.match(nome)
+        if encontrado:
+            copias.append((datetime.strptime(encontrado.group(1), '%Y%m%d-%H%M%S'), os.path.join(pasta, nome)))
+    return sorted(copias, reverse=True)
+
+def podar_backups(pasta):
+    """Rotação das cópias: mantém as mais recentes, a última de cada dia e de cada semana; devolve quantas removeu"""
+    copias = listar_backups(pasta)
+    manter = {caminho for _, caminho in copias[:app.config['BACKUP_MANTER_RECENTES']]}
+    hoje = date.today()
+    dias, semanas = {}, {}
+    for momento, caminho in copias:
+        idade = (hoje - momento.date()).days
+        if idade < app.config['BACKUP_MANTER_DIARIOS']:
+            dias.setdefault(momento.date(), caminho)
+        if idade < app.config['BACKUP_MANTER_SEMANAIS'] * 7:
+            semanas.setdefault(momento.isocalendar()[:2], caminho)
+    manter |= set(dias.values()) | set(semanas.values())
+    
+    removidas = 0
+    for _, caminho in copias:
+        if caminho not in manter:
+            os.remove(caminho)
+            removidas += 1
+    
+    # Documentos copiados que nenhuma cópia mantida referencia mais
+    pasta_documentos = os.path.join(pasta, 'documentos')
+    if removidas and os.path.isdir(pasta_documentos):
+        referenciados = set()
+        for caminho in manter:
+            copia = sqlite3.connect(f'file:{caminho}?mode=ro', uri=True)
+            try:
+                referenciados.update(os.path.normpath(linha[0]) for linha in copia.execute('SELECT nome_arquivo FROM documentos'))
+            finally:
+                copia.close()
+        for raiz, _, arquivos in os.walk(pasta_documentos):
+            for nome in arquivos:
+                caminho = os.path.join(raiz, nome)
+                if os.path.relpath(caminho, pasta_documentos) not in referenciados:
+                    os.remove(caminho)
+    return removidas
+
+def pasta_backups(unidade):
+    if unidade == app.config['UNIDADE_PADRAO']:
+        return app.config['BACKUP_PASTA']
+    return os.path.join(app.config['BACKUP_PASTA'], 'unidades', unidade)
+
+def fazer_backup(unidade):
+    """Grava uma cópia consistente do banco e copia os documentos que ela referencia e ainda faltam na pasta"""
+    pasta = pasta_backups(unidade)
+    os.makedirs(pasta, exist_ok=True)
+    destino = os.path.join(pasta, datetime.now().strftime('reabilitacao-%Y%m%d-%H%M%S.db'))
+    temporario = destino + '.tmp'
+    
+    # Cópia em um passo só: em WAL a transação de leitura não bloqueia os gravadores, enquanto
+    # copiar em partes (pages=N) recomeçaria a cópia a cada escrita de outra conexão
+    origem = _conectar(caminho_unidade(unidade), somente_leitura=True)
+    copia = sqlite3.connect(temporario)
+    try:
+        origem.backup(copia)
+        copia.execute('PRAGMA journal_mode = DELETE')  # arquivo único, sem -wal ao lado
+        integridade = copia.execute('PRAGMA quick_check').fetchone()[0]
+        documentos = [linha[0] for linha in copia.execute('SELECT DISTINCT nome_arquivo FROM documentos')]
+    finally:
+        copia.close()
+        origem.close()
+    if integridade != 'ok':
+        os.remove(temporario)
+        raise RuntimeError(f'Cópia de segurança inconsistente: {integridade}')
+    os.replace(temporario, destino)
+    
+    # Documentos nunca mudam de conteúdo sob o mesmo nome: basta copiar os que ainda não estão lá
+    copiados = ausentes = 0
+    for nome_arquivo in documentos:
+        alvo = os.path.join(pasta, 'documentos', nome_arquivo)
+        if os.path.exists(alvo):
+            continue
+        original = os.path.join(pasta_uploads(unidade), nome_arquivo)
+        if not os.path.exists(original):
+            ausentes += 1  # removido depois da cópia do banco
+            continue
+        os.makedirs(os.path.dirname(alvo), exist_ok=True)
+        shutil.copy2(original, alvo + '.tmp')
+        os.replace(alvo + '.tmp', alvo)
+        copiados += 1
+    
+    return {'arquivo': destino, 'tamanho': os.path.getsize(destino), 'documentos_copiados': copiados,
+            'documentos_ausentes': ausentes, 'backups_removidos': podar_backups(pasta)}
+
+def _tamanho_wal(unidade):
+    caminho = caminho_unidade(unidade) + '-wal'
+    return os.path.getsize(caminho) if os.path.exists(caminho) else 0
+
+def _conectar_manutencao(unidade):
+    conn = _conectar(caminho_unidade(unidade))
+    conn.execute(f"PRAGMA busy_timeout = {app.config['MANUTENCAO_ESPERA_MS']}")
+    return conn
+
+def checkpoint_wal(unidade):
+    """Transfere o WAL para o banco e trunca o arquivo; se houver leitores ou gravadores ativos, fica para depois.
+    
+    O espaço recuperado é medido pelo tamanho do -wal antes e depois: as páginas que o PRAGMA informa
+    se referem ao WAL já truncado e saem sempre zeradas.
+    """
+    antes = _tamanho_wal(unidade)
+    conn = _conectar_manutencao(unidade)
+    try:
+        ocupado = conn.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchone()[0]
+    finally:
+        conn.close()
+    depois = _tamanho_wal(unidade)
+    return {'concluido': not ocupado, 'wal_antes': antes, 'wal_depois': depois, 'wal_recuperado': max(antes - depois, 0)}
+
+def otimizar_banco(unidade):
+    """PRAGMA optimize: atualiza só as estatísticas que o planejador indicar como desatualizadas"""
+    executar_escrita(lambda cursor: cursor.execute('PRAGMA optimize').fetchall(), banco=caminho_unidade(unidade))
+    return {}
+
+def analisar_banco(unidade):
+    """ANALYZE completo das tabelas e índices"""
+    executar_escrita(lambda cursor: cursor.execute('ANALYZE'), banco=caminho_unidade(unidade))
+    return {}
+
+def vacuo_incremental(unidade):
+    """Devolve ao sistema as páginas livres do banco; na primeira vez converte o arquivo para auto_vacuum incremental"""
+    conn = _conectar_manutencao(unidade)
+    try:
+        tamanho_pagina = conn.execute('PRAGMA page_size').fetchone()[0]
+        if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+            # Bancos criados antes do auto_vacuum só mudam de modo com um VACUUM completo (uma vez)
+            antes = conn.execute('PRAGMA page_count').fetchone()[0]
+            conn.execute('VACUUM')
+            paginas = antes - conn.execute('PRAGMA page_count').fetchone()[0]
+            return {'convertido': True, 'paginas_liberadas': paginas, 'bytes_liberados': paginas * tamanho_pagina}
+        livres = conn.execute('PRAGMA freelist_count').fetchone()[0]
+        paginas = min(livres, app.config['MANUTENCAO_VACUO_PAGINAS'])
+        if paginas:
+            # Um PRAGMA só, com o limite de páginas da execução; o que sobrar fica para a próxima. O execute()
+            # do sqlite3 avança o PRAGMA um passo (uma página) só, já o executescript() roda até o fim, numa
+            # transação própria que disputa a trava de escrita como o VACUUM acima (busy_timeout da manutenção)
+            conn.executescript(f'PRAGMA incremental_vacuum({paginas})')
+        paginas = livres - conn.execute('PRAGMA freelist_count').fetchone()[0]
+        return {'convertido': False, 'paginas_liberadas': paginas, 'bytes_liberados': paginas * tamanho_pagina}
+    finally:
+        conn.close()
+
+TAREFAS_MANUTENCAO = {
+    'backup': (fazer_backup, 'BACKUP_INTERVALO'),
+    'otimizar': (otimizar_banco, 'MANUTENCAO_OTIMIZAR_INTERVALO'),
+    'analyze': (analisar_banco, 'MANUTENCAO_ANALYZE_INTERVALO'),
+    'vacuo': (vacuo_incremental, 'MANUTENCAO_VACUO_INTERVALO'),
+    'checkpoint': (checkpoint_wal, 'MANUTENCAO_CHECKPOINT_INTERVALO'),  # por último: recolhe o WAL das anteriores
+}
+
+class Manutencao:
+    """Agendador das tarefas de manutenção de cada unidade, com a duração e o resultado de cada execução.
+    
+    A cópia de segurança roda no intervalo mesmo com o sistema em uso, pois não bloqueia os gravadores;
+    as demais tarefas esperam um período sem requisições e com a fila de escrita da unidade vazia.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._execucao = threading.Lock()  # uma tarefa por vez
+        self._ultimas = {}
+        self._totais = {}
+        self._ultima_atividade = time.time()
+        self._thread = None
+    
+    def registrar_atividade(self):
+        self._ultima_atividade = time.time()
+    
+    def ocioso(self, unidade):
+        if time.time() - self._ultima_atividade < app.config['MANUTENCAO_OCIOSO']:
+            return False
+        return obter_escritor(caminho_unidade(unidade)).metricas()['fila'] == 0
+    
+    def executar(self, tarefa, unidade=None):
+        """Executa uma tarefa agora na unidade (a padrão, se omitida) e devolve o registro da execução"""
+        unidade = unidade or app.config['UNIDADE_PADRAO']
+        funcao, _ = TAREFAS_MANUTENCAO[tarefa]
+        with self._execucao:
+            registro = {'tarefa': tarefa, 'unidade': unidade, 'inicio': datetime.now().isoformat(timespec='seconds'),
+                        'erro': None}
+            inicio = time.perf_counter()
+            try:
+                preparar_unidade(unidade)
+                registro.update(funcao(unidade))
+            except Exception as e:
+                app.logger.exception('Falha na manutenção (%s, unidade %s)', tarefa, unidade)
+                registro['erro'] = str(e)
+            registro['duracao_s'] = round(time.perf_counter() - inicio, 3)
+        
+        with self._lock:
+            self._ultimas[unidade, tarefa] = (time.time(), registro)
+            totais = self._totais.setdefault((unidade, tarefa), {'execucoes': 0, 'erros': 0, 'wal_recuperado': 0})
+            totais['execucoes'] += 1
+            totais['erros'] += registro['erro'] is not None
+            totais['wal_recuperado'] += registro.get('wal_recuperado', 0)
+        app.logger.info('Manutenção %s (%s) em %.3fs: %s', tarefa, unidade, registro['duracao_s'], registro)
+        return registro
+    
+    def _ultima_execucao(self, tarefa, unidade):
+        with self._lock:
+            if (unidade, tarefa) in self._ultimas:
+                return self._ultimas[unidade, tarefa][0]
+        if tarefa == 'backup':
+            # Depois de reiniciar, conta a partir da cópia mais recente já gravada
+            copias = listar_backups(pasta_backups(unidade))
+            return copias[0][0].timestamp() if copias else 0.0
+        return 0.0
+    
+    def pendentes(self):
+        agora = time.time()
+        for unidade in listar_unidades():
+            for tarefa, (_, intervalo) in TAREFAS_MANUTENCAO.items():
+                if agora - self._ultima_execucao(tarefa, unidade) < app.config[intervalo]:
+                    continue
+                if tarefa != 'backup' and not self.ocioso(unidade):
+                    continue
+                yield tarefa, unidade
+    
+    def _agendador(self):
+        while True:
+            time.sleep(app.config['MANUTENCAO_VERIFICAR'])
+            try:
+                for tarefa, unidade in self.pendentes():
+                    self.executar(tarefa, unidade)
+            except Exception:
+                app.logger.exception('Falha no agendador de manutenção')
+    
+    def iniciar(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._agendador, name='manutencao', daemon=True)
+                self._thread.start()
+    
+    def metricas(self):
+        with self._lock:
+            ultimas = dict(self._ultimas)
+            totais = {chave: dict(dados) for chave, dados in self._totais.items()}
+        unidades = {}
+        for unidade in listar_unidades():
+            unidades[unidade] = {
+                'wal_bytes': _tamanho_wal(unidade),
+                'backups': len(listar_backups(pasta_backups(unidade))),
+                'ultimas': {tarefa: registro for (dona, tarefa), (_, registro) in ultimas.items() if dona == unidade},
+                'totais': {tarefa: dados for (dona, tarefa), dados in totais.items() if dona == unidade},
+            }
+        return {
+            'agendada': self._thread is not None,
+            'ocioso_ha_s': round(time.time() - self._ultima_atividade, 1),
+            'unidades': unidades,
+        }
+
+manutencao = Manutencao()
+
+@app.cli.command('backup')
+@_opcao_unidade
+def backup_comando(unidade):
+    """Grava uma cópia de segurança do banco e dos documentos, com o sistema em uso."""
+    for unidade in _unidades_comando(unidade):
+        registro = manutencao.executar('backup', unidade)
+        if registro['erro']:
+            raise click.ClickException(f"{unidade}: {registro['erro']}")
+        click.echo(f"{registro['arquivo']} ({registro['tamanho'] / (1024 * 1024):.1f} MB) em {registro['duracao_s']}s; "
+                   f"{registro['documentos_copiados']} documentos copiados, {registro['backups_removidos']} cópias antigas removidas")
+
+@app.cli.command('manutencao')
+@_opcao_unidade
+def manutencao_comando(unidade):
+    """Executa agora o optimize, ANALYZE, vácuo incremental e checkpoint do WAL."""
+    for unidade in _unidades_comando(unidade):
+        for tarefa in TAREFAS_MANUTENCAO:
+            if tarefa == 'backup':
+                continue
+            registro = manutencao.executar(tarefa, unidade)
+            detalhes = {chave: valor for chave, valor in registro.items()
+                        if chave not in ('tarefa', 'unidade', 'inicio', 'duracao_s', 'erro')}
+            click.echo(f"{unidade} {tarefa}: {registro['duracao_s']}s {registro['erro'] or detalhes}")
+
 def abrir_navegador_fullscreen():
+    import subprocess
+    import webbrowser
+    
     chrome_path = r"C:\Program Files\Google\Chrome\Application\chrome.exe"
 
     if os.path.exists(chrome_path):
@@ -768,13 +3566,93 @@ def abrir_navegador_fullscreen():
     else:
         webbrowser.open("http://127.0.0.1:5000")
 
+def servir(host, port):
+    """Inicia o servidor: waitress (multi-thread) em produção, ou o servidor de desenvolvimento do Flask"""
+    if app.config['MANUTENCAO_AGENDADA']:
+        manutencao.iniciar()
+    if app.config['SERVIDOR'] == 'producao':
+        try:
+            from waitress import serve
+        except ImportError:
+            app.logger.warning('waitress não instalado; usando o servidor do Flask com threads')
+        else:
+            serve(app, host=host, port=port, threads=app.config['SERVIDOR_THREADS'])
+            return
+    app.run(debug=False, host=host, port=port, threaded=True)
 
-if __name__ == "__main__":
-    with app.app_context():
-        init_db()
+def configurar_log():
+    """Nível INFO ao servir; no executável sem console (stderr ausente) o log vai para clinica.log"""
+    app.logger.setLevel(os.environ.get('CLINICA_LOG_NIVEL', 'INFO'))
+    if sys.stderr is None:
+        import logging
+        from logging.handlers import RotatingFileHandler
+        arquivo = RotatingFileHandler(os.path.join(data_path, 'clinica.log'), maxBytes=5 * 1024 * 1024,
+                                      backupCount=3, encoding='utf-8')
+        arquivo.setFormatter(logging.Formatter('[%(asctime)s] %(levelname)s: %(message)s'))
+        app.logger.addHandler(arquivo)
+
+def preparar_em_segundo_plano():
+    """Migra a unidade padrão e depois as demais fora do caminho crítico: o servidor sobe em paralelo"""
+    def preparar():
+        try:
+            preparar_unidade(app.config['UNIDADE_PADRAO'])
+            marcar_etapa('banco')
+            for unidade in listar_unidades():
+                preparar_unidade(unidade)
+            marcar_etapa('unidades')
+            # Relatórios prontos antes do primeiro acesso, calculados com o sistema já atendendo
+            for unidade in listar_unidades():
+                cache_relatorios.da_unidade(unidade).aquecer()
+        except Exception:
+            app.logger.exception('Falha ao preparar os bancos das unidades')
+    
+    threading.Thread(target=preparar, name='migracoes', daemon=True).start()
+
+def abrir_navegador_quando_pronto(host, port):
+    """Abre o navegador quando a sonda /pronto responder 200 e fecha a tela de abertura do executável"""
+    def esperar():
+        import http.client
+        
+        limite = time.monotonic() + app.config['INICIALIZACAO_ESPERA']
+        escutando = False
+        while True:
+            try:
+                # http.client direto: sem proxies do sistema no caminho até o 127.0.0.1
+                conexao = http.client.HTTPConnection(host, port, timeout=1)
+                conexao.request('GET', '/pronto')
+                status = conexao.getresponse().status
+                conexao.close()
+            except OSError:
+                status = None
+            if status is not None and not escutando:
+                escutando = True
+                marcar_etapa('servidor')
+            if status == 200:
+                break
+            if time.monotonic() > limite:
+                app.logger.warning('Sistema não ficou pronto em %ss; abrindo o navegador assim mesmo',
+                                   app.config['INICIALIZACAO_ESPERA'])
+                break
+            time.sleep(0.05)
+        
+        abrir_navegador_fullscreen()
+        marcar_etapa('navegador')
+        try:
+            import pyi_splash  # só existe no executável gerado com a tela de abertura
+        except ImportError:
+            pass
+        else:
+            pyi_splash.close()
+    
+    threading.Thread(target=esperar, name='navegador', daemon=True).start()
 
-    # CHAMA O NAVEGADOR AQUI (antes de iniciar o Flask)
-    abrir_navegador_fullscreen()
+if __name__ == "__main__":
+    configurar_log()
+    marcar_etapa('importacao')
+    
+    # Migrações em segundo plano; o navegador espera o /pronto em vez de o servidor esperar o banco
+    preparar_em_segundo_plano()
+    abrir_navegador_quando_pronto("127.0.0.1", 5000)
 
     # debug deve ser False para PyInstaller
-    app.run(debug=False, host="127.0.0.1", port=5000)
+    servir(host="127.0.0.1", port=5000)
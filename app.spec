@@ -1,11 +1,18 @@
 # -*- mode: python ; coding: utf-8 -*-
+import os
+
+# CLINICA_BUILD=onedir gera a pasta dist/app/ em vez de um único app.exe: nada é descompactado
+# em _MEIPASS a cada abertura e as DLLs não passam pelo UPX, então a janela aparece bem antes.
+# A tela de abertura (static/image.png) cobre o tempo até o navegador abrir; CLINICA_SPLASH=0 a desliga.
+MODO = os.environ.get('CLINICA_BUILD', 'onefile')
+COM_SPLASH = os.environ.get('CLINICA_SPLASH', '1') == '1'
 
 
 a = Analysis(
     ['app.py'],
     pathex=[],
     binaries=[],
-    datas=[('templates', 'templates'), ('static', 'static'), ('reabilitacao.db', '.')],
+    datas=[('templates', 'templates'), ('static', 'static')],
     hiddenimports=[],
     hookspath=[],
     hooksconfig={},
@@ -16,23 +23,65 @@ a = Analysis(
 )
 pyz = PYZ(a.pure)
 
-exe = EXE(
-    pyz,
-    a.scripts,
-    a.binaries,
-    a.datas,
-    [],
-    name='app',
-    debug=False,
-    bootloader_ignore_signals=False,
-    strip=False,
-    upx=True,
-    upx_exclude=[],
-    runtime_tmpdir=None,
-    console=False,
-    disable_windowed_traceback=False,
-    argv_emulation=False,
-    target_arch=None,
-    codesign_identity=None,
-    entitlements_file=None,
-)
+splash = []
+if COM_SPLASH:
+    splash = Splash(
+        'static/image.png',
+        binaries=a.binaries,
+        datas=a.datas,
+        text_pos=None,
+        always_on_top=True,
+    )
+    splash = [splash, splash.binaries]
+
+if MODO == 'onedir':
+    exe = EXE(
+        pyz,
+        a.scripts,
+        *splash[:1],
+        [],
+        exclude_binaries=True,
+        name='app',
+        debug=False,
+        bootloader_ignore_signals=False,
+        strip=False,
+        upx=False,
+        console=False,
+        disable_windowed_traceback=False,
+        argv_emulation=False,
+        target_arch=None,
+        codesign_identity=None,
+        entitlements_file=None,
+    )
+    coll = COLLECT(
+        exe,
+        a.binaries,
+        a.datas,
+        *splash[1:],
+        strip=False,
+        upx=False,
+        upx_exclude=[],
+        name='app',
+    )
+else:
+    exe = EXE(
+        pyz,
+        a.scripts,
+        a.binaries,
+        a.datas,
+        *splash,
+        [],
+        name='app',
+        debug=False,
+        bootloader_ignore_signals=False,
+        strip=False,
+        upx=True,
+        upx_exclude=[],
+        runtime_tmpdir=None,
+        console=False,
+        disable_windowed_traceback=False,
+        argv_emulation=False,
+        target_arch=None,
+        codesign_identity=None,
+        entitlements_file=None,
+    )
@@ -0,0 +1,224 @@
+"""Benchmark das rotas principais sobre um banco sintético.
+
+Gera um reabilitacao.db temporário com o esquema real (init_db), preenche com dados
+determinísticos (semente fixa) e mede as rotas pelo test client do Flask, imprimindo
+vazão e latências p50/p95/p99 em JSON para comparar entre commits.
+
+Uso:
+    python benchmark.py --tamanhos 1000 10000 100000 --saida bench_output.txt
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+import app as clinica
+
+NOMES = ['Ana', 'Bruno', 'Carla', 'Daniel', 'Eduarda', 'Fábio', 'Gabriela', 'Hugo', 'Isabela', 'João',
+         'Karina', 'Lucas', 'Mariana', 'Nicolas', 'Olívia', 'Paulo', 'Quésia', 'Rafael', 'Sofia', 'Tiago']
+SOBRENOMES = ['Silva', 'Santos', 'Oliveira', 'Souza', 'Lima', 'Pereira', 'Ferreira', 'Costa', 'Rodrigues',
+              'Almeida', 'Nascimento', 'Gonçalves', 'Araújo', 'Ribeiro', 'Carvalho']
+MEDICAMENTOS = ['Diazepam', 'Clonazepam', 'Naltrexona', 'Dissulfiram', 'Sertralina', 'Fluoxetina',
+                'Quetiapina', 'Risperidona', 'Tiamina', 'Carbamazepina']
+PARENTESCOS = ['Mãe', 'Pai', 'Irmão', 'Irmã', 'Cônjuge', 'Filho', 'Filha', 'Tio', 'Avó']
+TIPOS_DOCUMENTO = ['RG', 'CPF', 'Laudo', 'Receita', 'Outro']
+
+
+def gerar_banco(caminho, clientes, fichas_por_cliente, semente):
+    """Cria o banco com o esquema real e insere os dados sintéticos em lotes"""
+    rng = random.Random(semente)
+    clinica.DB_PATH = caminho
+    with clinica.app.app_context():
+        clinica.init_db()
+
+    conn = clinica._conectar(caminho)
+    cursor = conn.cursor()
+    cursor.execute('BEGIN IMMEDIATE')
+
+    # O índice de busca é reconstruído no final, em uma passada, em vez de um gatilho por linha
+    for (nome,) in cursor.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' AND name LIKE 'busca_%'").fetchall():
+        cursor.execute(f'DROP TRIGGER {nome}')
+
+    inicio_periodo = date(2015, 1, 1)
+    ficha_id = 0
+    lote_clientes, lote_fichas, lote_medicamentos, lote_familiares, lote_documentos = [], [], [], [], []
+
+    def gravar_lotes():
+        cursor.executemany('INSERT INTO clientes (id, nome, cpf, email, telefone) VALUES (?, ?, ?, ?, ?)', lote_clientes)
+        cursor.executemany('''
+            INSERT INTO fichas (id, cliente_id, data_entrada, data_saida, observacoes, created_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', lote_fichas)
+        cursor.executemany('''
+            INSERT INTO medicamentos (ficha_id, nome, dosagem, frequencia, observacoes)
+            VALUES (?, ?, ?, ?, ?)
+        ''', lote_medicamentos)
+        cursor.executemany('''
+            INSERT INTO familiares (cliente_id, nome, parentesco, telefone, email, endereco, observacoes)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', lote_familiares)
+        cursor.executemany('''
+            INSERT INTO documentos (cliente_id, nome_arquivo, nome_original, tipo_documento, tamanho, observacoes)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', lote_documentos)
+        for lote in (lote_clientes, lote_fichas, lote_medicamentos, lote_familiares, lote_documentos):
+            lote.clear()
+
+    for cliente_id in range(1, clientes + 1):
+        nome = f'{rng.choice(NOMES)} {rng.choice(SOBRENOMES)} {rng.choice(SOBRENOMES)}'
+        lote_clientes.append((cliente_id, nome, f'{cliente_id:011d}', f'paciente{cliente_id}@exemplo.com',
+                              f'(11) 9{rng.randint(1000, 9999)}-{rng.randint(1000, 9999)}'))
+
+        entrada = inicio_periodo + timedelta(days=rng.randint(0, 3650))
+        for n in range(rng.randint(1, fichas_por_cliente * 2 - 1)):
+            ficha_id += 1
+            saida = entrada + timedelta(days=rng.randint(10, 180))
+            finalizada = n > 0 or rng.random() < 0.7
+            lote_fichas.append((ficha_id, cliente_id, entrada.isoformat(), saida.isoformat() if finalizada else None,
+                                'Internação para tratamento', f'{entrada.isoformat()} 10:00:00'))
+            for _ in range(rng.randint(0, 4)):
+                lote_medicamentos.append((ficha_id, rng.choice(MEDICAMENTOS), f'{rng.choice([5, 10, 25, 50])}mg',
+                                          f'{rng.randint(1, 3)}x ao dia', ''))
+            entrada = saida + timedelta(days=rng.randint(30, 400))
+
+        for _ in range(rng.randint(0, 3)):
+            lote_familiares.append((cliente_id, f'{rng.choice(NOMES)} {rng.choice(SOBRENOMES)}', rng.choice(PARENTESCOS),
+                                    f'(11) 9{rng.randint(1000, 9999)}-{rng.randint(1000, 9999)}', '', '', ''))
+        for _ in range(rng.randint(0, 2)):
+            lote_documentos.append((cliente_id, f'cliente_{cliente_id}_{rng.randint(0, 10**9)}.pdf', 'documento.pdf',
+                                    rng.choice(TIPOS_DOCUMENTO), rng.randint(10_000, 5_000_000), ''))
+
+        if len(lote_clientes) >= 5000:
+            gravar_lotes()
+
+    gravar_lotes()
+    clinica._migracao_busca(cursor)
+    cursor.execute(clinica._RECALCULAR_ESTATISTICAS)
+    conn.commit()
+    cursor.execute('ANALYZE')
+    conn.close()
+
+
+def percentis(latencias):
+    ordenadas = sorted(latencias)
+
+    def p(fracao):
+        return round(ordenadas[min(len(ordenadas) - 1, int(len(ordenadas) * fracao))] * 1000, 3)
+
+    return {'p50_ms': p(0.50), 'p95_ms': p(0.95), 'p99_ms': p(0.99), 'media_ms': round(statistics.mean(ordenadas) * 1000, 3)}
+
+
+def medir(nome, requisicao, esperado, quantidade, concorrencia):
+    """Executa a requisição `quantidade` vezes e devolve vazão e latências.
+
+    `esperado` é (status, início do Location ou None): redirecionamentos de erro (CPF repetido,
+    paciente inexistente mandando para /) interrompem a medição em vez de contar como sucesso.
+    """
+    cliente = clinica.app.test_client()
+    status_esperado, destino_esperado = esperado
+
+    def executar(i):
+        inicio = time.perf_counter()
+        resposta = requisicao(cliente, i)
+        resposta.get_data()
+        duracao = time.perf_counter() - inicio
+        destino = resposta.location or ''
+        if resposta.status_code != status_esperado or \
+                (destino_esperado is None and destino) or not destino.startswith(destino_esperado or ''):
+            obtido = ' '.join(filter(None, (str(resposta.status_code), destino)))
+            previsto = ' '.join(filter(None, (str(status_esperado), destino_esperado)))
+            raise RuntimeError(f'{nome}: HTTP {obtido} (esperado {previsto})')
+        return duracao
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concorrencia) as pool:
+        latencias = list(pool.map(executar, range(quantidade)))
+    total = time.perf_counter() - inicio
+
+    return dict(rota=nome, requisicoes=quantidade, vazao_rps=round(quantidade / total, 2), **percentis(latencias))
+
+
+def cenarios(clientes, semente):
+    """Rotas medidas como (nome, requisição, (status, início do Location esperado))"""
+    rng = random.Random(semente)
+    ids = [rng.randint(1, clientes) for _ in range(10_000)]
+    cpf_base = 90_000_000_000
+    pagina = (200, None)
+
+    return [
+        ('index', lambda c, i: c.get('/'), pagina),
+        ('index_pagina', lambda c, i: c.get(f'/?apos={ids[i % len(ids)]}'), pagina),
+        ('index_busca', lambda c, i: c.get(f'/?busca={rng.choice(SOBRENOMES)}'), pagina),
+        ('index_filtro_data', lambda c, i: c.get('/?status=ativo&data_inicio=2020-01-01&data_fim=2020-12-31'), pagina),
+        ('ver_cliente', lambda c, i: c.get(f'/cliente/{ids[i % len(ids)]}'), pagina),
+        ('editar_ficha_get', lambda c, i: c.get(f'/editar-ficha/{ids[i % len(ids)]}'), pagina),
+        ('exportar_csv', lambda c, i: c.get('/exportar-csv?data_inicio=2020-01-01&data_fim=2020-01-31'), pagina),
+        ('cadastrar', lambda c, i: c.post('/cadastrar', data={
+            'nome': 'Paciente Benchmark', 'cpf': str(cpf_base + i + clientes * 10), 'email': 'bench@exemplo.com',
+            'telefone': '(11) 90000-0000', 'data_entrada': '2024-01-01',
+            'medicamentos_data': json.dumps([{'nome': 'Tiamina', 'dosagem': '100mg', 'frequencia': '1x ao dia'}]),
+        }), (302, '/cliente/')),
+        ('nova_ficha', lambda c, i: c.post(f'/nova-ficha/{ids[i % len(ids)]}', data={
+            'data_entrada': '2024-06-01', 'data_saida': '', 'observacoes': 'Benchmark', 'medicamentos_data': '[]',
+        }), (302, '/cliente/')),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--tamanhos', type=int, nargs='+', default=[1000, 10000, 100000], help='quantidade de pacientes')
+    parser.add_argument('--fichas', type=int, default=2, help='média de fichas por paciente')
+    parser.add_argument('--requisicoes', type=int, default=200, help='requisições por rota')
+    parser.add_argument('--concorrencia', type=int, default=1, help='requisições simultâneas')
+    parser.add_argument('--semente', type=int, default=42)
+    parser.add_argument('--rotas', nargs='*', help='limita o benchmark a estas rotas')
+    parser.add_argument('--saida', help='arquivo para gravar o JSON (padrão: saída padrão)')
+    args = parser.parse_args()
+
+    clinica.app.config['SQL_LENTA_MS'] = float('inf')
+    resultados = []
+    pasta = tempfile.mkdtemp(prefix='clinica_bench_')
+    try:
+        for tamanho in args.tamanhos:
+            caminho = os.path.join(pasta, f'reabilitacao_{tamanho}.db')
+            inicio = time.perf_counter()
+            gerar_banco(caminho, tamanho, args.fichas, args.semente)
+            geracao = round(time.perf_counter() - inicio, 2)
+            print(f'{tamanho} pacientes gerados em {geracao}s', file=sys.stderr)
+
+            rotas = []
+            for nome, requisicao, esperado in cenarios(tamanho, args.semente):
+                if args.rotas and nome not in args.rotas:
+                    continue
+                rotas.append(medir(nome, requisicao, esperado, args.requisicoes, args.concorrencia))
+                print(f"  {nome}: {rotas[-1]['vazao_rps']} req/s, p99 {rotas[-1]['p99_ms']} ms", file=sys.stderr)
+
+            resultados.append({'pacientes': tamanho, 'geracao_s': geracao, 'rotas': rotas})
+    finally:
+        shutil.rmtree(pasta, ignore_errors=True)
+
+    relatorio = json.dumps({
+        'semente': args.semente,
+        'requisicoes': args.requisicoes,
+        'concorrencia': args.concorrencia,
+        'python': sys.version.split()[0],
+        'sqlite': clinica.sqlite3.sqlite_version,
+        'resultados': resultados,
+    }, indent=2, ensure_ascii=False)
+
+    if args.saida:
+        with open(args.saida, 'w', encoding='utf-8') as arquivo:
+            arquivo.write(relatorio)
+    else:
+        print(relatorio)
+
+
+if __name__ == '__main__':
+    main()
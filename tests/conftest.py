@@ -0,0 +1,25 @@
+import os
+import sys
+
+import pytest
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# O app resolve templates/ e static/ a partir da pasta atual
+os.chdir(RAIZ)
+sys.path.insert(0, RAIZ)
+
+import app as clinica
+
+
+@pytest.fixture
+def cliente_http(tmp_path, monkeypatch):
+    """Cliente de teste com banco e pastas de documentos temporários"""
+    monkeypatch.setattr(clinica, 'DB_PATH', str(tmp_path / 'reabilitacao.db'))
+    monkeypatch.setitem(clinica.app.config, 'TESTING', True)
+    monkeypatch.setitem(clinica.app.config, 'UPLOAD_FOLDER', str(tmp_path / 'uploads'))
+    monkeypatch.setitem(clinica.app.config, 'PASTA_PARCIAIS', str(tmp_path / 'parciais'))
+    (tmp_path / 'parciais').mkdir()
+    monkeypatch.setitem(clinica.app.config, 'UNIDADES_PASTA', str(tmp_path / 'unidades'))
+    # Sem recálculo de relatórios em segundo plano: cada teste controla quando o cache é preenchido
+    monkeypatch.setitem(clinica.app.config, 'RELATORIOS_AQUECER', False)
+    return clinica.app.test_client()
@@ -0,0 +1,57 @@
+import json
+import sqlite3
+
+import app as clinica
+
+
+def cadastrar(cliente_http, nome, cpf):
+    resposta = cliente_http.post('/cadastrar', data={
+        'nome': nome, 'cpf': cpf, 'email': f'{cpf}@clinica.com', 'telefone': '1199999999',
+        'data_entrada': '2024-01-01', 'data_saida': '',
+        'medicamentos_data': json.dumps([{'nome': 'Dipirona', 'dosagem': '500mg', 'frequencia': '8/8h'}]),
+        'familiares_data': json.dumps([{'nome': 'Teresa Quintela', 'parentesco': 'Mãe'}]),
+    })
+    assert resposta.status_code == 302
+    return int(resposta.location.rsplit('/', 1)[1])
+
+
+def buscar(termos):
+    conn = sqlite3.connect(clinica.DB_PATH)
+    try:
+        return [row[0] for row in conn.execute(
+            'SELECT rowid FROM busca_clientes WHERE busca_clientes MATCH ? ORDER BY rowid',
+            (clinica.expressao_busca(termos),))]
+    finally:
+        conn.close()
+
+
+def test_edicao_atualiza_o_indice(cliente_http):
+    cliente_id = cadastrar(cliente_http, 'Joaquim Barbosa', '11111111111')
+    outro_id = cadastrar(cliente_http, 'Joaquim Pereira', '22222222222')
+    assert buscar('barbosa') == [cliente_id]
+    assert buscar('dipirona') == [cliente_id, outro_id]
+
+    resposta = cliente_http.post(f'/editar/{cliente_id}', data={
+        'nome': 'Joaquim Albuquerque', 'email': 'joaquim@clinica.com', 'telefone': '1199999999',
+        'familiares_data': json.dumps([{'nome': 'Rosa Quintela', 'parentesco': 'Irmã'}]),
+    })
+    assert resposta.status_code == 302
+
+    assert buscar('barbosa') == []
+    assert buscar('albuquerque') == [cliente_id]
+    assert buscar('joaquim') == [cliente_id, outro_id]
+    assert buscar('teresa') == [outro_id]
+    assert buscar('rosa') == [cliente_id]
+
+
+def test_exclusao_remove_do_indice(cliente_http):
+    cliente_id = cadastrar(cliente_http, 'Joaquim Barbosa', '11111111111')
+    outro_id = cadastrar(cliente_http, 'Joaquim Pereira', '22222222222')
+
+    assert cliente_http.get(f'/deletar/{cliente_id}').status_code == 302
+
+    assert buscar('barbosa') == []
+    assert buscar('joaquim') == [outro_id]
+    assert buscar('dipirona') == [outro_id]
+    pagina = cliente_http.get('/?busca=joaquim').data
+    assert b'Pereira' in pagina and b'Barbosa' not in pagina
@@ -0,0 +1,91 @@
+import sqlite3
+from datetime import date
+
+import app as clinica
+
+MESES_2023 = [date(2023, mes, 1) for mes in range(1, 13)]
+
+
+def novo_cache():
+    with clinica.app.app_context():
+        return clinica.CacheRelatorios(clinica.app.config['UNIDADE_PADRAO'])
+
+
+def preenchido():
+    cache = novo_cache()
+    _, geracao = cache.obter(MESES_2023)
+    cache.guardar({mes: {'mes': mes} for mes in MESES_2023}, geracao)
+    return cache
+
+
+def em_cache(cache):
+    with clinica.app.app_context():
+        return sorted(cache.obter(MESES_2023)[0])
+
+
+def test_invalidar_descarta_so_os_meses_da_ficha(cliente_http):
+    cache = preenchido()
+
+    with clinica.app.app_context():
+        cache.invalidar('2023-06-15', '2023-08-10')
+
+    # A entrada também vale para a readmissão de altas até 30 dias antes: maio sai junto
+    assert em_cache(cache) == MESES_2023[:4] + MESES_2023[8:]
+
+
+def test_invalidar_ficha_ativa_ou_sem_datas(cliente_http):
+    cache = preenchido()
+    with clinica.app.app_context():
+        cache.invalidar('2023-10-20', None)
+    assert em_cache(cache) == MESES_2023[:8]
+
+    with clinica.app.app_context():
+        cache.invalidar()
+    assert em_cache(cache) == []
+
+
+def test_guardar_ignora_meses_invalidados_durante_o_calculo(cliente_http):
+    """Um cálculo que começou antes de uma invalidação não grava os meses que ela atingiu"""
+    cache = novo_cache()
+    with clinica.app.app_context():
+        _, geracao = cache.obter(MESES_2023)
+        cache.invalidar('2023-06-15', '2023-06-20')
+        cache.guardar({mes: {'mes': mes} for mes in MESES_2023}, geracao)
+
+    assert em_cache(cache) == MESES_2023[:4] + MESES_2023[6:]
+
+
+def test_guardar_descarta_tudo_sem_o_historico_das_invalidacoes(cliente_http):
+    """Com mais invalidações do que o histórico guarda, não há como saber os meses atingidos"""
+    cache = novo_cache()
+    with clinica.app.app_context():
+        _, geracao = cache.obter(MESES_2023)
+        for _ in range(300):
+            cache.invalidar('2020-01-01', '2020-01-02')
+        cache.guardar({mes: {'mes': mes} for mes in MESES_2023}, geracao)
+
+    assert em_cache(cache) == []
+
+
+def test_cadastro_invalida_o_mes_da_internacao(cliente_http):
+    def cadastrar(cpf):
+        resposta = cliente_http.post('/cadastrar', data={
+            'nome': f'Paciente {cpf}', 'cpf': cpf, 'email': f'{cpf}@clinica.com', 'telefone': '1199999999',
+            'data_entrada': '2023-03-01', 'data_saida': '2023-03-10',
+            'medicamentos_data': '[]', 'familiares_data': '[]',
+        })
+        assert resposta.status_code == 302
+
+    def altas_em_marco():
+        conn = sqlite3.connect(clinica.DB_PATH)
+        try:
+            with clinica.app.app_context():
+                cache = clinica.cache_relatorios.da_unidade(clinica.app.config['UNIDADE_PADRAO'])
+                return cache.resumos(conn.cursor(), [date(2023, 3, 1)])[date(2023, 3, 1)]['altas']
+        finally:
+            conn.close()
+
+    cadastrar('11111111111')
+    assert altas_em_marco() == 1
+    cadastrar('22222222222')
+    assert altas_em_marco() == 2
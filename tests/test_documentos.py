@@ -0,0 +1,66 @@
+import io
+import os
+import sqlite3
+
+import app as clinica
+
+
+def cadastrar(cliente_http, cpf):
+    resposta = cliente_http.post('/cadastrar', data={
+        'nome': f'Paciente {cpf}', 'cpf': cpf, 'email': f'{cpf}@clinica.com', 'telefone': '1199999999',
+        'data_entrada': '2024-01-01', 'data_saida': '', 'medicamentos_data': '[]', 'familiares_data': '[]',
+    })
+    assert resposta.status_code == 302
+    return int(resposta.location.rsplit('/', 1)[1])
+
+
+def enviar(cliente_http, cliente_id, conteudo, nome='laudo.txt'):
+    resposta = cliente_http.post(f'/upload-documento/{cliente_id}', data={
+        'arquivo': (io.BytesIO(conteudo), nome), 'tipo_documento': 'Laudo', 'observacoes_doc': '',
+    })
+    assert resposta.status_code == 302
+
+
+def documentos():
+    conn = sqlite3.connect(clinica.DB_PATH)
+    try:
+        return conn.execute('SELECT id, cliente_id, nome_arquivo FROM documentos ORDER BY id').fetchall()
+    finally:
+        conn.close()
+
+
+def blob(nome_arquivo):
+    return os.path.join(clinica.app.config['UPLOAD_FOLDER'], nome_arquivo)
+
+
+def test_blob_compartilhado_sai_com_a_ultima_referencia(cliente_http):
+    primeiro = cadastrar(cliente_http, '11111111111')
+    segundo = cadastrar(cliente_http, '22222222222')
+    enviar(cliente_http, primeiro, b'mesmo laudo')
+    enviar(cliente_http, segundo, b'mesmo laudo', 'copia.txt')
+    enviar(cliente_http, segundo, b'outro laudo')
+
+    (doc_a, _, nome_a), (doc_b, _, nome_b), (doc_c, _, nome_c) = documentos()
+    assert nome_a == nome_b != nome_c
+    assert os.path.exists(blob(nome_a)) and os.path.exists(blob(nome_c))
+
+    assert cliente_http.get(f'/deletar-documento/{doc_a}').status_code == 302
+    assert os.path.exists(blob(nome_a))
+    resposta = cliente_http.get(f'/download-documento/{doc_b}')
+    assert resposta.status_code == 200
+    assert resposta.data == b'mesmo laudo'
+
+    assert cliente_http.get(f'/deletar-documento/{doc_b}').status_code == 302
+    assert not os.path.exists(blob(nome_a))
+    assert os.path.exists(blob(nome_c))
+    assert [doc[0] for doc in documentos()] == [doc_c]
+
+
+def test_envio_com_falha_nao_deixa_arquivo(cliente_http):
+    """Um envio para paciente inexistente (chave estrangeira) não deixa blob nem arquivo provisório"""
+    enviar(cliente_http, 999, b'laudo sem paciente')
+
+    assert documentos() == []
+    armazenados = [nome for _, _, nomes in os.walk(clinica.app.config['UPLOAD_FOLDER']) for nome in nomes]
+    assert armazenados == []
+    assert os.listdir(clinica.app.config['PASTA_PARCIAIS']) == []
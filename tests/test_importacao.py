@@ -0,0 +1,79 @@
+import io
+import json
+import sqlite3
+
+import app as clinica
+
+
+def paciente(cpf, **extra):
+    return dict({'nome': f'Paciente {cpf}', 'cpf': cpf, 'email': f'{cpf}@clinica.com', 'telefone': '1199999999',
+                 'data_entrada': '2024-01-01'}, **extra)
+
+
+def importar(cliente_http, conteudo, nome_arquivo='pacientes.json'):
+    return cliente_http.post('/importar', data={'arquivo': (io.BytesIO(conteudo.encode()), nome_arquivo)})
+
+
+def test_erros_apontados_linha_a_linha(cliente_http):
+    """Linhas inválidas voltam com o número e o motivo; as válidas do mesmo arquivo são gravadas"""
+    registros = [
+        paciente('11111111111', medicamentos=[{'nome': 'Dipirona', 'dosagem': 500}]),
+        'não é um paciente',
+        paciente('22222222222', medicamentos={'nome': 'Dipirona'}),
+        paciente('33333333333', familiares=['Ana']),
+        paciente('44444444444', familiares=[{'parentesco': 'Mãe'}]),
+        paciente('123'),
+        paciente('55555555555', data_entrada='2024-02-30'),
+        paciente('111.111.111-11'),
+        paciente('66666666666', email='sem-arroba'),
+        paciente('77777777777', familiares=[{'nome': ' Ana ', 'parentesco': 'Mãe'}]),
+    ]
+    resposta = importar(cliente_http, json.dumps(registros))
+
+    assert resposta.status_code == 200
+    relatorio = resposta.get_json()
+    assert relatorio['total'] == 10
+    assert relatorio['importados'] == 2
+    erros = {erro['linha']: erro['erro'] for erro in relatorio['erros']}
+    assert sorted(erros) == [2, 3, 4, 5, 6, 7, 8, 9]
+    assert 'não é um objeto' in erros[2]
+    assert erros[3] == 'Medicamentos inválidos: esperada uma lista'
+    assert erros[4] == 'Familiares inválidos: o item 1 não é um objeto'
+    assert erros[5] == 'Familiares inválidos: o item 1 está sem nome'
+    assert 'CPF inválido' in erros[6]
+    assert 'inválida' in erros[7]
+    assert erros[8] == 'CPF repetido no arquivo'
+    assert erros[9] == 'Email inválido!'
+
+    conn = sqlite3.connect(clinica.DB_PATH)
+    try:
+        assert conn.execute('SELECT nome, dosagem FROM medicamentos').fetchall() == [('Dipirona', '500')]
+        assert conn.execute('SELECT nome, parentesco FROM familiares').fetchall() == [('Ana', 'Mãe')]
+    finally:
+        conn.close()
+
+
+def test_cpf_ja_cadastrado(cliente_http):
+    assert importar(cliente_http, json.dumps([paciente('11111111111')])).get_json()['importados'] == 1
+
+    relatorio = importar(cliente_http, json.dumps([paciente('22222222222'), paciente('11111111111')])).get_json()
+
+    assert relatorio['importados'] == 1
+    assert relatorio['erros'] == [{'linha': 2, 'erro': 'CPF já cadastrado'}]
+
+
+def test_csv_com_lista_invalida_na_celula(cliente_http):
+    conteudo = ('nome,cpf,email,telefone,data_entrada,medicamentos\n'
+                'Ana,11111111111,ana@clinica.com,1199999999,2024-01-01,"[{""nome"": ""Dipirona""}]"\n'
+                'Bia,22222222222,bia@clinica.com,1199999999,2024-01-01,Dipirona\n')
+    relatorio = importar(cliente_http, conteudo, 'pacientes.csv').get_json()
+
+    assert relatorio['importados'] == 1
+    assert relatorio['erros'] == [{'linha': 2, 'erro': 'Medicamentos inválidos: esperada uma lista'}]
+
+
+def test_json_que_nao_e_lista(cliente_http):
+    resposta = importar(cliente_http, json.dumps({'pacientes': [paciente('11111111111')]}))
+
+    assert resposta.status_code == 400
+    assert 'lista de pacientes' in resposta.get_json()['erro']
@@ -0,0 +1,74 @@
+import json
+import sqlite3
+
+import app as clinica
+
+
+def familiar(nome, parentesco, **extra):
+    return dict({'nome': nome, 'parentesco': parentesco, 'telefone': '', 'email': '', 'endereco': '',
+                 'observacoes': ''}, **extra)
+
+
+def cadastrar(cliente_http, familiares):
+    resposta = cliente_http.post('/cadastrar', data={
+        'nome': 'Paciente Familiares', 'cpf': '33333333333', 'email': 'familia@clinica.com', 'telefone': '1199999999',
+        'data_entrada': '2024-01-01', 'data_saida': '',
+        'medicamentos_data': '[]', 'familiares_data': json.dumps(familiares),
+    })
+    assert resposta.status_code == 302
+    return int(resposta.location.rsplit('/', 1)[1])
+
+
+def editar(cliente_http, cliente_id, familiares):
+    resposta = cliente_http.post(f'/editar/{cliente_id}', data={
+        'nome': 'Paciente Familiares', 'email': 'familia@clinica.com', 'telefone': '1199999999',
+        'familiares_data': json.dumps(familiares),
+    })
+    assert resposta.status_code == 302
+    assert resposta.location == f'/cliente/{cliente_id}'
+
+
+def gravados(cliente_id):
+    conn = sqlite3.connect(clinica.DB_PATH)
+    try:
+        return {nome: (row_id, parentesco) for row_id, nome, parentesco in conn.execute(
+            'SELECT id, nome, parentesco FROM familiares WHERE cliente_id=?', (cliente_id,))}
+    finally:
+        conn.close()
+
+
+def test_edicao_aplica_so_as_diferencas(cliente_http):
+    """Linhas inalteradas e alteradas mantêm o id; as omitidas saem e as novas entram"""
+    cliente_id = cadastrar(cliente_http, [familiar('Ana', 'Mãe'), familiar('Bruno', 'Pai'), familiar('Carla', 'Irmã')])
+    antes = gravados(cliente_id)
+
+    editar(cliente_http, cliente_id, [
+        familiar('Ana', 'Mãe', id=antes['Ana'][0]),
+        familiar('Bruno', 'Padrasto', id=antes['Bruno'][0]),
+        familiar('Daniel', 'Filho'),
+    ])
+
+    depois = gravados(cliente_id)
+    assert set(depois) == {'Ana', 'Bruno', 'Daniel'}
+    assert depois['Ana'] == antes['Ana']
+    assert depois['Bruno'] == (antes['Bruno'][0], 'Padrasto')
+    assert depois['Daniel'][0] > max(row_id for row_id, _ in antes.values())
+
+
+def test_linha_sem_id_igual_a_gravada_e_mantida(cliente_http):
+    """Uma linha reenviada sem id, com o mesmo conteúdo, não é apagada e inserida de novo"""
+    cliente_id = cadastrar(cliente_http, [familiar('Ana', 'Mãe'), familiar('Bruno', 'Pai')])
+    antes = gravados(cliente_id)
+
+    editar(cliente_http, cliente_id, [familiar('Ana', 'Mãe'), familiar(' Bruno ', 'Pai')])
+
+    assert gravados(cliente_id) == antes
+
+
+def test_linhas_sem_nome_sao_ignoradas(cliente_http):
+    cliente_id = cadastrar(cliente_http, [familiar('Ana', 'Mãe')])
+    antes = gravados(cliente_id)
+
+    editar(cliente_http, cliente_id, [familiar('Ana', 'Mãe', id=antes['Ana'][0]), familiar('', 'Tio')])
+
+    assert gravados(cliente_id) == antes
@@ -0,0 +1,36 @@
+import json
+
+MEDICAMENTOS = json.dumps([
+    {'nome': 'Dipirona', 'dosagem': '500mg', 'frequencia': '8/8h'},
+    {'nome': 'Ibuprofeno', 'dosagem': '400mg', 'frequencia': '12/12h'},
+])
+
+
+def cadastrar(cliente_http, cpf):
+    resposta = cliente_http.post('/cadastrar', data={
+        'nome': f'Paciente {cpf}', 'cpf': cpf, 'email': f'{cpf}@clinica.com', 'telefone': '1199999999',
+        'data_entrada': '2024-01-01', 'data_saida': '',
+        'medicamentos_data': MEDICAMENTOS, 'familiares_data': '[]',
+    })
+    assert resposta.status_code == 302
+    assert resposta.location.startswith('/cliente/')
+    return int(resposta.location.rsplit('/', 1)[1])
+
+
+def test_consultas_nao_crescem_com_fichas(cliente_http):
+    """A página do paciente faz o mesmo número de consultas com 1 ou ~20 fichas com medicamentos"""
+    uma_ficha = cadastrar(cliente_http, '11111111111')
+    muitas_fichas = cadastrar(cliente_http, '22222222222')
+    for dia in range(2, 21):
+        resposta = cliente_http.post(f'/nova-ficha/{muitas_fichas}', data={
+            'data_entrada': f'2024-02-{dia:02d}', 'data_saida': '', 'observacoes': '',
+            'medicamentos_data': MEDICAMENTOS,
+        })
+        assert resposta.status_code == 302
+
+    # Primeira visita de cada paciente: página renderizada, sem passar pelo cache de páginas
+    pequena = cliente_http.get(f'/cliente/{uma_ficha}')
+    grande = cliente_http.get(f'/cliente/{muitas_fichas}')
+    assert pequena.status_code == grande.status_code == 200
+    assert grande.data.count(b'Ibuprofeno') >= 20
+    assert pequena.headers['X-SQL-Count'] == grande.headers['X-SQL-Count']